@@ -1,9 +1,9 @@
 "Multi-video clipping system."
 
 # Exported classes
-from .config import Config, Prefs, Subcommand
-from .error import Error
-from .job import Clip, Job, Video
+from .config import Config, Prefs, Subcommand, WriteMode
+from .error import Error, TransientError, UnsupportedError
+from .job import Clip, Job, Reel, Video
 
 # Exported modules
-from . import gen
+from . import analyze, catalog, check, encode, ffmpeg, fingerprint, gen, governor, ingest, loudness, manifest, mp4, readahead, reel, rename, scan, scheduler, serve, thumbs, time, timeline, trace
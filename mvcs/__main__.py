@@ -2,35 +2,93 @@
 
 "Create clips from OBS captures using ffmpeg and YAML."
 
+import datetime
 import sys
 from pathlib import Path
 from typing import List, Optional
 
+import yaml
+
 import mvcs
 
+def propose_clips(config: mvcs.Config, clips):
+    "Print proposed clips, or merge them into the job file with --merge."
+    if config.merge:
+        added = mvcs.gen.merge_clips(config.job_path, clips)
+        print(f"added {added} clips to {config.job_path}")
+    else:
+        yaml.safe_dump(mvcs.gen.clips_document(clips), sys.stdout)
+
+def handle_analyze(config: mvcs.Config):
+    "Handle the analyze subcommand."
+
+    job = mvcs.Job.from_yaml_file(config)
+    propose_clips(config, {
+        date: mvcs.analyze.window_entries(windows, "scene")
+        for (date, windows) in mvcs.analyze.analyze_job(config, job).items()
+    })
+
+def report_sources(config: mvcs.Config, paths: List[Path]) -> int:
+    "Report broken sources (repairing them with --repair); returns the number left broken."
+
+    broken = 0
+    for report in mvcs.scan.scan_sources(config, paths):
+        for problem in report.problems:
+            print(f"warning: broken video file: {report.path}: {problem}", file=sys.stderr)
+        if not report.problems:
+            continue
+        if config.repair:
+            try:
+                backup = mvcs.scan.repair(report.path)
+            except mvcs.Error as ex:
+                print(f"warning: cannot repair {report.path}: {ex}", file=sys.stderr)
+            else:
+                print(f"repaired {report.path} (original kept as {backup})", file=sys.stderr)
+                continue
+        broken += 1
+    return broken
+
+def preflight(config: mvcs.Config, job: mvcs.Job):
+    "Report every problem in the job, and fail if any is fatal (unless --keep-going)."
+
+    problems = mvcs.check.check_job(config, job)
+    for problem in problems:
+        print(f"{'error' if problem.fatal else 'warning'}: {problem.message}", file=sys.stderr)
+    # Scans are cached per source, so this only checks new recordings
+    sources = {video.src_path(config, job.video_dir) for video in job.videos if video.clips}
+    report_sources(config, sorted(path for path in sources if path.is_file()))
+    fatal = len([problem for problem in problems if problem.fatal])
+    if fatal and not config.keep_going:
+        raise mvcs.Error(f"{config.job_path}: {fatal} problems found")
+
+def handle_check(config: mvcs.Config):
+    "Handle the check subcommand."
+    preflight(config, mvcs.Job.from_yaml_file(config))
+
 def handle_clip(config: mvcs.Config):
     "Handle the clip subcommand."
 
-    yaml = config.job_path
+    job_path = config.job_path
 
-    mvcs.gen.check_template(yaml, config.output_dir, config.video_dir)
+    mvcs.gen.check_template(job_path, config.output_dir, config.video_dir)
     print(config.video_dir)
     print(config.video_ext)
-    # print(mvcs.gen.current_time())
-    latest = mvcs.gen.latest_video(config, mvcs.gen.current_time(), config.video_ext, config.video_dir)
-    video = mvcs.gen.add_video(
-        yaml,
-        latest,
-        0,
-        "Video"
+    # Clip windows may start before an OBS file split, or in the past with --at
+    when = config.at if config.at is not None else mvcs.gen.current_time()
+    (before, after) = (300, 30)
+    timeline = mvcs.timeline.Timeline.scan(
+      config,
+      config.video_dir,
+      when - datetime.timedelta(seconds=before),
+      when + datetime.timedelta(seconds=after),
     )
-    mvcs.gen.trigger_clip(
+    mvcs.gen.timeline_clip(
       config,
-      latest,
-      300,
-      30,
-      yaml,
-      latest,
+      timeline,
+      when,
+      before,
+      after,
+      job_path,
       "CLIP IT!",
     )
 
@@ -45,12 +103,46 @@ def handle_help(_config: mvcs.Config):
             "    mvcs [OPTIONS] [SUBCOMMAND]",
             "",
             "OPTIONS:",
+            "    --at <DATETIME>",
+            "        Wall-clock time `clip` clips around, e.g. \"2020-01-01 12:34:00\" (default: now)",
+            "    --background",
+            "        Yield to live recording: lower priority, adapt workers to load, pause while",
+            "        the newest recording is growing (thresholds: --max-load, --max-disk-queue,",
+            "        --max-pressure)",
+            "    --cache-dir <PATH>",
+            f"        Directory for cached source metadata (default: {prefs.cache_dir})",
+            "    --checksum",
+            "        Hash clips once they are written and record them in <JOB>.manifest.json",
+            "    --coalesce <SECONDS>",
+            "        Merge `clip` triggers within this many seconds of an earlier clip, 0 to",
+            f"        always add a new clip (default: {prefs.coalesce:g})",
+            "    --device-jobs <N>",
+            "        Maximum number of clips reading or writing each disk at once during",
+            f"        multi-job runs, 0 for no limit (default: {prefs.device_jobs})",
+            "    --encode-args <ARGS>",
+            f"        ffmpeg output options for re-encoding (default: {prefs.encode_args})",
             "    -h, --help",
             "        Print usage information",
             "    -i, --video-dir <PATH>",
             f"        Path to the input video directory (default: {prefs.video_dir})",
             "    -j, --job-path <PATH>",
-            f"        Path to the clipping job YAML file (default: {prefs.job_path})",
+            f"        Path to the clipping job YAML file (default: {prefs.job_path}); `run` runs",
+            "        every job given (repeat the option or use a glob) as one batch",
+            "    --keep-going",
+            "        Continue past failed clips and write them to <JOB>.failures.json",
+            "    --name-collision <number|skip|error>",
+            "        What to do when different clips render to the same output name",
+            f"        (default: {prefs.name_collision.value})",
+            "    --max-disk-queue <N>",
+            f"        Background mode: highest in-flight I/O requests per disk (default: {prefs.max_disk_queue:g})",
+            "    --max-load <LOAD>",
+            f"        Background mode: highest 1-minute load average per CPU (default: {prefs.max_load:g})",
+            "    --max-pressure <PERCENT>",
+            f"        Background mode: highest CPU/IO pressure stall (default: {prefs.max_pressure:g})",
+            "    --merge",
+            "        Merge proposed clips into the job file instead of printing them",
+            "    --jobs <N>",
+            f"        Maximum number of concurrent ffmpeg workers, 0 for one per CPU (default: {prefs.jobs})",
             "    -o, --output-dir <PATH>",
             f"        Path to the output clips directory (default: {prefs.output_dir})",
             "    -r, --filename-replace <OLD>=<NEW>",
@@ -59,23 +151,228 @@ def handle_help(_config: mvcs.Config):
             "        pass an empty string to clear the current mappings",
             "    --output-ext <EXTENSION>",
             f"        Output clip file extension (default: {prefs.output_ext})",
+            "    --port <PORT>",
+            "        Loopback port `serve-clips` listens on, 0 for any free port (default: 8765)",
+            "    --profile <PATH>",
+            "        Write a cProfile dump of the run",
+            "    --rebuild",
+            "        Rebuild the catalog from the clips of the job files before `ls` or `search`",
+            "    --recording <DATETIME>",
+            "        Only list clips of the recording started at this time in `ls` or `search`",
+            "    --repair",
+            "        Remux broken sources found by `scan` or before `run`, keeping the",
+            "        originals as <NAME>.broken",
+            "    --retries <N>",
+            f"        Retries for clips that fail transiently (default: {prefs.retries})",
+            "    --retry-failed",
+            "        Only run the clips listed in the failure report (implies --keep-going)",
+            "    --since <DATETIME>",
+            "        Only list clips ending after this time in `ls` or `search`",
+            "    --spacing <SECONDS>",
+            "        Minimum distance between highlights (default: 60)",
+            "    --thumbnails",
+            "        Also write poster frames and contact sheets when running the job",
+            "    --threshold <DBFS>",
+            "        Minimum loudness of a highlight (default: -20)",
+            "    --trace <PATH>",
+            "        Write a Chrome trace-event JSON timeline of the run (open in Perfetto)",
+            "    --top <N>",
+            "        Maximum number of highlights per video (default: 10)",
+            "    --until <DATETIME>",
+            "        Only list clips starting before this time in `ls` or `search`",
             "    --video-ext <EXTENSION>",
             f"        Input video file extension (default: {prefs.video_ext})",
             "    --video-filename-format <STRING>",
             f"        Input video filename format (default: {prefs.video_filename_format})",
+            "    --write-mode <copy|encode|native|smart>",
+            "        Stream copy clips (natively for MP4/MOV sources), re-encode them in",
+            "        parallel GOP-aligned chunks, or re-encode only the partial GOPs at",
+            "        each end (frame-accurate)",
+            f"        (default: {prefs.write_mode.value})",
             "",
             "SUBCOMMANDS:",
-            "    clip    Add a new clip to the job file",
+            "    analyze Propose clips around scene changes in the source videos",
+            "    check   Report problems in the job file (also done before `run`)",
+            "    clip    Add a new clip to the job file (around now, or --at)",
             "    help    Print usage information",
+            "    highlights",
+            "            Propose clips around the loudest moments of the source videos",
+            "    index   Fingerprint source videos and clips for `match`",
+            "    ingest <MARKERS.jsonl|->",
+            "            Add clips around timestamped markers (JSON lines) to the job file",
+            "    ls      List the clips in the catalog, in wall-clock order",
+            "    match <CLIP>",
+            "            Find where the content of a clip appears in other videos",
+            "    reel [TITLE...]",
+            "            Compile the job's highlight reels (all, or those named)",
             "    run     Run the job file to process videos and produce clips",
+            "    scan    Check every recording in the video directory for a broken header,",
+            "            missing index, wrong duration or undecodable end",
+            "    search <WORD...>",
+            "            Find clips in the catalog whose titles have words starting with each",
+            "    serve-clips",
+            "            Serve every clip of the job on http://127.0.0.1, remuxed from the",
+            "            sources on demand instead of written to disk",
+            "    thumbs  Write poster frames and contact sheets for every clip",
+            "    verify  Check clips against the checksums in the job's manifest",
     ):
         print(line, file=sys.stderr)
 
+def handle_highlights(config: mvcs.Config):
+    "Handle the highlights subcommand."
+
+    job = mvcs.Job.from_yaml_file(config)
+    propose_clips(config, {
+        date: mvcs.analyze.window_entries(windows, "loud")
+        for (date, windows) in mvcs.loudness.highlights(config, job).items()
+    })
+
+def handle_index(config: mvcs.Config):
+    "Handle the index subcommand."
+    job = mvcs.Job.from_yaml_file(config)
+    index = mvcs.fingerprint.update_index(config, job)
+    print(f"indexed {len(index.hashes)} keyframes from {len(index.sources)} files")
+
+def handle_ingest(config: mvcs.Config):
+    "Handle the ingest subcommand."
+
+    if len(config.args) != 1:
+        raise mvcs.Error("usage: mvcs ingest <MARKERS.jsonl|->")
+    if config.args[0] == "-":
+        (clips, count, skipped) = mvcs.ingest.ingest(config, sys.stdin, "<stdin>")
+    else:
+        try:
+            with open(config.args[0], encoding="utf-8") as file:
+                (clips, count, skipped) = mvcs.ingest.ingest(config, file, config.args[0])
+        except OSError as ex:
+            raise mvcs.Error(ex)
+
+    added = mvcs.gen.merge_clips(config.job_path, clips)
+    print(f"read {count} markers ({skipped} outside every recording), "
+          f"added {added} clips to {config.job_path}")
+
+def list_clips(config: mvcs.Config, text: str):
+    "Print the catalog clips matching `text` and the --since, --until and --recording filters."
+
+    if config.rebuild:
+        configs = [config._replace(job_path=path) for path in config.job_paths] or [config]
+        entries = [
+            entry
+            for job_config in configs
+            for entry in mvcs.Job.from_yaml_file(job_config).catalog_entries(job_config)
+        ]
+        total = mvcs.catalog.rebuild(
+            config,
+            [job_config.job_path.absolute() for job_config in configs],
+            entries,
+        )
+        print(f"rebuilt catalog: {total} clips", file=sys.stderr)
+
+    for entry in mvcs.catalog.search(config, text, config.since, config.until, config.recording):
+        print(f"{mvcs.time.datetime_to_str(entry.start)} - {entry.end:%H:%M:%S}  "
+              f"{entry.title}  {entry.output}")
+
+def handle_ls(config: mvcs.Config):
+    "Handle the ls subcommand."
+    if config.args:
+        raise mvcs.Error("usage: mvcs ls (use `mvcs search` to match titles)")
+    list_clips(config, "")
+
+def handle_match(config: mvcs.Config):
+    "Handle the match subcommand."
+
+    if len(config.args) != 1:
+        raise mvcs.Error("usage: mvcs match <clip>")
+    index = mvcs.fingerprint.load_index(config)
+    if index is None:
+        raise mvcs.Error("no fingerprint index (run `mvcs index` first)")
+
+    matches = mvcs.fingerprint.match_file(config, index, Path(config.args[0]))
+    for (path, offset, count) in matches:
+        print(f"{path} at {mvcs.time.timedelta_to_str(datetime.timedelta(seconds=offset))}"
+              f" ({count} keyframes)")
+
+def handle_reel(config: mvcs.Config):
+    "Handle the reel subcommand."
+    job = mvcs.Job.from_yaml_file(config)
+    mvcs.reel.write_reels(config, job)
+
 def handle_run(config: mvcs.Config):
     "Handle the run subcommand."
-    # Deserialize the YAML job playbook and run it
+
+    # Deserialize the YAML job playbooks (several with repeated -j or a glob)
+    configs = [config._replace(job_path=path) for path in config.job_paths] or [config]
+    full_jobs = [mvcs.Job.from_yaml_file(job_config) for job_config in configs]
+    jobs = [
+        job.only_failed(job_config) if config.retry_failed else job
+        for (job_config, job) in zip(configs, full_jobs)
+    ]
+    # Watch the live recording and disks of the jobs, not the command line's
+    mvcs.governor.watch([
+        job_config._replace(video_dir=job.video_dir, output_dir=job.output_dir)
+        for (job_config, job) in zip(configs, jobs)
+    ])
+    index = mvcs.fingerprint.load_index(config)
+    for (job_config, job, full_job) in zip(configs, jobs, full_jobs):
+        preflight(job_config, job)
+        mvcs.rename.rename_outputs(job_config, full_job)
+        if index is not None:
+            for (dst, existing) in mvcs.fingerprint.duplicate_clips(job_config, job, index).items():
+                print(f"warning: {dst} duplicates {existing}", file=sys.stderr)
+
+    # Run them
+    if len(jobs) == 1:
+        jobs[0].run(configs[0])
+    else:
+        mvcs.scheduler.run_jobs(config, list(zip(configs, jobs)))
+
+    for (job_config, job, full_job) in zip(configs, jobs, full_jobs):
+        if config.thumbnails:
+            mvcs.thumbs.write_thumbnails(job_config, job)
+        orphans = mvcs.rename.orphaned_outputs(job_config, full_job)
+        if orphans:
+            print(f"{len(orphans)} clips are no longer produced by {job_config.job_path} "
+                  "(safe to delete):")
+            for path in orphans:
+                print(f"    {path}")
+
+def handle_scan(config: mvcs.Config):
+    "Handle the scan subcommand."
+
+    paths = sorted(mvcs.timeline.recordings(config, config.video_dir).values())
+    broken = report_sources(config, paths)
+    if broken:
+        raise mvcs.Error(f"{broken} of {len(paths)} recordings are broken")
+    print(f"scanned {len(paths)} recordings")
+
+def handle_search(config: mvcs.Config):
+    "Handle the search subcommand."
+    if not config.args:
+        raise mvcs.Error("usage: mvcs search <WORD...>")
+    list_clips(config, " ".join(config.args))
+
+def handle_serve_clips(config: mvcs.Config):
+    "Handle the serve-clips subcommand."
     job = mvcs.Job.from_yaml_file(config)
-    job.run(config)
+    mvcs.serve.serve(config, job, config.port)
+
+def handle_thumbs(config: mvcs.Config):
+    "Handle the thumbs subcommand."
+    job = mvcs.Job.from_yaml_file(config)
+    mvcs.thumbs.write_thumbnails(config, job)
+
+def handle_verify(config: mvcs.Config):
+    "Handle the verify subcommand."
+
+    clips = mvcs.manifest.load(config)
+    if not clips:
+        raise mvcs.Error(f"no manifest: {mvcs.manifest.manifest_path(config)} (run with --checksum)")
+    problems = mvcs.manifest.verify(config, clips)
+    for (path, problem) in problems:
+        print(f"{path}: {problem}")
+    if problems:
+        raise mvcs.Error(f"{len(problems)} of {len(clips)} clips failed verification")
+    print(f"verified {len(clips)} clips")
 
 def main(argv: Optional[List[str]] = None) -> int:
     "Main entrypoint."
@@ -87,14 +384,39 @@ def main(argv: Optional[List[str]] = None) -> int:
         prefs = mvcs.Prefs.from_yaml_file(prefs_path) if prefs_path.is_file() else None
 
         # Get configuration from command-line arguments
+        start = mvcs.trace.now()
         config = mvcs.Config.from_argv(argv, prefs=prefs)
+        if config.trace_path is not None or config.profile_path is not None:
+            mvcs.trace.start(profile=config.profile_path is not None)
+            mvcs.trace.record("Config.from_argv", start)
+        if config.background:
+            mvcs.governor.start(config)
 
         # Dispatch subcommand handler
-        {
+        handler = {
+            mvcs.Subcommand.ANALYZE: handle_analyze,
+            mvcs.Subcommand.CHECK: handle_check,
             mvcs.Subcommand.CLIP: handle_clip,
             mvcs.Subcommand.HELP: handle_help,
+            mvcs.Subcommand.HIGHLIGHTS: handle_highlights,
+            mvcs.Subcommand.INDEX: handle_index,
+            mvcs.Subcommand.INGEST: handle_ingest,
+            mvcs.Subcommand.LS: handle_ls,
+            mvcs.Subcommand.MATCH: handle_match,
+            mvcs.Subcommand.REEL: handle_reel,
             mvcs.Subcommand.RUN: handle_run,
-        }[config.subcommand](config)
+            mvcs.Subcommand.SCAN: handle_scan,
+            mvcs.Subcommand.SEARCH: handle_search,
+            mvcs.Subcommand.SERVE_CLIPS: handle_serve_clips,
+            mvcs.Subcommand.THUMBS: handle_thumbs,
+            mvcs.Subcommand.VERIFY: handle_verify,
+        }[config.subcommand]
+        try:
+            with mvcs.trace.span(config.subcommand.name.lower()):
+                handler(config)
+        finally:
+            mvcs.governor.stop()
+            mvcs.trace.stop(config.trace_path, config.profile_path)
     except mvcs.Error as ex:
         print(f"error: {ex}", file=sys.stderr)
         return 1
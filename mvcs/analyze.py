@@ -0,0 +1,165 @@
+"Scene change analysis module."
+
+import datetime
+import math
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Sequence
+
+np: Any
+try:
+    import numpy as np # type: ignore
+except ImportError: # pragma: no cover
+    np = None
+
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Job
+from mvcs.time import timedelta_to_str
+
+# Analysis frame size in pixels (downscaled grayscale).
+FRAME_SIZE = (64, 36)
+# Analysis frames per second of source video.
+SAMPLE_RATE = 5
+# Frames read from ffmpeg per batch.
+BATCH_FRAMES = 1024
+# Mean absolute frame difference (0-1) that counts as a scene change.
+SCENE_THRESHOLD = 0.15
+# Seconds of video to propose before and after each scene change.
+CLIP_BEFORE = 10.0
+CLIP_AFTER = 20.0
+
+class Window(NamedTuple):
+    "Candidate clip window in a source video."
+
+    # Source video timestamp for the start of the window in seconds.
+    start: float
+    # Source video timestamp for the end of the window in seconds.
+    end: float
+    # Ranking score (scene change score, or loudness in dBFS).
+    score: float
+
+def require_numpy():
+    "Raise an error if the optional numpy dependency is missing."
+    if np is None:
+        raise Error("video analysis requires numpy (install mvcs[analysis])")
+
+def fill(stream: BinaryIO, view: memoryview) -> int:
+    "Read from a stream until the buffer is full or EOF, returning the bytes read."
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:]) # type: ignore
+        if not count:
+            break
+        filled += count
+    return filled
+
+def scene_scores(
+        stream: BinaryIO,
+        size: Sequence[int] = FRAME_SIZE,
+        batch: int = BATCH_FRAMES,
+) -> Iterator[Any]:
+    "Yield per-frame difference scores (0-1) for a raw grayscale frame stream."
+
+    require_numpy()
+    (width, height) = size
+    frame_bytes = width * height
+    # Slot 0 holds the last frame of the previous batch
+    frames = np.empty((batch + 1, height, width), dtype=np.uint8)
+    view = memoryview(frames[1:]).cast("B") # type: ignore
+    first = True
+    while True:
+        count = fill(stream, view) // frame_bytes
+        if not count:
+            return
+        if first:
+            frames[0] = frames[1]
+            first = False
+        current = frames[1:count + 1].astype(np.int16)
+        yield np.abs(current - frames[:count]).mean(axis=(1, 2)) / 255.0
+        frames[0] = frames[count]
+
+def merge_windows(windows: Sequence[Window]) -> List[Window]:
+    "Merge overlapping windows, keeping the highest score."
+    merged: List[Window] = []
+    for window in sorted(windows):
+        if merged and window.start <= merged[-1].end:
+            last = merged[-1]
+            merged[-1] = Window(
+                last.start,
+                max(last.end, window.end),
+                max(last.score, window.score),
+            )
+        else:
+            merged.append(window)
+    return merged
+
+def detect_windows(
+        stream: BinaryIO,
+        *,
+        rate: float = SAMPLE_RATE,
+        threshold: float = SCENE_THRESHOLD,
+) -> List[Window]:
+    "Get merged candidate windows around scene changes in a raw frame stream."
+
+    windows = []
+    offset = 0
+    for scores in scene_scores(stream):
+        for index in np.flatnonzero(scores >= threshold):
+            time = (offset + int(index)) / rate
+            windows.append(Window(
+                max(0.0, time - CLIP_BEFORE),
+                time + CLIP_AFTER,
+                float(scores[index]),
+            ))
+        offset += len(scores)
+    return merge_windows(windows)
+
+def analyze_video(src: Path) -> List[Window]:
+    "Stream downscaled frames of a source video from ffmpeg and detect scene changes."
+
+    require_numpy()
+    (width, height) = FRAME_SIZE
+    cmd = (
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-i", str(src),
+        "-map", "0:v:0",
+        "-vf", f"fps={SAMPLE_RATE},scale={width}:{height},format=gray",
+        "-f", "rawvideo",
+        "pipe:1",
+    )
+    try:
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+            windows = detect_windows(proc.stdout) # type: ignore
+    except OSError as ex:
+        raise Error(ex)
+    if proc.returncode != 0:
+        raise Error(f"ffmpeg failed to decode {src}")
+    return windows
+
+def analyze_job(config: Config, job: Job) -> Dict[datetime.datetime, List[Window]]:
+    "Detect candidate windows in every source video of the job in parallel."
+
+    require_numpy()
+    sources = {video.date: video.src_path(config, job.video_dir) for video in job.videos}
+    for src in sources.values():
+        if not src.is_file():
+            raise Error(f"missing video file: {src}")
+
+    with ProcessPoolExecutor(max_workers=config.jobs) as pool:
+        results = pool.map(analyze_video, sources.values())
+        return dict(zip(sources.keys(), results))
+
+def window_entries(windows: Sequence[Window], title: str) -> List[Dict[str, str]]:
+    "Get job file clip entries for candidate windows."
+    return [
+        {
+            "time": " - ".join((
+                timedelta_to_str(datetime.timedelta(seconds=int(window.start))),
+                timedelta_to_str(datetime.timedelta(seconds=math.ceil(window.end))),
+            )),
+            "title": f"{title} {number}",
+        }
+        for (number, window) in enumerate(windows, start=1)
+    ]
@@ -0,0 +1,39 @@
+"Source metadata cache module."
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+from mvcs.config import Config
+
+def source_key(path: Path) -> str:
+    "Get a key identifying the current contents of a source file."
+    stat = path.stat()
+    ident = f"{path.resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}"
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+def cache_path(config: Config, namespace: str, path: Path, suffix: str = ".json") -> Path:
+    "Get the cache file path for a source file."
+    return config.cache_dir / namespace / f"{source_key(path)}{suffix}"
+
+def load(config: Config, namespace: str, path: Path) -> Optional[Any]:
+    "Load a cached value for a source file, or `None` if it is not cached."
+    try:
+        with cache_path(config, namespace, path).open(encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def store(config: Config, namespace: str, path: Path, value: Any):
+    "Cache a value for a source file (failures are ignored)."
+    dst = cache_path(config, namespace, path)
+    tmp = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+    try:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        with tmp.open("w", encoding="utf-8") as file:
+            json.dump(value, file)
+        os.replace(tmp, dst)
+    except OSError:
+        pass
@@ -0,0 +1,236 @@
+"Clip catalog module."
+
+import datetime
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from mvcs.config import Config
+from mvcs.error import Error
+
+# Wall-clock times are stored as seconds since this (naive, local) moment.
+EPOCH = datetime.datetime(1970, 1, 1)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    output TEXT NOT NULL UNIQUE,
+    job TEXT NOT NULL,
+    source TEXT NOT NULL,
+    video REAL NOT NULL,
+    video_title TEXT NOT NULL,
+    title TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clips_start ON clips (start);
+CREATE INDEX IF NOT EXISTS clips_video ON clips (video);
+CREATE INDEX IF NOT EXISTS clips_job ON clips (job);
+CREATE VIRTUAL TABLE IF NOT EXISTS clips_text USING fts5 (
+    title, video_title, content='clips', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS clips_insert AFTER INSERT ON clips BEGIN
+    INSERT INTO clips_text (rowid, title, video_title)
+    VALUES (new.rowid, new.title, new.video_title);
+END;
+CREATE TRIGGER IF NOT EXISTS clips_delete AFTER DELETE ON clips BEGIN
+    INSERT INTO clips_text (clips_text, rowid, title, video_title)
+    VALUES ('delete', old.rowid, old.title, old.video_title);
+END;
+CREATE TRIGGER IF NOT EXISTS clips_update AFTER UPDATE ON clips BEGIN
+    INSERT INTO clips_text (clips_text, rowid, title, video_title)
+    VALUES ('delete', old.rowid, old.title, old.video_title);
+    INSERT INTO clips_text (rowid, title, video_title)
+    VALUES (new.rowid, new.title, new.video_title);
+END;
+"""
+
+COLUMNS = "output, job, source, video, video_title, title, start, end, size"
+# Statement adding a row or replacing the row of the same output (through
+# UPDATE, so the triggers keep the text index in sync).
+PLACEHOLDERS = ", ".join("?" * len(COLUMNS.split(", ")))
+UPSERT = (
+    f"INSERT INTO clips ({COLUMNS}) VALUES ({PLACEHOLDERS}) "
+    "ON CONFLICT (output) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in COLUMNS.split(", ")[1:])
+)
+
+class Entry(NamedTuple):
+    "Produced clip in the catalog."
+
+    # Output path of the clip.
+    output: Path
+    # Job file that produces the clip.
+    job: Path
+    # Path to the source video file.
+    source: Path
+    # Start of the source recording.
+    video: datetime.datetime
+    # Title of the source video.
+    video_title: str
+    # Clip title.
+    title: str
+    # Wall-clock start of the clip.
+    start: datetime.datetime
+    # Wall-clock end of the clip.
+    end: datetime.datetime
+    # File size in bytes.
+    size: int
+
+    @property
+    def duration(self) -> datetime.timedelta:
+        "Get the length of the clip."
+        return self.end - self.start
+
+    def to_row(self) -> Tuple[Any, ...]:
+        "Convert the entry to a database row."
+        return (
+            str(self.output),
+            str(self.job),
+            str(self.source),
+            seconds(self.video),
+            self.video_title,
+            self.title,
+            seconds(self.start),
+            seconds(self.end),
+            self.size,
+        )
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "Entry":
+        "Convert a database row to an entry."
+        (output, job, source, video, video_title, title, start, end, size) = row
+        return cls(
+            output=Path(output),
+            job=Path(job),
+            source=Path(source),
+            video=moment(video),
+            video_title=video_title,
+            title=title,
+            start=moment(start),
+            end=moment(end),
+            size=size,
+        )
+
+def seconds(when: datetime.datetime) -> float:
+    "Convert a wall-clock time to its stored form."
+    return (when - EPOCH).total_seconds()
+
+def moment(value: float) -> datetime.datetime:
+    "Convert a stored time to a wall-clock time."
+    return EPOCH + datetime.timedelta(seconds=value)
+
+def catalog_path(config: Config) -> Path:
+    "Get the path of the clip catalog database."
+    return config.cache_dir / "catalog.sqlite"
+
+def connect(config: Config) -> sqlite3.Connection:
+    "Open the clip catalog, creating it if needed."
+    path = catalog_path(config)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(path)
+        connection.executescript(SCHEMA)
+    except (OSError, sqlite3.Error) as ex:
+        raise Error(f"cannot open clip catalog: {path}: {ex}")
+    return connection
+
+def record(config: Config, job: Path, entries: Sequence[Entry]):
+    """Bring the catalog entries of a job's existing clips up to date in one
+    transaction; only changed rows are written."""
+
+    if not entries:
+        return
+    connection = connect(config)
+    try:
+        with connection:
+            known = {
+                row[0]: row for row in connection.execute(
+                    f"SELECT {COLUMNS} FROM clips WHERE job = ?",
+                    (str(job),),
+                )
+            }
+            rows = [entry.to_row() for entry in entries]
+            current = {row[0] for row in rows}
+            connection.executemany("DELETE FROM clips WHERE output = ?", [
+                (output,) for output in known
+                if output not in current and not os.path.exists(output)
+            ])
+            connection.executemany(
+                UPSERT,
+                [row for row in rows if known.get(row[0]) != row],
+            )
+    except sqlite3.Error as ex:
+        raise Error(f"cannot update clip catalog: {ex}")
+    finally:
+        connection.close()
+
+def rebuild(config: Config, jobs: Sequence[Path], entries: Iterable[Entry]) -> int:
+    """Replace the catalog entries of `jobs` with `entries` and drop the entries
+    of clips that no longer exist; returns the number of clips in the catalog."""
+
+    connection = connect(config)
+    try:
+        with connection:
+            connection.executemany(
+                "DELETE FROM clips WHERE job = ?",
+                [(str(job),) for job in jobs],
+            )
+            gone = [
+                (output,) for (output,) in connection.execute("SELECT output FROM clips")
+                if not os.path.exists(output)
+            ]
+            connection.executemany("DELETE FROM clips WHERE output = ?", gone)
+            connection.executemany(
+                UPSERT,
+                [entry.to_row() for entry in entries],
+            )
+        return connection.execute("SELECT count(*) FROM clips").fetchone()[0]
+    except sqlite3.Error as ex:
+        raise Error(f"cannot rebuild clip catalog: {ex}")
+    finally:
+        connection.close()
+
+def text_query(text: str) -> str:
+    "Convert search words to an FTS5 query matching titles with words starting with each."
+    words = text.split()
+    return " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+def search(
+        config: Config,
+        text: str = "",
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        video: Optional[datetime.datetime] = None,
+) -> List[Entry]:
+    """Find clips by title words, overlap with a wall-clock range and recording,
+    in wall-clock order."""
+
+    conditions: List[str] = []
+    params: List[Any] = []
+    if text.split():
+        conditions.append("rowid IN (SELECT rowid FROM clips_text WHERE clips_text MATCH ?)")
+        params.append(text_query(text))
+    if since is not None:
+        conditions.append("end > ?")
+        params.append(seconds(since))
+    if until is not None:
+        conditions.append("start < ?")
+        params.append(seconds(until))
+    if video is not None:
+        conditions.append("video = ?")
+        params.append(seconds(video))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    connection = connect(config)
+    try:
+        rows = connection.execute(
+            f"SELECT {COLUMNS} FROM clips {where} ORDER BY start, output",
+            params,
+        ).fetchall()
+    except sqlite3.Error as ex:
+        raise Error(f"cannot search clip catalog: {ex}")
+    finally:
+        connection.close()
+    return [Entry.from_row(row) for row in rows]
@@ -0,0 +1,115 @@
+"Preflight job validation module."
+
+import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from mvcs import ffmpeg, names, timeline, trace
+from mvcs.config import Config, NameCollision
+from mvcs.error import Error
+from mvcs.job import Job, Video
+
+class Problem(NamedTuple):
+    "Problem found in a job before running it."
+
+    # Whether the problem would make the run fail.
+    fatal: bool
+    # Description of the problem.
+    message: str
+
+def scan_dir(directory: Path) -> Set[str]:
+    "Get the names of all files in a directory with a single scan."
+    with trace.span("scan_dir", path=directory), os.scandir(directory) as entries:
+        return {entry.name for entry in entries if entry.is_file()}
+
+def clip_label(video: Video, clip) -> str:
+    "Get a human-readable reference to a clip."
+    return f"{video.title} ({video.date}): {clip.title}"
+
+def check_overlaps(video: Video) -> List[Problem]:
+    "Report duplicate and overlapping clips of a video."
+
+    problems = []
+    clips = sorted(video.clips, key=lambda clip: (clip.start, clip.end))
+    # A long clip can overlap many later ones, so the sweep tracks the clip
+    # that ends last so far rather than only the previous one
+    longest = clips[0] if clips else None
+    for (prev, clip) in zip(clips, clips[1:]):
+        if (prev.start, prev.end) == (clip.start, clip.end):
+            problems.append(Problem(False, "duplicate clip time: "
+                                    f"{clip_label(video, prev)} / {clip.title}"))
+        elif longest is not None and clip.start < longest.end:
+            problems.append(Problem(False, "overlapping clips: "
+                                    f"{clip_label(video, longest)} / {clip.title}"))
+        if longest is None or clip.end > longest.end:
+            longest = clip
+    return problems
+
+def check_job(config: Config, job: Job) -> List[Problem]:
+    "Find every problem that would make a job run fail or misbehave."
+
+    problems: List[Problem] = []
+    if not job.output_dir.is_dir():
+        problems.append(Problem(True, f"missing output directory: {job.output_dir}"))
+    for target in job.targets:
+        if not target.output_dir.is_dir():
+            problems.append(Problem(True, f"missing output directory: {target.output_dir}"))
+
+    files: Optional[Set[str]]
+    try:
+        files = scan_dir(job.video_dir)
+    except OSError as ex:
+        problems.append(Problem(True, f"cannot read video directory: {ex}"))
+        files = None
+
+    renderer = names.renderer(config)
+    sources: Dict[datetime.datetime, Path] = {}
+    for video in job.videos:
+        if not video.clips or files is None:
+            continue
+        name = renderer.source_name(video.date)
+        if name in files:
+            sources[video.date] = job.video_dir / name
+        else:
+            problems.append(Problem(True, f"missing video file: {job.video_dir / name}"))
+
+    # Durations are cached per source, so this only probes new recordings
+    with ThreadPoolExecutor(max_workers=config.jobs) as pool:
+        futures = {
+            date: pool.submit(ffmpeg.duration, config, src)
+            for (date, src) in sources.items()
+        }
+        durations = {}
+        for (date, future) in futures.items():
+            try:
+                durations[date] = datetime.timedelta(seconds=future.result())
+            except Error as ex:
+                problems.append(Problem(True, f"unreadable video file: {sources[date]}: {ex}"))
+
+    index: Optional[timeline.Timeline] = None
+    for video in job.videos:
+        length = durations.get(video.date)
+        if length is not None:
+            for clip in video.clips:
+                if clip.start >= length:
+                    problems.append(Problem(True, "clip starts after the end of the video "
+                                            f"({length}): {clip_label(video, clip)}"))
+                elif clip.end > length:
+                    # Clips may continue in the next recordings after a split
+                    if index is None:
+                        index = timeline.Timeline.scan(config, job.video_dir)
+                    parts = index.covering(video.date + clip.start, video.date + clip.end)
+                    if not parts or parts[-1].recording.start + parts[-1].end < video.date + clip.end:
+                        problems.append(Problem(False, "clip ends after the end of the video "
+                                                f"({length}): {clip_label(video, clip)}"))
+        problems.extend(check_overlaps(video))
+
+    for group in names.collisions(job.outputs(config)):
+        problems.append(Problem(
+            config.name_collision == NameCollision.ERROR,
+            f"clips share an output name ({config.name_collision.value}): {group[0]}",
+        ))
+
+    return problems
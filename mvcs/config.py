@@ -1,14 +1,18 @@
 "Configuration module."
 
+import datetime
 import enum
 import getopt
+import glob
+import os
 from collections import UserDict
 from pathlib import Path
-from typing import Any, Dict, List, NamedTuple, Optional, Type, TypeVar
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Type, TypeVar
 
 import yaml
 
 from mvcs.error import Error
+from mvcs.time import datetime_from_str
 
 ReplaceType = TypeVar("ReplaceType", bound="Replace")
 class Replace(UserDict): # pylint: disable=too-many-ancestors
@@ -33,37 +37,245 @@ class Replace(UserDict): # pylint: disable=too-many-ancestors
             target = target.replace(key, value)
         return target
 
+TargetType = TypeVar("TargetType", bound="Target")
+class Target(NamedTuple):
+    "Additional destination that every clip is also written to."
+
+    # Directory the clips are written to.
+    output_dir: Path
+    # Clip file extension (which also selects the container format).
+    output_ext: str
+    # Muxer options for this destination, e.g. `movflags: +faststart`.
+    options: Dict[str, str] = {}
+
+    @classmethod
+    def from_dict(cls: Type[TargetType], data: Dict[str, Any]) -> TargetType:
+        "Create a `Target` from an untyped `dict` (YAML deserialization result)."
+
+        if not isinstance(data, dict):
+            raise Error(f"invalid output: {data}")
+        unknown_keys = set(data.keys()) - {"dir", "ext", "options"}
+        if unknown_keys:
+            raise Error(f"unknown output keys: {unknown_keys}")
+        if not data.get("dir") or not data.get("ext"):
+            raise Error(f"output needs a dir and an ext: {data}")
+
+        options = data.get("options", {})
+        if not isinstance(options, dict):
+            raise Error(f"invalid output options: {options}")
+
+        return cls(
+            output_dir=Path(str(data["dir"])).expanduser(),
+            output_ext=str(data["ext"]),
+            options={str(key): str(value) for (key, value) in options.items()},
+        )
+
+    def path(self, dst: Path) -> Path:
+        "Get this destination's path for the clip written to `dst`."
+        return self.output_dir / f"{dst.stem}.{self.output_ext}"
+
+def targets_from_list(data: Any) -> Tuple[Target, ...]:
+    "Parse a list of additional output destinations."
+    if not isinstance(data, list):
+        raise Error(f"invalid outputs: {data}")
+    return tuple(Target.from_dict(target) for target in data)
+
+@enum.unique
+class WriteMode(enum.Enum):
+    "Method used to write clip files."
+
+    # Stream copy the source (fast and lossless, but keyframe-aligned).
+    COPY = "copy"
+    # Re-encode the clip in parallel GOP-aligned chunks.
+    ENCODE = "encode"
+    # Cut MP4/MOV sources in-process from their sample tables (falls back to copy).
+    NATIVE = "native"
+    # Re-encode only the partial GOPs at the clip boundaries, copy the rest.
+    SMART = "smart"
+
+    @classmethod
+    def from_str(cls, mode: str) -> "WriteMode":
+        "Parse a `WriteMode` from its name."
+        try:
+            return cls(mode.lower())
+        except ValueError:
+            raise Error(f"invalid write mode: {mode}")
+
+@enum.unique
+class NameCollision(enum.Enum):
+    "What to do when different clips render to the same output name."
+
+    # Report all collisions and stop before writing anything.
+    ERROR = "error"
+    # Append a number to the later clips' names.
+    NUMBER = "number"
+    # Only write the first clip.
+    SKIP = "skip"
+
+    @classmethod
+    def from_str(cls, policy: str) -> "NameCollision":
+        "Parse a `NameCollision` from its name."
+        try:
+            return cls(policy.lower())
+        except ValueError:
+            raise Error(f"invalid name collision policy: {policy}")
+
+def jobs_from_str(jobs_s: str) -> int:
+    "Parse a worker count, where 0 means one worker per CPU."
+    try:
+        jobs = int(jobs_s)
+    except ValueError:
+        raise Error(f"invalid job count: {jobs_s}")
+    if jobs < 0:
+        raise Error(f"invalid job count: {jobs_s}")
+    return jobs or os.cpu_count() or 1
+
+def device_jobs_from_str(jobs_s: str) -> int:
+    "Parse a per-disk clip limit, where 0 means no limit."
+    try:
+        jobs = int(jobs_s)
+    except ValueError:
+        raise Error(f"invalid device job count: {jobs_s}")
+    if jobs < 0:
+        raise Error(f"invalid device job count: {jobs_s}")
+    return jobs
+
+def job_paths_from_str(pattern: str) -> List[Path]:
+    "Expand a job path argument, which may be a glob pattern."
+    if not pattern:
+        raise Error("job path cannot be empty")
+    if not glob.has_magic(pattern):
+        return [Path(pattern)]
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise Error(f"no job files match {pattern}")
+    return [Path(path) for path in paths]
+
+def port_from_str(port_s: str) -> int:
+    "Parse a TCP port number, where 0 means any free port."
+    try:
+        port = int(port_s)
+    except ValueError:
+        raise Error(f"invalid port: {port_s}")
+    if not 0 <= port <= 65535:
+        raise Error(f"invalid port: {port_s}")
+    return port
+
+def retries_from_str(retries_s: str) -> int:
+    "Parse a retry count."
+    try:
+        retries = int(retries_s)
+    except ValueError:
+        raise Error(f"invalid retry count: {retries_s}")
+    if retries < 0:
+        raise Error(f"invalid retry count: {retries_s}")
+    return retries
+
+def limit_from_str(limit_s: str, name: str) -> float:
+    "Parse a non-negative numeric option value."
+    limit = number_from_str(limit_s, name)
+    if limit < 0:
+        raise Error(f"invalid {name}: {limit_s}")
+    return limit
+
+def number_from_str(num_s: str, name: str) -> float:
+    "Parse a numeric option value."
+    try:
+        return float(num_s)
+    except ValueError:
+        raise Error(f"invalid {name}: {num_s}")
+
+def flag_from_value(value: Any, name: str) -> bool:
+    "Parse a boolean preference value (a YAML boolean or its spelling as a string)."
+    if isinstance(value, bool):
+        return value
+    try:
+        return {
+            "true": True, "yes": True, "on": True, "1": True,
+            "false": False, "no": False, "off": False, "0": False,
+        }[str(value).strip().lower()]
+    except KeyError:
+        raise Error(f"invalid {name}: {value}")
+
 PrefsType = TypeVar("PrefsType", bound="Prefs")
 class Prefs(NamedTuple):
     "User preferences to choose default behavior."
 
+    # Whether extraction yields to other work (e.g. live recording) on the machine.
+    background: bool = False
+    # Directory for cached source metadata (keyframes, durations, ...).
+    cache_dir: Path = Path("~/.cache/mvcs").expanduser()
+    # Whether written clips are hashed and recorded in the job's manifest.
+    checksum: bool = False
+    # Triggered clips within this many seconds of each other are merged.
+    coalesce: float = 0.0
+    # ffmpeg output options used when re-encoding clips.
+    encode_args: str = "-c:v libx264 -preset medium -crf 18"
     # String replacement map for input and output filenames.
     filename_replace: Replace = Replace()
+    # Maximum number of concurrent clips reading or writing each disk (0 for no limit).
+    device_jobs: int = 2
+    # Maximum number of concurrent ffmpeg workers (0, the default, means one per CPU).
+    jobs: int = jobs_from_str("0")
+    # Whether runs continue past failed clips and write a failure report.
+    keep_going: bool = False
     # Default path to the job file.
     job_path: Path = Path("clip.yaml")
+    # Background mode: highest 1-minute load average per CPU before workers are cut.
+    max_load: float = 0.75
+    # Background mode: highest in-flight I/O requests on a source or output disk.
+    max_disk_queue: float = 8.0
+    # Background mode: highest CPU or I/O pressure stall percentage (10s average).
+    max_pressure: float = 10.0
+    # What to do when different clips render to the same output name.
+    name_collision: NameCollision = NameCollision.NUMBER
     # Default path to the output clips directory.
     output_dir: Path = Path(".")
     # Default output clip file extension.
     output_ext: str = "mkv"
+    # Additional destinations every clip is also written to.
+    targets: Tuple[Target, ...] = ()
+    # Whether `run` also writes clip thumbnails and contact sheets.
+    thumbnails: bool = False
+    # Number of times a clip is retried after a transient failure.
+    retries: int = 2
     # Default path to the input video directory.
     video_dir: Path = Path(".")
     # Default input video file extension.
     video_ext: str = "mkv"
     # Default input video filename format.
     video_filename_format: str = "%Y-%m-%d %H-%M-%S"
+    # Method used to write clip files.
+    write_mode: WriteMode = WriteMode.COPY
 
     @classmethod
     def dict_key(cls: Type[PrefsType], field: str) -> str:
         "Get the untyped `dict` key name for a `Prefs` field."
         try:
             return {
+                "background": "background",
+                "cache_dir": "cache-dir",
+                "checksum": "checksum",
+                "coalesce": "coalesce",
+                "device_jobs": "device-jobs",
+                "encode_args": "encode-args",
                 "filename_replace": "filename-replace",
+                "jobs": "jobs",
                 "job_path": "job-path",
+                "keep_going": "keep-going",
+                "max_disk_queue": "max-disk-queue",
+                "max_load": "max-load",
+                "max_pressure": "max-pressure",
+                "name_collision": "name-collision",
                 "output_dir": "output-dir",
                 "output_ext": "output-ext",
+                "retries": "retries",
+                "targets": "outputs",
+                "thumbnails": "thumbnails",
                 "video_dir": "video-dir",
                 "video_ext": "video-ext",
                 "video_filename_format": "video-filename-format",
+                "write_mode": "write-mode",
             }[field]
         except KeyError:
             raise Error(f"invalid field: {field}")
@@ -75,13 +287,29 @@ class Prefs(NamedTuple):
         prefs = {}
         # pylint: disable=unnecessary-lambda
         for (field, value_fn) in (
+                ("background", lambda x: flag_from_value(x, "background setting")),
+                ("cache_dir", lambda x: Path(str(x)).expanduser()),
+                ("checksum", lambda x: flag_from_value(x, "checksum setting")),
+                ("coalesce", lambda x: limit_from_str(str(x), "coalesce window")),
+                ("device_jobs", lambda x: device_jobs_from_str(str(x))),
+                ("encode_args", lambda x: str(x)),
                 ("job_path", lambda x: Path(str(x))),
+                ("jobs", lambda x: jobs_from_str(str(x))),
+                ("keep_going", lambda x: flag_from_value(x, "keep-going setting")),
+                ("max_disk_queue", lambda x: limit_from_str(str(x), "disk queue limit")),
+                ("max_load", lambda x: limit_from_str(str(x), "load limit")),
+                ("max_pressure", lambda x: limit_from_str(str(x), "pressure limit")),
                 ("filename_replace", lambda x: Replace.from_dict(x)),
+                ("name_collision", lambda x: NameCollision.from_str(str(x))),
                 ("output_dir", lambda x: Path(str(x))),
                 ("output_ext", lambda x: str(x)),
+                ("retries", lambda x: retries_from_str(str(x))),
+                ("targets", lambda x: targets_from_list(x)),
+                ("thumbnails", lambda x: flag_from_value(x, "thumbnails setting")),
                 ("video_dir", lambda x: Path(str(x))),
                 ("video_ext", lambda x: str(x)),
                 ("video_filename_format", lambda x: str(x)),
+                ("write_mode", lambda x: WriteMode.from_str(str(x))),
         ):
             key = cls.dict_key(field)
             if key in data:
@@ -109,12 +337,38 @@ class Prefs(NamedTuple):
 class Subcommand(enum.Enum):
     "Subcommand for selecting program execution type."
 
+    # Propose clips around scene changes in the source videos.
+    ANALYZE = enum.auto()
+    # Validate the job without running it.
+    CHECK = enum.auto()
     # Add a new clip to the job file.
     CLIP = enum.auto()
     # Show program usage and exit.
     HELP = enum.auto()
+    # Propose clips around the loudest moments of the source videos.
+    HIGHLIGHTS = enum.auto()
+    # Build or update the perceptual fingerprint index.
+    INDEX = enum.auto()
+    # Add clips around a stream of timestamped markers to the job file.
+    INGEST = enum.auto()
+    # List the clips in the catalog.
+    LS = enum.auto()
+    # Find where the content of a clip appears in other recordings.
+    MATCH = enum.auto()
+    # Compile highlight reels from the job's clips.
+    REEL = enum.auto()
     # Run the job file to process videos and produce clips.
     RUN = enum.auto()
+    # Check the integrity of every recording in the video directory.
+    SCAN = enum.auto()
+    # Find clips in the catalog by title.
+    SEARCH = enum.auto()
+    # Serve the job's clips over HTTP, remuxed on demand.
+    SERVE_CLIPS = enum.auto()
+    # Check clips against the checksums in the job's manifest.
+    VERIFY = enum.auto()
+    # Write clip thumbnails and contact sheets.
+    THUMBS = enum.auto()
 
 ConfigType = TypeVar("ConfigType", bound="Config")
 class Config(NamedTuple):
@@ -122,20 +376,84 @@ class Config(NamedTuple):
 
     # Path to the clip.yaml job file.
     job_path: Path
+    # Whether extraction yields to other work on the machine.
+    background: bool
+    # Directory for cached source metadata.
+    cache_dir: Path
+    # Whether written clips are hashed and recorded in the job's manifest.
+    checksum: bool
+    # Triggered clips within this many seconds of each other are merged.
+    coalesce: float
+    # ffmpeg output options used when re-encoding clips.
+    encode_args: str
     # String replacement map for input and output filenames.
     filename_replace: Replace
+    # Maximum number of concurrent clips reading or writing each disk (0 for no limit).
+    device_jobs: int
+    # Maximum number of concurrent ffmpeg workers.
+    jobs: int
+    # Whether runs continue past failed clips and write a failure report.
+    keep_going: bool
+    # Background mode: highest 1-minute load average per CPU.
+    max_load: float
+    # Background mode: highest in-flight I/O requests on a source or output disk.
+    max_disk_queue: float
+    # Background mode: highest CPU or I/O pressure stall percentage.
+    max_pressure: float
+    # What to do when different clips render to the same output name.
+    name_collision: NameCollision
     # Default path to the output clips directory.
     output_dir: Path
     # Output clip file extension.
     output_ext: str
+    # Number of times a clip is retried after a transient failure.
+    retries: int
+    # Additional destinations every clip is also written to.
+    targets: Tuple[Target, ...]
+    # Whether `run` also writes clip thumbnails and contact sheets.
+    thumbnails: bool
     # Default path to the input video directory.
     video_dir: Path
     # Input video file extension.
     video_ext: str
     # Input video filename format.
     video_filename_format: str
+    # Method used to write clip files.
+    write_mode: WriteMode
     # mvcs subcommand.
     subcommand: Subcommand = Subcommand.HELP
+    # Positional arguments following the subcommand.
+    args: Tuple[str, ...] = ()
+    # Every job file given on the command line (`run` runs them together).
+    job_paths: Tuple[Path, ...] = ()
+    # Wall-clock time `clip` clips around (now, if not given).
+    at: Optional[datetime.datetime] = None
+    # `ls` and `search` only list clips ending after this wall-clock time.
+    since: Optional[datetime.datetime] = None
+    # `ls` and `search` only list clips starting before this wall-clock time.
+    until: Optional[datetime.datetime] = None
+    # `ls` and `search` only list clips of the recording started at this time.
+    recording: Optional[datetime.datetime] = None
+    # Whether `ls` and `search` first rebuild the catalog from the job's existing clips.
+    rebuild: bool = False
+    # Loopback port `serve-clips` listens on (0 for any free port).
+    port: int = 8765
+    # Whether broken sources found by `scan` (or before `run`) are remuxed.
+    repair: bool = False
+    # Whether proposed clips are merged into the job file instead of printed.
+    merge: bool = False
+    # Whether `run` only retries the clips in the failure report.
+    retry_failed: bool = False
+    # Path to write a Chrome trace-event JSON timeline of the run to.
+    trace_path: Optional[Path] = None
+    # Path to write a cProfile dump of the run to.
+    profile_path: Optional[Path] = None
+    # Minimum loudness (dBFS) of a highlight.
+    highlight_threshold: float = -20.0
+    # Maximum number of highlights per source video.
+    highlight_top: int = 10
+    # Minimum distance between highlights in seconds.
+    highlight_spacing: float = 60.0
 
     @classmethod
     def default(cls: Type[ConfigType], *, prefs: Optional[Prefs] = None) -> ConfigType:
@@ -144,12 +462,28 @@ class Config(NamedTuple):
         prefs = prefs if prefs is not None else Prefs()
         return cls(
             job_path=prefs.job_path,
+            background=prefs.background,
+            cache_dir=prefs.cache_dir,
+            checksum=prefs.checksum,
+            coalesce=prefs.coalesce,
+            encode_args=prefs.encode_args,
             filename_replace=prefs.filename_replace.copy(),
+            device_jobs=prefs.device_jobs,
+            jobs=prefs.jobs,
+            keep_going=prefs.keep_going,
+            max_load=prefs.max_load,
+            max_disk_queue=prefs.max_disk_queue,
+            max_pressure=prefs.max_pressure,
+            name_collision=prefs.name_collision,
             output_dir=prefs.output_dir,
             output_ext=prefs.output_ext,
+            retries=prefs.retries,
+            targets=prefs.targets,
+            thumbnails=prefs.thumbnails,
             video_dir=prefs.video_dir,
             video_ext=prefs.video_ext,
             video_filename_format=prefs.video_filename_format,
+            write_mode=prefs.write_mode,
         )
 
     @classmethod
@@ -166,41 +500,113 @@ class Config(NamedTuple):
         config: Dict[str, Any] = cls.default(prefs=prefs)._asdict()
         try:
             opts, args = getopt.getopt(argv[1:], "hi:j:o:r:", longopts=[
+                "at=",
+                "background",
+                "cache-dir=",
+                "checksum",
+                "coalesce=",
+                "device-jobs=",
+                "encode-args=",
                 "filename-replace=",
                 "help",
                 "job-path=",
+                "jobs=",
+                "keep-going",
+                "max-disk-queue=",
+                "max-load=",
+                "max-pressure=",
+                "merge",
+                "name-collision=",
                 "output-dir=",
                 "output-ext=",
+                "port=",
+                "profile=",
+                "rebuild",
+                "recording=",
+                "repair",
+                "retries=",
+                "retry-failed",
+                "since=",
+                "spacing=",
+                "thumbnails",
+                "threshold=",
+                "top=",
+                "trace=",
+                "until=",
                 "video-dir=",
                 "video-ext=",
                 "video-filename-format=",
+                "write-mode=",
             ])
         except getopt.GetoptError as ex:
             raise Error(ex)
 
         if args:
             subcommand = {
+                "analyze": Subcommand.ANALYZE,
+                "check": Subcommand.CHECK,
                 "clip": Subcommand.CLIP,
                 "help": Subcommand.HELP,
+                "highlights": Subcommand.HIGHLIGHTS,
+                "index": Subcommand.INDEX,
+                "ingest": Subcommand.INGEST,
+                "ls": Subcommand.LS,
+                "match": Subcommand.MATCH,
+                "reel": Subcommand.REEL,
                 "run": Subcommand.RUN,
+                "scan": Subcommand.SCAN,
+                "search": Subcommand.SEARCH,
+                "serve-clips": Subcommand.SERVE_CLIPS,
+                "thumbs": Subcommand.THUMBS,
+                "verify": Subcommand.VERIFY,
             }.get(args[0].lower())
             if subcommand is None:
                 raise Error(f"invalid subcommand: {args[0]}")
             config["subcommand"] = subcommand
+            config["args"] = tuple(args[1:])
 
         for opt, optarg in opts:
             if opt in ("-h", "--help"):
                 config["subcommand"] = Subcommand.HELP
+            elif opt == "--at":
+                config["at"] = datetime_from_str(optarg)
+            elif opt == "--background":
+                config["background"] = True
+            elif opt == "--cache-dir":
+                if optarg:
+                    config["cache_dir"] = Path(optarg).expanduser()
+                else:
+                    raise Error("cache directory cannot be empty")
+            elif opt == "--checksum":
+                config["checksum"] = True
+            elif opt == "--coalesce":
+                config["coalesce"] = limit_from_str(optarg, "coalesce window")
+            elif opt == "--encode-args":
+                config["encode_args"] = optarg
             elif opt in ("-i", "--video-dir"):
                 if optarg:
                     config["video_dir"] = Path(optarg)
                 else:
                     raise Error("video directory path cannot be empty")
+            elif opt == "--device-jobs":
+                config["device_jobs"] = device_jobs_from_str(optarg)
             elif opt in ("-j", "--job-path"):
-                if optarg:
-                    config["job_path"] = Path(optarg)
-                else:
-                    raise Error("job path cannot be empty")
+                config["job_paths"] = (*config["job_paths"], *job_paths_from_str(optarg))
+                config["job_path"] = config["job_paths"][0]
+            elif opt == "--jobs":
+                config["jobs"] = jobs_from_str(optarg)
+            elif opt == "--keep-going":
+                config["keep_going"] = True
+            elif opt == "--max-disk-queue":
+                config["max_disk_queue"] = limit_from_str(optarg, "disk queue limit")
+            elif opt == "--max-load":
+                config["max_load"] = limit_from_str(optarg, "load limit")
+            elif opt == "--max-pressure":
+                config["max_pressure"] = limit_from_str(optarg, "pressure limit")
+            elif opt == "--merge":
+                config["merge"] = True
+            elif opt == "--name-collision":
+                config["name_collision"] = NameCollision.from_str(optarg)
             elif opt in ("-o", "--output-dir"):
                 if optarg:
                     config["output_dir"] = Path(optarg)
@@ -224,6 +630,48 @@ class Config(NamedTuple):
                     config["output_ext"] = optarg
                 else:
                     raise Error("output extension cannot be empty")
+            elif opt == "--port":
+                config["port"] = port_from_str(optarg)
+            elif opt == "--profile":
+                if optarg:
+                    config["profile_path"] = Path(optarg)
+                else:
+                    raise Error("profile path cannot be empty")
+            elif opt == "--rebuild":
+                config["rebuild"] = True
+            elif opt == "--recording":
+                config["recording"] = datetime_from_str(optarg)
+            elif opt == "--repair":
+                config["repair"] = True
+            elif opt == "--retries":
+                config["retries"] = retries_from_str(optarg)
+            elif opt == "--retry-failed":
+                config["retry_failed"] = True
+                config["keep_going"] = True
+            elif opt == "--since":
+                config["since"] = datetime_from_str(optarg)
+            elif opt == "--spacing":
+                config["highlight_spacing"] = number_from_str(optarg, "spacing")
+                if config["highlight_spacing"] < 0:
+                    raise Error(f"invalid spacing: {optarg}")
+            elif opt == "--thumbnails":
+                config["thumbnails"] = True
+            elif opt == "--threshold":
+                config["highlight_threshold"] = number_from_str(optarg, "threshold")
+            elif opt == "--trace":
+                if optarg:
+                    config["trace_path"] = Path(optarg)
+                else:
+                    raise Error("trace path cannot be empty")
+            elif opt == "--top":
+                try:
+                    config["highlight_top"] = int(optarg)
+                except ValueError:
+                    raise Error(f"invalid count: {optarg}")
+                if config["highlight_top"] < 1:
+                    raise Error(f"invalid count: {optarg}")
+            elif opt == "--until":
+                config["until"] = datetime_from_str(optarg)
             elif opt == "--video-ext":
                 if optarg:
                     config["video_ext"] = optarg
@@ -234,6 +682,8 @@ class Config(NamedTuple):
                     config["video_filename_format"] = optarg
                 else:
                     raise Error("video filename format cannot be empty")
+            elif opt == "--write-mode":
+                config["write_mode"] = WriteMode.from_str(optarg)
             else:
                 raise Error(f"unhandled option: {opt}")
 
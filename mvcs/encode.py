@@ -0,0 +1,289 @@
+"Parallel re-encoding module."
+
+import os
+import shlex
+import sys
+import tempfile
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from mvcs import ffmpeg
+from mvcs.config import Config
+
+# Chunks shorter than this cost more in seeking and GOP restarts than they gain.
+MIN_CHUNK_SECONDS = 10.0
+# Planning several chunks per worker keeps workers busy when chunks finish unevenly.
+CHUNKS_PER_WORKER = 4
+
+# Seconds past a keyframe's (rounded) timestamp that a stream copy seeks to, so
+# it lands on that keyframe and not on the one before it.
+SEEK_SLACK = 0.001
+# Stream parameters that re-encoded boundary segments must share with the source.
+SMART_CUT_PARAMS = ("codec_name", "profile", "pix_fmt", "width", "height")
+# Encoder options for source color properties (with the ffprobe entry they match).
+COLOR_OPTIONS = (
+    ("color_range", "-color_range"),
+    ("color_space", "-colorspace"),
+    ("color_transfer", "-color_trc"),
+    ("color_primaries", "-color_primaries"),
+)
+
+class SmartCutCodec(NamedTuple):
+    "How to re-encode boundary segments that can be joined to a copied stream."
+
+    # Encoder and quality arguments.
+    encoder: Tuple[str, ...]
+    # Encoder profiles by ffprobe profile name.
+    profiles: Dict[str, str]
+    # Converts a probed level to the encoder level arguments.
+    level: Callable[[int], Tuple[str, ...]]
+    # Bitstream filters that carry the parameter sets in-band in copied segments.
+    bitstream_filter: str
+
+SMART_CUT_CODECS = {
+    "h264": SmartCutCodec(
+        encoder=("-c:v", "libx264", "-preset", "fast", "-crf", "16"),
+        profiles={
+            "Constrained Baseline": "baseline",
+            "Baseline": "baseline",
+            "Main": "main",
+            "High": "high",
+            "High 10": "high10",
+            "High 4:2:2": "high422",
+            "High 4:4:4 Predictive": "high444",
+        },
+        level=lambda level: ("-level", f"{level / 10:.1f}"),
+        bitstream_filter="h264_mp4toannexb,dump_extra",
+    ),
+    "hevc": SmartCutCodec(
+        encoder=("-c:v", "libx265", "-preset", "fast", "-crf", "18"),
+        profiles={"Main": "main", "Main 10": "main10"},
+        level=lambda level: ("-x265-params", f"level-idc={level / 30:.1f}:repeat-headers=1"),
+        bitstream_filter="hevc_mp4toannexb,dump_extra",
+    ),
+}
+
+class Segment(NamedTuple):
+    "Part of a clip that is either stream copied or re-encoded."
+
+    # Source timestamp for the start of the segment in seconds.
+    start: float
+    # Source timestamp for the end of the segment in seconds.
+    end: float
+    # Whether the segment can be stream copied.
+    copy: bool
+
+def plan_chunks(
+        keyframes: Sequence[float],
+        start: float,
+        end: float,
+        jobs: int,
+) -> List[Tuple[float, float]]:
+    "Split `[start, end)` into chunks that begin on source keyframes."
+
+    target = max(MIN_CHUNK_SECONDS, (end - start) / (max(1, jobs) * CHUNKS_PER_WORKER))
+    bounds = [start]
+    for keyframe in keyframes[bisect_right(keyframes, start):bisect_left(keyframes, end)]:
+        if keyframe - bounds[-1] >= target and end - keyframe >= MIN_CHUNK_SECONDS:
+            bounds.append(keyframe)
+    bounds.append(end)
+    return list(zip(bounds, bounds[1:]))
+
+def plan_smart_cut(keyframes: Sequence[float], start: float, end: float) -> List[Segment]:
+    "Split `[start, end)` into re-encoded boundary segments and a copied middle."
+
+    first = bisect_left(keyframes, start)
+    last = bisect_right(keyframes, end) - 1
+    if first >= len(keyframes) or last < first or keyframes[first] >= keyframes[last]:
+        return [Segment(start, end, copy=False)]
+
+    (copy_start, copy_end) = (keyframes[first], keyframes[last])
+    segments = []
+    if copy_start > start:
+        segments.append(Segment(start, copy_start, copy=False))
+    segments.append(Segment(copy_start, copy_end, copy=True))
+    if copy_end < end:
+        segments.append(Segment(copy_end, end, copy=False))
+    return segments
+
+def encode_args(config: Config, src: Path, dst: Path, start: float, end: float, threads: int):
+    "Get ffmpeg arguments to re-encode the video of `[start, end)` from `src`."
+    return (
+        "-ss", str(start),
+        "-i", str(src),
+        "-t", str(end - start),
+        "-map", "0:v:0",
+        "-an",
+        *shlex.split(config.encode_args),
+        "-threads", str(threads),
+        str(dst),
+    )
+
+def concat_quote(name: str) -> str:
+    "Quote a file name for a concat demuxer list."
+    escaped = name.replace("'", "'\\''")
+    return f"'{escaped}'"
+
+def write_concat_list(path: Path, names: Sequence[str]):
+    "Write a concat demuxer list file referencing files next to it."
+    with path.open("w", encoding="utf-8") as file:
+        for name in names:
+            file.write(f"file {concat_quote(name)}\n")
+
+def copy_args(src: Path, dst: Path, start: float, end: float, bitstream_filter: str):
+    """Get ffmpeg arguments to stream copy the video between the keyframes at
+    `start` and `end` from `src` to MPEG-TS, with in-band parameter sets."""
+    return (
+        "-ss", str(start + SEEK_SLACK),
+        "-i", str(src),
+        "-t", str(end - start - 2 * SEEK_SLACK),
+        "-map", "0:v:0",
+        "-an",
+        "-c:v", "copy",
+        "-bsf:v", bitstream_filter,
+        "-f", "mpegts",
+        str(dst),
+    )
+
+def audio_args(src: Path, dst: Path, start: float, end: float):
+    "Get ffmpeg arguments to stream copy the audio of `[start, end)` from `src`."
+    return (
+        "-ss", str(start),
+        "-i", str(src),
+        "-t", str(end - start),
+        "-map", "0:a",
+        "-c:a", "copy",
+        str(dst),
+    )
+
+def join(tmp: Path, names: Sequence[str], audio: Path, dst: Path):
+    "Concatenate video segments in `tmp`, add the audio, and move the result to `dst`."
+
+    concat = tmp / "concat.txt"
+    write_concat_list(concat, names)
+    out = tmp / dst.name
+    ffmpeg.run((
+        "-f", "concat",
+        "-safe", "0",
+        "-i", str(concat),
+        "-i", str(audio),
+        "-map", "0:v",
+        "-map", "1:a",
+        "-c", "copy",
+        str(out),
+    ))
+    os.replace(out, dst)
+
+def write_encoded(config: Config, src: Path, dst: Path, start: float, end: float):
+    "Re-encode `[start, end)` of `src` into `dst` with parallel chunk encoders."
+
+    chunks = plan_chunks(ffmpeg.keyframes(config, src), start, end, config.jobs)
+    workers = min(config.jobs, len(chunks))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with tempfile.TemporaryDirectory(prefix=".mvcs-", dir=str(dst.parent)) as tmp_s:
+        tmp = Path(tmp_s)
+        names = [f"chunk{i:05}.mkv" for i in range(len(chunks))]
+        audio = tmp / "audio.mka"
+
+        # The encoders are ffmpeg child processes, so threads are enough to keep them fed
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(ffmpeg.run, encode_args(config, src, tmp / name, *chunk, threads))
+                for (name, chunk) in zip(names, chunks)
+            ]
+            futures.append(pool.submit(ffmpeg.run, audio_args(src, audio, start, end)))
+            for future in futures:
+                future.result()
+
+        join(tmp, names, audio, dst)
+
+def smart_cut_encoder(info: Dict[str, str]) -> Optional[Tuple[str, ...]]:
+    """Get encoder arguments for boundary segments matching the codec, profile,
+    level, pixel format and colors of a source stream, or `None` if the source
+    cannot be matched."""
+
+    codec = SMART_CUT_CODECS.get(info.get("codec_name", ""))
+    if codec is None:
+        return None
+    profile = codec.profiles.get(info.get("profile", ""))
+    pix_fmt = info.get("pix_fmt", "")
+    if profile is None or not pix_fmt:
+        return None
+    encoder: Tuple[str, ...] = (*codec.encoder, "-profile:v", profile, "-pix_fmt", pix_fmt)
+    try:
+        level = int(info.get("level", ""))
+    except ValueError:
+        level = 0
+    if level > 0:
+        encoder = (*encoder, *codec.level(level))
+    for (entry, option) in COLOR_OPTIONS:
+        value = info.get(entry, "unknown")
+        if value and value != "unknown":
+            encoder = (*encoder, option, value)
+    return (*encoder, "-f", "mpegts")
+
+def write_smart_cut(config: Config, src: Path, dst: Path, start: float, end: float):
+    """Write `[start, end)` of `src` to `dst`, re-encoding only the boundary GOPs;
+    falls back to re-encoding the whole clip if the boundaries cannot match the
+    copied stream."""
+
+    info = ffmpeg.stream_info(src)
+    encoder = smart_cut_encoder(info)
+    if encoder is None:
+        video = " ".join(filter(None, (info.get("codec_name"), info.get("profile")))) or "unknown"
+        print(
+            f"re-encoding the whole clip: smart cut does not support {video} video: {src}",
+            file=sys.stderr,
+        )
+        write_encoded(config, src, dst, start, end)
+        return
+    bitstream_filter = SMART_CUT_CODECS[info["codec_name"]].bitstream_filter
+
+    segments = plan_smart_cut(ffmpeg.keyframes(config, src), start, end)
+    with tempfile.TemporaryDirectory(prefix=".mvcs-", dir=str(dst.parent)) as tmp_s:
+        tmp = Path(tmp_s)
+        names = [f"segment{i}.ts" for i in range(len(segments))]
+        audio = tmp / "audio.mka"
+
+        # Boundary segments are at most one GOP each, so they run side by side
+        with ThreadPoolExecutor(max_workers=len(segments) + 1) as pool:
+            futures = [
+                pool.submit(
+                    ffmpeg.run,
+                    copy_args(src, tmp / name, segment.start, segment.end, bitstream_filter)
+                    if segment.copy
+                    else (
+                        "-ss", str(segment.start),
+                        "-i", str(src),
+                        "-t", str(segment.end - segment.start),
+                        "-map", "0:v:0",
+                        "-an",
+                        *encoder,
+                        str(tmp / name),
+                    ),
+                )
+                for (name, segment) in zip(names, segments)
+            ]
+            futures.append(pool.submit(ffmpeg.run, audio_args(src, audio, start, end)))
+            for future in futures:
+                future.result()
+
+        # The encoder may still pick other parameters (e.g. a profile the
+        # options cannot express), and the joined stream would not decode
+        expected = tuple(info.get(key, "") for key in SMART_CUT_PARAMS)
+        for (name, segment) in zip(names, segments):
+            if segment.copy:
+                continue
+            got = ffmpeg.stream_info(tmp / name)
+            if tuple(got.get(key, "") for key in SMART_CUT_PARAMS) != expected:
+                print(
+                    f"re-encoding the whole clip: boundary segment does not match {src}",
+                    file=sys.stderr,
+                )
+                write_encoded(config, src, dst, start, end)
+                return
+
+        join(tmp, names, audio, dst)
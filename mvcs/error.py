@@ -2,3 +2,9 @@
 
 class Error(Exception):
     "Generic library exception."
+
+class TransientError(Error):
+    "Failure that may not happen again if the operation is retried."
+
+class UnsupportedError(Error):
+    "Input that an operation cannot handle, but a fallback may."
@@ -0,0 +1,209 @@
+"ffmpeg and ffprobe process module."
+
+import errno
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import IO, Dict, List, Sequence, Tuple
+
+from mvcs import cache, governor, trace
+from mvcs.config import Config
+from mvcs.error import Error, TransientError
+
+# ffmpeg log messages of failures that may not happen again.
+TRANSIENT_MESSAGES = re.compile(
+    r"Resource temporarily unavailable|No space left on device|Input/output error"
+    r"|Device or resource busy|Cannot allocate memory|Stale file handle"
+    r"|Connection (?:reset|refused|timed out)",
+    re.IGNORECASE,
+)
+# OS errors that may not happen again.
+TRANSIENT_ERRNOS = {
+    errno.EAGAIN, errno.EBUSY, errno.EINTR, errno.EIO, errno.ENOMEM, errno.ENOSPC, errno.ESTALE,
+}
+# Bytes at the end of an ffmpeg log that are kept to describe a failure.
+LOG_TAIL_SIZE = 16 * 1024
+
+def os_error(ex: OSError) -> Error:
+    "Get the error for a failed OS operation; transient if it may not happen again."
+    return TransientError(ex) if ex.errno in TRANSIENT_ERRNOS else Error(ex)
+
+def process_error(returncode: int, cmd: Sequence[str], log: str) -> Error:
+    "Get the error for a failed ffmpeg process; transient if its log says it may not happen again."
+    ex = subprocess.CalledProcessError(returncode, cmd)
+    lines = [line.strip() for line in log.splitlines() if line.strip()]
+    message = f"{ex}: {lines[-1]}" if lines else str(ex)
+    return TransientError(message) if TRANSIENT_MESSAGES.search(log) else Error(message)
+
+def follow_log(stream: IO[bytes]) -> str:
+    "Copy an ffmpeg log to stderr as it is written; returns the end of the log."
+
+    tail = b""
+    while True:
+        data = os.read(stream.fileno(), 4096)
+        if not data:
+            break
+        sys.stderr.write(data.decode("utf-8", errors="replace"))
+        sys.stderr.flush()
+        tail = (tail + data)[-LOG_TAIL_SIZE:]
+    return tail.decode("utf-8", errors="replace")
+
+def check_call(cmd: Sequence[str]):
+    "Run an ffmpeg command, raising `TransientError` only for failures that may not happen again."
+    try:
+        with subprocess.Popen(cmd, stderr=subprocess.PIPE) as proc:
+            assert proc.stderr is not None
+            log = follow_log(proc.stderr)
+    except OSError as ex:
+        raise os_error(ex)
+    if proc.returncode:
+        raise process_error(proc.returncode, cmd, log)
+
+def run(args: Sequence[str]):
+    "Run ffmpeg quietly with the given arguments."
+    with governor.slot(), trace.span("ffmpeg", output=args[-1] if args else ""):
+        check_call(("ffmpeg", "-nostdin", "-loglevel", "error", *args))
+
+def errors(args: Sequence[str]) -> List[str]:
+    "Run ffmpeg with the given arguments and return the errors it logged (and its failure)."
+
+    cmd = ("ffmpeg", "-nostdin", "-loglevel", "error", *args)
+    try:
+        with governor.slot(), trace.span("ffmpeg", output=args[-1] if args else ""):
+            proc = subprocess.run(
+                cmd,
+                check=False,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                errors="replace",
+            )
+    except OSError as ex:
+        raise Error(ex)
+    lines = [line.strip() for line in proc.stderr.splitlines() if line.strip()]
+    if proc.returncode:
+        lines.append(f"ffmpeg exited with {proc.returncode}")
+    return lines
+
+def tee_escape(text: str, special: str) -> str:
+    "Backslash-escape the `special` characters of `text` for the tee muxer."
+    return "".join(f"\\{char}" if char in special or char == "\\" else char for char in text)
+
+def output_args(outputs: Sequence[Tuple[Path, Dict[str, str]]]) -> Tuple[str, ...]:
+    """Get ffmpeg output arguments writing the same streams to every output.
+
+    Several outputs (or muxer options) are written by the tee muxer, so the
+    input is read and demuxed once for all of them.
+    """
+
+    if len(outputs) == 1 and not outputs[0][1]:
+        return (str(outputs[0][0]),)
+
+    slaves = []
+    for (path, options) in outputs:
+        # Options are unescaped once by the tee muxer and again per option
+        opts = ":".join(
+            f"{tee_escape(key, ':=]')}={tee_escape(value, ':=]')}"
+            for (key, value) in {"onfail": "abort", **options}.items()
+        )
+        slaves.append(tee_escape(f"[{opts}]{path}", "'|"))
+    return ("-f", "tee", "|".join(slaves))
+
+def remux(src: Path, outputs: Sequence[Tuple[Path, Dict[str, str]]]):
+    "Stream copy every stream of `src` to all `outputs` in one read."
+    run(("-i", str(src), "-map", "0", "-c", "copy", *output_args(outputs)))
+
+def concat(script: Path, outputs: Sequence[Tuple[Path, Dict[str, str]]]):
+    "Stream copy the video and audio joined by an ffconcat `script` to all `outputs`."
+    run((
+        "-f", "concat",
+        "-safe", "0",
+        "-i", str(script),
+        "-map", "0:v",
+        "-map", "0:a",
+        "-c", "copy",
+        *output_args(outputs),
+    ))
+
+def probe(args: Sequence[str]) -> str:
+    "Run ffprobe with the given arguments and return its output."
+
+    cmd = ("ffprobe", "-v", "error", *args)
+    try:
+        with trace.span("ffprobe", input=args[-1] if args else ""):
+            return subprocess.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+            ).stdout
+    except (OSError, subprocess.CalledProcessError) as ex:
+        raise Error(ex)
+
+def parse_entries(output: str) -> Dict[str, str]:
+    "Parse ffprobe `default=noprint_wrappers=1` key=value output."
+    entries = {}
+    for line in output.splitlines():
+        (key, sep, value) = line.strip().partition("=")
+        if sep:
+            entries[key] = value
+    return entries
+
+def stream_info(src: Path, stream: str = "v:0") -> Dict[str, str]:
+    "Get codec parameters of a source stream."
+    return parse_entries(probe((
+        "-select_streams", stream,
+        "-show_entries", (
+            "stream=codec_name,profile,level,pix_fmt,width,height,sample_rate,channels,"
+            "color_range,color_space,color_transfer,color_primaries"
+        ),
+        "-of", "default=noprint_wrappers=1",
+        str(src),
+    )))
+
+def parse_keyframes(output: str) -> List[float]:
+    "Parse keyframe timestamps from ffprobe `packet=pts_time,flags` CSV output."
+
+    times = []
+    for line in output.splitlines():
+        (pts, _, flags) = line.strip().partition(",")
+        if "K" not in flags:
+            continue
+        try:
+            times.append(float(pts))
+        except ValueError:
+            pass
+    times.sort()
+    return times
+
+def keyframes(config: Config, src: Path) -> List[float]:
+    "Get the (cached) video keyframe timestamps of a source file in seconds."
+
+    times = cache.load(config, "keyframes", src)
+    if times is None:
+        times = parse_keyframes(probe((
+            "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags",
+            "-of", "csv=p=0",
+            str(src),
+        )))
+        cache.store(config, "keyframes", src, times)
+    return times
+
+def duration(config: Config, src: Path) -> float:
+    "Get the (cached) duration of a source file in seconds."
+
+    seconds = cache.load(config, "duration", src)
+    if seconds is None:
+        output = probe((
+            "-show_entries", "format=duration",
+            "-of", "csv=p=0",
+            str(src),
+        ))
+        try:
+            seconds = float(output.strip())
+        except ValueError:
+            raise Error(f"cannot read duration: {src}")
+        cache.store(config, "duration", src, seconds)
+    return seconds
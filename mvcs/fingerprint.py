@@ -0,0 +1,296 @@
+"Perceptual fingerprint index module."
+
+import json
+import os
+import re
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Type, TypeVar
+
+np: Any
+try:
+    import numpy as np # type: ignore
+except ImportError: # pragma: no cover
+    np = None
+
+from mvcs import cache
+from mvcs.analyze import require_numpy
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Job
+
+# Size of the grayscale frames that are hashed.
+FRAME_SIZE = 32
+# Maximum Hamming distance between hashes of the same moment.
+MATCH_DISTANCE = 6
+# Number of 16-bit substrings used for multi-index hashing.
+CHUNKS = 4
+# Fraction of a clip's keyframes that must match for a duplicate.
+DUPLICATE_FRACTION = 0.5
+# Presentation time of a frame in the log of the showinfo filter.
+SHOWINFO_TIME = re.compile(r"\[Parsed_showinfo_\d+ @ [^]]*\] n: *\d+ .*\bpts_time:(\S+)")
+
+def dct_matrix(size: int) -> Any:
+    "Get the orthonormal DCT-II matrix."
+    (row, col) = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * col + 1) * row / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+def phash(frames: Any) -> Any:
+    "Get 64-bit DCT perceptual hashes of `(n, 32, 32)` grayscale frames."
+
+    require_numpy()
+    matrix = dct_matrix(FRAME_SIZE)
+    coeffs = matrix @ frames.astype(np.float32) @ matrix.T
+    low = coeffs[:, :8, :8].reshape(len(frames), 64)
+    # The DC coefficient is excluded from the median so brightness doesn't dominate
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+def popcount(values: Any) -> Any:
+    "Count set bits of each uint64 value."
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    bits = np.unpackbits(np.ascontiguousarray(values).view(np.uint8).reshape(-1, 8), axis=1)
+    return bits.sum(axis=1)
+
+def chunk_values(hashes: Any) -> Any:
+    "Split hashes into `(CHUNKS, n)` 16-bit substrings."
+    shifts = np.arange(CHUNKS - 1, -1, -1, dtype=np.uint64)[:, None] * np.uint64(16)
+    return ((hashes[None, :] >> shifts) & np.uint64(0xFFFF)).astype(np.uint16)
+
+def neighbours(value: int, radius: int) -> List[int]:
+    "Get all 16-bit values within a Hamming radius of `value`."
+    values = [value]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(16), distance):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+IndexType = TypeVar("IndexType", bound="FingerprintIndex")
+class FingerprintIndex(NamedTuple):
+    "Keyframe hashes of many files, searchable by Hamming distance."
+
+    # Indexed file paths.
+    sources: List[str]
+    # Index into `sources` for each hash.
+    source_ids: Any
+    # File timestamp of each hash in seconds.
+    times: Any
+    # 64-bit perceptual hashes.
+    hashes: Any
+    # Sorted 16-bit substrings of the hashes, one row per substring.
+    chunks: Any
+    # Hash index for each entry of `chunks`.
+    order: Any
+
+    @classmethod
+    def build(
+            cls: Type[IndexType],
+            entries: Sequence[Tuple[str, Any, Any]],
+    ) -> IndexType:
+        "Build an index from `(path, times, hashes)` entries."
+
+        require_numpy()
+        sources = [path for (path, _, _) in entries]
+        source_ids = np.concatenate([
+            np.full(len(hashes), i, dtype=np.int32)
+            for (i, (_, _, hashes)) in enumerate(entries)
+        ] or [np.zeros(0, dtype=np.int32)])
+        times = np.concatenate([t for (_, t, _) in entries] or [np.zeros(0)]).astype(np.float64)
+        hashes = np.concatenate(
+            [h for (_, _, h) in entries] or [np.zeros(0, dtype=np.uint64)]
+        ).astype(np.uint64)
+        chunks = chunk_values(hashes)
+        order = np.argsort(chunks, axis=1, kind="stable").astype(np.int64)
+        return cls(
+            sources=sources,
+            source_ids=source_ids,
+            times=times,
+            hashes=hashes,
+            chunks=np.take_along_axis(chunks, order, axis=1),
+            order=order,
+        )
+
+    @classmethod
+    def load(cls: Type[IndexType], path: Path) -> IndexType:
+        "Memory-map an index saved with `save`."
+
+        require_numpy()
+        try:
+            with (path / "sources.json").open(encoding="utf-8") as file:
+                sources = json.load(file)
+            arrays = {
+                name: np.load(str(path / f"{name}.npy"), mmap_mode="r")
+                for name in ("source_ids", "times", "hashes", "chunks", "order")
+            }
+        except (OSError, ValueError) as ex:
+            raise Error(f"cannot load fingerprint index: {ex}")
+        return cls(sources=sources, **arrays) # type: ignore
+
+    def save(self, path: Path):
+        "Save the index as memory-mappable arrays."
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ("source_ids", "times", "hashes", "chunks", "order"):
+            np.save(str(path / f"{name}.npy"), getattr(self, name))
+        with (path / "sources.json").open("w", encoding="utf-8") as file:
+            json.dump(self.sources, file)
+
+    def search(self, value: int, distance: int = MATCH_DISTANCE) -> Any:
+        "Get indices of hashes within `distance` bits of `value`."
+
+        # Any hash within `distance` bits matches at least one substring within
+        # `distance // CHUNKS` bits (pigeonhole), so only those are verified.
+        radius = distance // CHUNKS
+        candidates: List[Any] = []
+        for (row, sub) in enumerate(chunk_values(np.array([value], dtype=np.uint64))[:, 0]):
+            probes = np.array(neighbours(int(sub), radius), dtype=np.uint16)
+            lows = np.searchsorted(self.chunks[row], probes, side="left")
+            highs = np.searchsorted(self.chunks[row], probes, side="right")
+            candidates.extend(self.order[row][low:high] for (low, high) in zip(lows, highs))
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        found = np.unique(np.concatenate(candidates))
+        distances = popcount(self.hashes[found] ^ np.uint64(value))
+        return found[distances <= distance]
+
+    def matches(self, times: Any, hashes: Any) -> List[Tuple[str, float, int]]:
+        "Get `(path, offset, frames)` of files containing the hashed frames, best first."
+
+        votes: Counter = Counter()
+        for (time, value) in zip(times.tolist(), hashes.tolist()):
+            for found in self.search(value).tolist():
+                # Matches of one moment agree on the offset between the two files
+                offset = round(float(self.times[found]) - time)
+                votes[(int(self.source_ids[found]), offset)] += 1
+        return [
+            (self.sources[source_id], float(offset), count)
+            for ((source_id, offset), count) in votes.most_common()
+        ]
+
+def index_dir(config: Config) -> Path:
+    "Get the directory of the fingerprint index."
+    return config.cache_dir / "fingerprints"
+
+def parse_showinfo_times(output: str) -> List[float]:
+    "Parse the presentation times of the frames logged by the showinfo filter."
+    return [float(match.group(1)) for match in SHOWINFO_TIME.finditer(output)]
+
+def hash_file(config: Config, path: Path) -> Tuple[Any, Any]:
+    "Get (cached) keyframe times and perceptual hashes of a video file."
+
+    require_numpy()
+    cached = cache.cache_path(config, "keyframe-phash", path, ".npy")
+    if cached.is_file():
+        data = np.load(str(cached))
+        return (data["time"], data["hash"])
+
+    # The decoder can drop or reorder keyframes, so their times come from the
+    # frames it outputs (logged by showinfo) rather than from the demuxer
+    cmd = (
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "info",
+        "-skip_frame", "nokey",
+        "-i", str(path),
+        "-map", "0:v:0",
+        "-fps_mode", "passthrough",
+        "-vf", f"scale={FRAME_SIZE}:{FRAME_SIZE},format=gray,showinfo",
+        "-f", "rawvideo",
+        "pipe:1",
+    )
+    try:
+        proc = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError) as ex:
+        raise Error(ex)
+    frames = np.frombuffer(proc.stdout, dtype=np.uint8)
+    frames = frames[:len(frames) // FRAME_SIZE ** 2 * FRAME_SIZE ** 2]
+    frames = frames.reshape(-1, FRAME_SIZE, FRAME_SIZE)
+    times = np.array(parse_showinfo_times(proc.stderr.decode(errors="replace")), dtype=np.float64)
+    count = min(len(frames), len(times))
+
+    data = np.zeros(count, dtype=[("time", "<f8"), ("hash", "<u8")])
+    data["time"] = times[:count]
+    data["hash"] = phash(frames[:count])
+    try:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp.npy")
+        np.save(str(tmp), data)
+        os.replace(tmp, cached)
+    except OSError:
+        pass
+    return (data["time"], data["hash"])
+
+def scan_files(directory: Path, ext: str) -> List[Path]:
+    "List files with an extension in a directory with a single scan."
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(
+                Path(entry.path).resolve() for entry in entries
+                if entry.is_file() and entry.name.endswith(f".{ext}")
+            )
+    except OSError as ex:
+        raise Error(ex)
+
+def update_index(config: Config, job: Job) -> FingerprintIndex:
+    "Hash new source recordings and output clips and rebuild the index."
+
+    require_numpy()
+    paths = scan_files(job.video_dir, config.video_ext) \
+            + scan_files(job.output_dir, config.output_ext)
+    # Hashing runs in ffmpeg children, so threads are enough to overlap files
+    with ThreadPoolExecutor(max_workers=config.jobs) as pool:
+        hashed = list(pool.map(lambda path: hash_file(config, path), paths))
+    index = FingerprintIndex.build([
+        (str(path), times, hashes) for (path, (times, hashes)) in zip(paths, hashed)
+    ])
+    index.save(index_dir(config))
+    return index
+
+def load_index(config: Config) -> Optional[FingerprintIndex]:
+    "Load the fingerprint index if it has been built (and numpy is available)."
+    path = index_dir(config)
+    if np is None or not (path / "sources.json").is_file():
+        return None
+    return FingerprintIndex.load(path)
+
+def match_file(config: Config, index: FingerprintIndex, path: Path) -> List[Tuple[str, float, int]]:
+    "Find where the moments of a video file appear in other indexed files."
+    (times, hashes) = hash_file(config, path)
+    own = str(path.resolve())
+    return [match for match in index.matches(times, hashes) if match[0] != own]
+
+def duplicate_clips(
+        config: Config,
+        job: Job,
+        index: FingerprintIndex,
+) -> Dict[Path, str]:
+    "Map clips that would be extracted to existing outputs with the same content."
+
+    require_numpy()
+    output_dir = job.output_dir.resolve()
+    sources = {path: source_id for (source_id, path) in enumerate(index.sources)}
+    duplicates = {}
+    for (video, dsts) in zip(job.videos, job.output_paths(config)):
+        source_id = sources.get(str(video.src_path(config, job.video_dir).resolve()))
+        if source_id is None:
+            continue
+        mask = np.asarray(index.source_ids) == source_id
+        (times, hashes) = (np.asarray(index.times)[mask], np.asarray(index.hashes)[mask])
+        for (clip, dst) in zip(video.clips, dsts):
+            if dst is None or dst.exists():
+                continue
+            inside = (times >= clip.start.total_seconds()) & (times < clip.end.total_seconds())
+            if not inside.any():
+                continue
+            for (path, _, count) in index.matches(times[inside], hashes[inside]):
+                if Path(path).parent == output_dir \
+                        and count >= DUPLICATE_FRACTION * inside.sum():
+                    duplicates[dst] = path
+                    break
+    return duplicates
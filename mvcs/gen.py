@@ -45,15 +45,13 @@
 #             title: "after the epoch"
 
 import os.path
-from os.path import isfile, join
-from os import listdir
 import yaml
 from datetime import datetime
 from datetime import timedelta
 import pathlib
 from mvcs.config import Config
 from mvcs.time import datetime_from_str, datetime_to_str, timedelta_from_str, timedelta_to_str, timedelta_to_path_str
-from mvcs.job import Video
+from mvcs.job import Clip, Video, include_paths
 from mvcs.error import Error
 
 def generate_template(document, output_dir, video_dir):
@@ -85,24 +83,62 @@ def check_template(document, output_dir, video_dir):
 #     path_str = f"{date_str} - T+{start_str} - {title} - {self.title}.mkv"
 #     return re.sub(r"[/\:]", "-", path_str.casefold())
 
-def current_time():
-    return datetime.now()
-
-def latest_video(config: Config, date_time, extension, path):
-    onlyfiles = [f for f in listdir(path) if isfile(join(path, f))]
-    extension = [item for item in onlyfiles if extension in item]
+def shard_router(document):
+    """Get a function mapping video dates to the job file that should hold them.
 
-    video_list = []
-
-    for item in extension:
-        video = Video.from_path(config, pathlib.Path(item))._replace(title=item)
-
-        video_list.append(video)
+    Jobs with a `shard-format` (a strftime pattern relative to the job file)
+    keep each video in the shard named by its date; the shard is created and
+    included on first use. Otherwise the included shard that already lists the
+    video is used, falling back to the job file itself.
+    """
+    document = pathlib.Path(document)
+    with open(document, "r") as f:
+        contents = yaml.safe_load(f) or {}
+    shards = include_paths(document, contents)
+    shard_format = contents.get('shard-format')
+    known = None
+
+    def route(date):
+        nonlocal known
+        if shard_format:
+            relative = date.strftime(str(shard_format))
+            shard = document.parent / relative
+            if shard not in shards:
+                include = contents.get('include') or []
+                if isinstance(include, str):
+                    include = [include]
+                shards.append(shard)
+                # A new shard may already be covered by an include pattern
+                if not any(shard.match(str(document.parent / pattern)) for pattern in include):
+                    contents['include'] = include + [relative]
+                    with open(document, "w") as f:
+                        yaml.safe_dump(contents, f)
+            if not shard.exists():
+                shard.parent.mkdir(parents=True, exist_ok=True)
+                with open(shard, "w") as f:
+                    yaml.safe_dump({'videos': []}, f)
+            return shard
+
+        if known is None:
+            known = {}
+            for shard in shards:
+                with open(shard, "r") as f:
+                    data = yaml.safe_load(f) or {}
+                for video in data.get('videos') or []:
+                    known.setdefault(datetime_from_str(str(video['date'])), shard)
+        return known.get(date, document)
+
+    return route
+
+def shard_path(document, date):
+    "Get the job file that holds (or should hold) the video recorded at `date`."
+    return shard_router(document)(date)
 
-    video_list = sorted(video_list, key=lambda x: x.date)
-    return video_list[-1]
+def current_time():
+    return datetime.now()
 
 def add_video(document, date_time, epoch, title):
+    document = shard_path(document, date_time.date)
     date_time = datetime_to_str(date_time.date)
     print(date_time)
     print(type(date_time))
@@ -164,8 +200,64 @@ def add_video(document, date_time, epoch, title):
                 return date_time
                 print("End of video function.")
 
-def add_clip(document, latest_video, window, title):
+def coalesce_clip(clips, window, title, gap):
+    """Add a clip window to a video's clip entries, merging it with nearby clips.
+
+    Clips with the same title that overlap the window or are within `gap`
+    seconds of it are replaced by one clip spanning all of them, so a burst of
+    triggers becomes a single clip. Returns the resulting clip entry.
+    """
+    new = Clip.from_dict({'time': window, 'title': title})
+    (start, end) = (new.start, new.end)
+    gap = timedelta(seconds=gap)
+
+    spans = []
+    for (index, entry) in enumerate(clips):
+        if str(entry.get('title')) != title:
+            continue
+        try:
+            clip = Clip.from_dict(entry)
+        except Error:
+            continue
+        spans.append((clip.start, clip.end, index))
+
+    # Sweep the spans by start, extending each run of overlapping spans, until
+    # the run holding the new window ends
+    spans.append((start, end, None))
+    spans.sort(key=lambda span: (span[0], span[1]))
+    merged = set()
+    found = False
+    (start, end) = spans[0][:2]
+    for (span_start, span_end, index) in spans:
+        if span_start > end + gap:
+            if found:
+                break
+            merged = set()
+            start = span_start
+        end = max(end, span_end)
+        if index is None:
+            found = True
+        else:
+            merged.add(index)
+
+    data = {
+        'time': f"{timedelta_to_str(start)} - {timedelta_to_str(end)}",
+        'title': title
+    }
+    if not merged:
+        clips.append(data)
+        return data
+
+    # Keep the earliest merged clip's place in the list
+    (first, *rest) = sorted(merged)
+    clips[first] = data
+    for index in reversed(rest):
+        del clips[index]
+    return data
+
+def add_clip(document, video, window, title, coalesce=0):
     print("Clipping")
+    document = shard_path(document, video.date)
     with open(document, "r") as f:
         contents = yaml.safe_load(f)
 
@@ -175,42 +267,106 @@ def add_clip(document, latest_video, window, title):
     }
 
     for item in contents['videos']:
-        if item['date'] == datetime_to_str(latest_video.date):
+        if item['date'] == datetime_to_str(video.date):
             print("Before: ", str(item))
-            item['clips'].append(data)
+            if not item.get('clips'):
+                item['clips'] = []
+            if coalesce > 0:
+                coalesce_clip(item['clips'], window, title, coalesce)
+            else:
+                item['clips'].append(data)
             print("After: ", str(item))
         
     with open(document, "w") as f:
         yaml.safe_dump(contents, f)
 
-def trigger_clip(config: Config, video_time, clip_before_length, clip_after_length, document, latest_video, title):
-    time = current_time()
-    relative_time = time - latest_video.date
-
-    clip_before_length = timedelta(seconds=clip_before_length)
-    clip_after_length = timedelta(seconds=clip_after_length)
-
-    print("Current Time: {}".format(time))
-    print("Latest Video Time: {}".format(latest_video.date))
-    print("Relative Time: {}".format(relative_time))
-
-    start_window = relative_time - clip_before_length
-    start_window = timedelta_to_str(start_window)
-
-    end_window = relative_time + clip_after_length
-    end_window = timedelta_to_str(end_window)
-
+def timeline_clip(config: Config, timeline, when, clip_before_length, clip_after_length, document, title):
+    """Add a clip around the wall-clock time `when` to the recording it starts in.
+
+    The window may start in an earlier recording than `when` (across OBS file
+    splits) or lie in the past; clip times are wall-clock offsets from the
+    start of the first recording, so the clip continues into the next ones.
+    """
+    start = when - timedelta(seconds=clip_before_length)
+    end = when + timedelta(seconds=clip_after_length)
+    parts = timeline.covering(start, end)
+    if not parts:
+        raise Error(f"no recording at {when}")
+
+    recording = parts[0].recording
+    video = Video(date=recording.start, title="Video")
+    start_window = timedelta_to_str(parts[0].start)
+    end_window = timedelta_to_str(end - recording.start)
+    window = f"{start_window} - {end_window}"
+    print("Recording: {}".format(recording.path))
+    print("Window: {}".format(window))
 
-    print("Start Window: {}".format(start_window))
-    print("End Window: {}".format(end_window))
+    add_video(document, video, 0, "Video")
+    add_clip(document, video, window, title, config.coalesce)
+    return window
+
+def clips_document(clips):
+    """Get a job-shaped document with clip entries keyed by video date.
+
+    The result can be printed as YAML and merged into a job by hand or with
+    `merge_clips`.
+    """
+    return {
+        'videos': [
+            {'date': datetime_to_str(date), 'clips': entries}
+            for (date, entries) in sorted(clips.items())
+            if entries
+        ]
+    }
 
-    # # Fix if less than 0
-    # if start_window <= 0:
-    #     start_window = 0
+def merge_clips(document, clips, title="Video"):
+    """Merge clip entries keyed by video date into the job in one write per file.
+
+    Videos missing from the job are added (to their shard, see `shard_path`),
+    and clips whose time is already listed for their video are skipped.
+    Returns the number of clips added.
+    """
+    route = shard_router(document)
+    shards = {}
+    for (date, entries) in clips.items():
+        shards.setdefault(route(date), {})[date] = entries
+    return sum(
+        merge_document_clips(shard, shard_clips, title)
+        for (shard, shard_clips) in shards.items()
+    )
+
+def merge_document_clips(document, clips, title):
+    "Merge clip entries keyed by video date into a single job file."
+    with open(document, "r") as f:
+        contents = yaml.safe_load(f) or {}
+
+    videos = contents.get('videos') or []
+    contents['videos'] = videos
+    by_date = {datetime_from_str(str(video['date'])): video for video in videos}
+
+    added = 0
+    for (date, entries) in clips.items():
+        video = by_date.get(date)
+        if video is None:
+            video = {
+                'date': datetime_to_str(date),
+                'epoch': 0,
+                'title': title,
+                'clips': []
+            }
+            videos.append(video)
+            by_date[date] = video
+
+        if not video.get('clips'):
+            video['clips'] = []
+        existing = {str(clip['time']) for clip in video['clips']}
+        for entry in entries:
+            if entry['time'] not in existing:
+                video['clips'].append(entry)
+                existing.add(entry['time'])
+                added += 1
 
-    window = str(start_window) + " - " + str(end_window)
-    print("Window: {}".format(window))
+    with open(document, "w") as f:
+        yaml.safe_dump(contents, f)
 
-    print(type(latest_video.date))
-    
-    add_clip(document, latest_video, window, title)
+    return added
@@ -0,0 +1,236 @@
+"Adaptive concurrency module for running alongside live recording."
+
+import contextlib
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from mvcs.config import Config
+
+# Seconds between samples of the system load.
+SAMPLE_INTERVAL = 1.0
+# A recording modified more recently than this is considered still growing.
+RECORDING_IDLE_SECONDS = 10.0
+# CPU niceness of extraction in background mode.
+NICENESS = 10
+
+# Running governor, or `None` when background mode is disabled.
+_governor: Optional["Governor"] = None
+# Shared no-op context returned by `slot` when background mode is disabled.
+_DISABLED = contextlib.nullcontext()
+
+class Load(NamedTuple):
+    "Sample of the system load."
+
+    # 1-minute load average per CPU.
+    cpu: float
+    # In-flight I/O requests on the busiest watched disk.
+    disk_queue: int
+    # Highest CPU or I/O pressure stall percentage (10 second average).
+    pressure: float
+
+def read_proc(path: str) -> str:
+    "Read a /proc file, or get an empty string where it is not available."
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read()
+    except OSError:
+        return ""
+
+def parse_loadavg(text: str) -> float:
+    "Parse the 1-minute load average from /proc/loadavg."
+    try:
+        return float(text.split()[0])
+    except (IndexError, ValueError):
+        return 0.0
+
+def parse_disk_queue(text: str, devices: Set[Tuple[int, int]]) -> int:
+    "Parse the most in-flight I/O requests of any of `devices` from /proc/diskstats."
+    queue = 0
+    for line in text.splitlines():
+        fields = line.split()
+        try:
+            if (int(fields[0]), int(fields[1])) in devices:
+                queue = max(queue, int(fields[11]))
+        except (IndexError, ValueError):
+            continue
+    return queue
+
+def parse_pressure(text: str) -> float:
+    "Parse the 10 second `some` stall percentage from a /proc/pressure file."
+    for line in text.splitlines():
+        fields = line.split()
+        if fields and fields[0] == "some":
+            for field in fields[1:]:
+                (key, _, value) = field.partition("=")
+                if key == "avg10":
+                    try:
+                        return float(value)
+                    except ValueError:
+                        return 0.0
+    return 0.0
+
+def disk_devices(*paths: Path) -> Set[Tuple[int, int]]:
+    "Get the (major, minor) numbers of the devices holding `paths`."
+    devices = set()
+    for path in paths:
+        try:
+            dev = path.stat().st_dev
+        except OSError:
+            continue
+        devices.add((os.major(dev), os.minor(dev)))
+    return devices
+
+def sample(devices: Set[Tuple[int, int]]) -> Load:
+    "Sample the current system load."
+    return Load(
+        cpu=parse_loadavg(read_proc("/proc/loadavg")) / (os.cpu_count() or 1),
+        disk_queue=parse_disk_queue(read_proc("/proc/diskstats"), devices),
+        pressure=max(
+            parse_pressure(read_proc("/proc/pressure/cpu")),
+            parse_pressure(read_proc("/proc/pressure/io")),
+        ),
+    )
+
+def growing_recording(config: Config, now: float) -> Optional[Path]:
+    "Get the newest recording in the video directory if it is still being written."
+
+    (newest, newest_mtime) = (None, 0.0)
+    try:
+        with os.scandir(config.video_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(f".{config.video_ext}") or not entry.is_file():
+                    continue
+                mtime = entry.stat().st_mtime
+                if newest is None or mtime > newest_mtime:
+                    (newest, newest_mtime) = (Path(entry.path), mtime)
+    except OSError:
+        return None
+
+    if newest is not None and now - newest_mtime < RECORDING_IDLE_SECONDS:
+        return newest
+    return None
+
+def lower_priority():
+    "Run this process and the ffmpeg children it starts at idle CPU and I/O priority."
+    os.nice(NICENESS)
+    try:
+        # I/O priority is inherited by children, like niceness
+        subprocess.run(
+            ("ionice", "-c", "3", "-p", str(os.getpid())),
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+class Governor:
+    "Limit concurrent ffmpeg workers to what the machine can spare."
+
+    def __init__(self, config: Config):
+        self.config = config
+        # Configurations whose video directories may hold a live recording.
+        self.watched: List[Config] = [config]
+        self.devices = disk_devices(config.video_dir, config.output_dir)
+        # Start with a single worker and ramp up while the machine stays idle
+        self.limit = 1
+        self.active = 0
+        self.paused: Optional[Path] = None
+        self.sampled = float("-inf")
+        self.condition = threading.Condition()
+
+    def watch(self, configs: Sequence[Config]):
+        "Watch the video and output directories of the jobs being run."
+        with self.condition:
+            self.watched = list(configs)
+            self.devices = disk_devices(*(
+                path for config in configs for path in (config.video_dir, config.output_dir)
+            ))
+            # Sample the new devices before the next worker starts
+            self.sampled = float("-inf")
+
+    def overloaded(self, load: Load) -> bool:
+        "Check whether a load sample exceeds any configured threshold."
+        return (
+            load.cpu > self.config.max_load
+            or load.disk_queue > self.config.max_disk_queue
+            or load.pressure > self.config.max_pressure
+        )
+
+    def adjust(self, load: Load):
+        "Halve the worker limit when overloaded, otherwise allow one more worker."
+        if self.overloaded(load):
+            self.limit = max(1, self.limit // 2)
+        else:
+            self.limit = min(self.config.jobs, self.limit + 1)
+
+    def update(self):
+        "Sample the system and update the limit, if a sample is due."
+
+        now = time.monotonic()
+        if now - self.sampled < SAMPLE_INTERVAL:
+            return
+        self.sampled = now
+
+        wall_time = time.time()
+        paused = next((
+            recording for recording in (
+                growing_recording(config, wall_time) for config in self.watched
+            ) if recording is not None
+        ), None)
+        if paused is not None and paused != self.paused:
+            print(f"waiting for recording to finish: {paused}")
+        self.paused = paused
+        self.adjust(sample(self.devices))
+
+    def acquire(self):
+        "Wait for a worker slot."
+        with self.condition:
+            while True:
+                self.update()
+                if self.paused is None and self.active < self.limit:
+                    self.active += 1
+                    return
+                self.condition.wait(SAMPLE_INTERVAL)
+
+    def release(self):
+        "Release a worker slot."
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[None]:
+        "Hold a worker slot for the duration of the context."
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+def start(config: Config):
+    "Lower the process priority and start governing ffmpeg workers."
+    global _governor # pylint: disable=global-statement
+    lower_priority()
+    _governor = Governor(config)
+
+def watch(configs: Sequence[Config]):
+    """Point the governor at the directories of the jobs being run (they are
+    only known once the jobs are loaded)."""
+    if _governor is not None:
+        _governor.watch(configs)
+
+def stop():
+    "Stop governing ffmpeg workers."
+    global _governor # pylint: disable=global-statement
+    _governor = None
+
+def slot():
+    "Get a context manager holding a worker slot (a shared no-op when not governed)."
+    if _governor is None:
+        return _DISABLED
+    return _governor.slot()
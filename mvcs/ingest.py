@@ -0,0 +1,160 @@
+"Bulk clip marker ingestion module."
+
+import datetime
+import json
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.time import datetime_from_str, timedelta_from_str, timedelta_to_str
+from mvcs.timeline import Timeline
+
+# Default seconds of recording kept before a marker.
+CLIP_BEFORE = 300.0
+# Default seconds of recording kept after a marker.
+CLIP_AFTER = 30.0
+# Default title of marker clips.
+TITLE = "marker"
+# Shortest wall-clock range, used to find the recording running at a moment.
+MOMENT = datetime.timedelta(microseconds=1)
+
+class Marker(NamedTuple):
+    "Moment in a recording to clip around."
+
+    # Start time of the recording.
+    date: datetime.datetime
+    # Offset of the marker in the recording.
+    offset: datetime.timedelta
+    # Clip title.
+    title: str
+    # Length of recording kept before the marker.
+    before: datetime.timedelta
+    # Length of recording kept after the marker.
+    after: datetime.timedelta
+
+def locate(timeline: Timeline, when: datetime.datetime) -> Optional[datetime.datetime]:
+    """Get the start of the recording running at `when`, or `None` if it lies
+    before, between or after the recordings."""
+    parts = timeline.covering(when, when + MOMENT)
+    return parts[0].recording.start if parts else None
+
+def parse_datetime(value: Any) -> datetime.datetime:
+    "Parse a wall-clock time: ISO 8601 text or a Unix timestamp."
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.datetime.fromtimestamp(value)
+    try:
+        when = datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return datetime_from_str(str(value))
+    if when.tzinfo is not None:
+        # Recording names use local time
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+def parse_seconds(value: Any) -> datetime.timedelta:
+    "Parse a duration: a number of seconds or `[H:]M:S` text."
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.timedelta(seconds=value)
+    return timedelta_from_str(str(value))
+
+def parse_marker(record: Dict[str, Any], timeline: Timeline) -> Optional[Marker]:
+    """Convert a marker record, or get `None` if no recording contains it.
+
+    Records have a wall-clock `time`, or a recording `video` date and an
+    `offset` into it, and optional `title`, `before` and `after` fields.
+    """
+
+    if "offset" in record:
+        if "video" not in record:
+            raise Error("relative markers need a video date")
+        date = parse_datetime(record["video"])
+        offset = parse_seconds(record["offset"])
+    elif "time" in record:
+        when = parse_datetime(record["time"])
+        located = locate(timeline, when)
+        if located is None:
+            return None
+        (date, offset) = (located, when - located)
+    else:
+        raise Error("markers need a time, or a video and an offset")
+
+    return Marker(
+        date=date,
+        offset=offset,
+        title=str(record.get("title", TITLE)),
+        before=parse_seconds(record.get("before", CLIP_BEFORE)),
+        after=parse_seconds(record.get("after", CLIP_AFTER)),
+    )
+
+def read_markers(
+        lines: Iterable[str],
+        timeline: Timeline,
+        source: str,
+) -> Iterator[Optional[Marker]]:
+    """Stream markers from JSON lines (`None` for markers outside every
+    recording, which are reported on standard error)."""
+    for (number, line) in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise Error(f"invalid marker: {record}")
+            marker = parse_marker(record, timeline)
+        except (Error, ValueError, TypeError, OverflowError) as ex:
+            raise Error(f"{source}:{number}: {ex}")
+        if marker is None:
+            print(f"{source}:{number}: no recording at {record['time']}", file=sys.stderr)
+        yield marker
+
+def marker_windows(
+        markers: Iterable[Marker],
+        gap: float,
+) -> Dict[datetime.datetime, List[Dict[str, str]]]:
+    """Convert markers to clip entries keyed by recording.
+
+    Windows with the same title that overlap, or are within `gap` seconds of
+    each other, are merged, so duplicate and clustered markers become one clip.
+    """
+
+    windows: Dict[Tuple[datetime.datetime, str], List[Tuple[datetime.timedelta, datetime.timedelta]]]
+    windows = {}
+    for marker in markers:
+        start = max(datetime.timedelta(0), marker.offset - marker.before)
+        windows.setdefault((marker.date, marker.title), []).append(
+            (start, marker.offset + marker.after),
+        )
+
+    spacing = datetime.timedelta(seconds=gap)
+    clips: Dict[datetime.datetime, List[Dict[str, str]]] = {}
+    for ((date, title), spans) in sorted(windows.items()):
+        spans.sort()
+        merged = [list(spans[0])]
+        for (start, end) in spans[1:]:
+            if start <= merged[-1][1] + spacing:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        clips.setdefault(date, []).extend(
+            {"time": f"{timedelta_to_str(start)} - {timedelta_to_str(end)}", "title": title}
+            for (start, end) in merged
+        )
+    return clips
+
+def ingest(
+        config: Config,
+        lines: Iterable[str],
+        source: str,
+) -> Tuple[Dict[datetime.datetime, List[Dict[str, str]]], int, int]:
+    "Convert a stream of markers to clip entries; also returns the marker and skipped counts."
+
+    timeline = Timeline.scan(config, config.video_dir)
+    (markers, count, skipped) = ([], 0, 0)
+    for marker in read_markers(lines, timeline, source):
+        count += 1
+        if marker is None:
+            skipped += 1
+        else:
+            markers.append(marker)
+    return (marker_windows(markers, config.coalesce), count, skipped)
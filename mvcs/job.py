@@ -1,16 +1,25 @@
 "Job execution module."
 
 import datetime
-import subprocess
-from itertools import chain
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Any, Dict, List, NamedTuple, Type, TypeVar
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Type, TypeVar
 
 import yaml
 
-from mvcs.config import Config
-from mvcs.error import Error
-from mvcs.time import datetime_from_str, timedelta_from_str, timedelta_to_path_str
+from mvcs import catalog, encode, ffmpeg, governor, manifest, mp4, names, readahead, timeline, trace
+from mvcs.config import Config, Target, WriteMode, targets_from_list
+from mvcs.error import Error, TransientError, UnsupportedError
+from mvcs.time import datetime_from_str, datetime_to_str, timedelta_from_str, timedelta_to_str
+
+# Delay before the first retry of a failed clip in seconds (doubles per retry).
+RETRY_DELAY = 1.0
 
 ClipType = TypeVar("ClipType", bound="Clip")
 class Clip(NamedTuple):
@@ -31,8 +40,8 @@ class Clip(NamedTuple):
             clip: Dict[str, Any] = {
                 "title": str(data["title"]),
             }
-            time = [timedelta_from_str(t.strip()) for t in str(data["time"]).split("-", maxsplit=1)]
-            (clip["start"], clip["end"]) = time
+            span = [timedelta_from_str(t.strip()) for t in str(data["time"]).split("-", maxsplit=1)]
+            (clip["start"], clip["end"]) = span
         except (KeyError, ValueError) as ex:
             raise Error(f"bad clip data: {ex}: {data}")
 
@@ -52,31 +61,82 @@ class Clip(NamedTuple):
             title: str,
     ) -> str:
         "Get the file name for a clip."
+        return names.renderer(config).clip_name(date, epoch, title, self.start, self.title)
 
-        path_str = " - ".join((
-            (date + epoch).strftime("%Y-%m-%d %H:%M:%S"),
-            f"T+{timedelta_to_path_str(self.start - epoch)}",
-            title,
-            f"{self.title}",
-        )).casefold()
-
-        for (old, new) in chain(
-                ((bad, "-") for bad in "\"*/:?\\|<>"),
-                config.filename_replace.items(),
-        ):
-            path_str = path_str.replace(old, new)
-
-        return ".".join((path_str, config.output_ext))
+    def write(
+            self,
+            config: Config,
+            src: Path,
+            dst: Path,
+            parts: Sequence[timeline.Part] = (),
+    ) -> Optional[manifest.Checksum]:
+        """Use ffmpeg to write the video clip file.
+
+        A clip that runs past a recording split is joined from its `parts` in
+        the consecutive recordings. With `checksum`, returns the checksum of a
+        newly written clip.
+        """
+
+        with trace.span("Clip.write", clip=self.title, start=self.start, end=self.end, dst=dst):
+            existed = dst.exists()
+            self._write(config, src, dst, parts)
+            if not config.checksum or existed:
+                return None
+            # The finished clip is still in the page cache
+            return manifest.hash_file(dst)
+
+    def _write(
+            self,
+            config: Config,
+            src: Path,
+            dst: Path,
+            parts: Sequence[timeline.Part],
+    ):
+        extras = [
+            (target.path(dst), target.options)
+            for target in config.targets
+            if not target.path(dst).exists()
+        ]
+        if dst.exists():
+            if not extras:
+                print(f"skipping existing clip: {dst}")
+                return
+            # Fan the existing clip out instead of reading the source again
+            write_outputs(lambda: ffmpeg.remux(dst, extras), extras)
+            return
 
-    def write(self, src: Path, dst: Path):
-        "Use ffmpeg to write the lossless video clip file."
+        if len(parts) > 1:
+            # Spanning clips are stream copied whatever the write mode
+            outputs: List[Tuple[Path, Dict[str, str]]] = [(dst, {})] + extras
+            write_outputs(lambda: timeline.write_parts(parts, outputs), outputs)
+            return
 
-        if dst.exists():
-            print(f"skipping existing clip: {dst}")
+        if config.write_mode in (WriteMode.ENCODE, WriteMode.SMART):
+            writer = (
+                encode.write_encoded
+                if config.write_mode == WriteMode.ENCODE
+                else encode.write_smart_cut
+            )
+            writer(config, src, dst, self.start.total_seconds(), self.end.total_seconds())
+            if extras:
+                write_outputs(lambda: ffmpeg.remux(dst, extras), extras)
             return
 
+        if config.write_mode == WriteMode.NATIVE and mp4.supported(src, dst):
+            try:
+                with governor.slot(), trace.span("mp4.cut", src=src):
+                    mp4.cut(src, dst, self.start.total_seconds(), self.end.total_seconds())
+            except UnsupportedError as ex:
+                print(f"cutting with ffmpeg: {src}: {ex}")
+            else:
+                if extras:
+                    write_outputs(lambda: ffmpeg.remux(dst, extras), extras)
+                return
+
+        outputs = [(dst, {})] + extras
         cmd = (
             "ffmpeg",
+            "-nostdin",
             "-ss", str(self.start.total_seconds()),
             "-i", str(src),
             "-c:a", "copy",
@@ -84,12 +144,94 @@ class Clip(NamedTuple):
             "-map", "0:v",
             "-map", "0:a",
             "-t", str((self.end - self.start).total_seconds()),
-            str(dst),
+            *ffmpeg.output_args(outputs),
         )
-        try:
-            subprocess.run(cmd, check=True)
-        except subprocess.CalledProcessError as ex:
-            raise Error(ex)
+
+        def copy():
+            with governor.slot():
+                ffmpeg.check_call(cmd)
+        write_outputs(copy, outputs)
+
+    def write_with_retries(
+            self,
+            config: Config,
+            src: Path,
+            dst: Path,
+            parts: Sequence[timeline.Part] = (),
+    ) -> Optional[manifest.Checksum]:
+        "Write the clip, retrying transient failures with backoff (see `write`)."
+
+        attempt = 1
+        while True:
+            try:
+                return self.write(config, src, dst, parts)
+            except TransientError:
+                if attempt > config.retries:
+                    raise
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+                attempt += 1
+
+    def identity(self, date: datetime.datetime) -> Dict[str, str]:
+        "Get a serializable reference to the clip of the video recorded at `date`."
+        return {
+            "video": datetime_to_str(date),
+            "time": f"{timedelta_to_str(self.start)} - {timedelta_to_str(self.end)}",
+            "title": self.title,
+        }
+
+def write_outputs(write: Callable[[], None], outputs: Sequence[Tuple[Path, Any]]):
+    "Run `write`, removing its partial outputs if it fails."
+    try:
+        write()
+    except Error:
+        # Don't leave partial clips that later runs would skip as existing
+        for (path, _) in outputs:
+            if path.exists():
+                path.unlink()
+        raise
+
+ItemType = TypeVar("ItemType")
+ResultType = TypeVar("ResultType")
+
+def run_parallel(
+        workers: int,
+        work: Callable[[ItemType], ResultType],
+        items: Sequence[ItemType],
+) -> List[ResultType]:
+    """Apply `work` to every item on up to `workers` threads, returning the
+    results in order. The first failure cancels the items that have not
+    started (the running ones finish) and is raised."""
+
+    if workers <= 1:
+        return [work(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(work, item) for item in items]
+        wait(futures, return_when=FIRST_EXCEPTION)
+        if any(future.done() and future.exception() is not None for future in futures):
+            pool.shutdown(cancel_futures=True)
+        # Items run in order, so a failure comes before the items it cancelled
+        return [future.result() for future in futures]
+
+class Failure(NamedTuple):
+    "Clip that could not be written."
+
+    # Reference to the clip (see `Clip.identity`).
+    clip: Dict[str, str]
+    # Output path of the clip, if known.
+    output: Optional[Path]
+    # Error message.
+    error: str
+    # Number of attempts made.
+    attempts: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        "Convert the failure to a `dict` for the failure report."
+        return {
+            **self.clip,
+            "output": str(self.output) if self.output is not None else None,
+            "error": self.error,
+            "attempts": self.attempts,
+        }
 
 VideoType = TypeVar("VideoType", bound="Video")
 class Video(NamedTuple):
@@ -140,33 +282,271 @@ class Video(NamedTuple):
     @classmethod
     def from_path(cls: Type[VideoType], config: Config, path: Path) -> VideoType:
         "Create a default `Video` from a filesystem path."
+        return cls(date=names.renderer(config).source_date(str(path)), title="video")
+
+    def src_path(self, config: Config, src_dir: Path) -> Path:
+        "Get the path to the source video file."
+        return src_dir / names.renderer(config).source_name(self.date)
+
+    def dst_path(self, config: Config, clip: Clip, dst_dir: Path) -> Path:
+        "Get the output path for one of the video's clips."
+        return dst_dir / clip.path_str(
+            config,
+            self.date,
+            self.epoch,
+            self.title,
+        )
 
-        if path.suffix != f".{config.video_ext}":
-            raise Error(f"{path} has invalid file extension")
+    def spanning_parts(
+            self,
+            config: Config,
+            src_dir: Path,
+            src: Path,
+            clips: Sequence[Clip],
+    ) -> Dict[Clip, List[timeline.Part]]:
+        "Get the recording pieces of the clips that continue past the end of the source video."
 
-        fmt = config.filename_replace.apply(config.video_filename_format)
         try:
-            date = datetime.datetime.strptime(path.stem, fmt)
-        except ValueError:
-            raise Error(f"{path} does not match format {fmt}")
-        return cls(date=date, title="video")
+            length = datetime.timedelta(seconds=ffmpeg.duration(config, src))
+        except Error:
+            return {}
+        spanning = [clip for clip in clips if clip.end > length]
+        if not spanning:
+            return {}
+
+        index = timeline.Timeline.scan(config, src_dir)
+        parts = {}
+        for clip in spanning:
+            pieces = index.covering(self.date + clip.start, self.date + clip.end)
+            if len(pieces) > 1:
+                parts[clip] = pieces
+        return parts
+
+    def write_clips(
+            self,
+            config: Config,
+            src_dir: Path,
+            dst_dir: Path,
+            dsts: Optional[Sequence[Optional[Path]]] = None,
+            checksums: Optional[Dict[str, Dict[str, Any]]] = None,
+    ) -> List[Failure]:
+        """Create all requested clips from the video (at `dsts`, if given).
+
+        With `keep_going`, failures are returned instead of raised. Manifest
+        entries of newly written clips are added to `checksums`, if given.
+        """
+        with trace.span("Video.write_clips", video=self.date, clips=len(self.clips)):
+            return self._write_clips(config, src_dir, dst_dir, dsts, checksums)
+
+    def _write_clips(
+            self,
+            config: Config,
+            src_dir: Path,
+            dst_dir: Path,
+            dsts: Optional[Sequence[Optional[Path]]],
+            checksums: Optional[Dict[str, Dict[str, Any]]],
+    ) -> List[Failure]:
+        if dsts is None:
+            dsts = [self.dst_path(config, clip, dst_dir) for clip in self.clips]
+
+        src = self.src_path(config, src_dir)
+        if not src.is_file():
+            if not config.keep_going:
+                raise Error(f"missing video file: {src}")
+            return [
+                Failure(clip.identity(self.date), dst, f"missing video file: {src}", 0)
+                for (clip, dst) in zip(self.clips, dsts)
+                if dst is not None
+            ]
+
+        # Identical clips share their output path and are written once
+        unique: Dict[Path, Tuple[Clip, Path]] = {}
+        for (clip, dst) in zip(self.clips, dsts):
+            if dst is not None:
+                unique.setdefault(dst, (clip, dst))
+        pending = list(unique.values())
+        # Encoding modes already spread each clip over the workers
+        copying = config.write_mode in (WriteMode.COPY, WriteMode.NATIVE)
+        workers = min(config.jobs, len(pending)) if copying else 1
+
+        # Read the next clips ahead while the current ones are extracted
+        missing = [clip for (clip, dst) in pending if not dst.exists()]
+        ranges = readahead.clip_ranges(config, src, [
+            (clip.start.total_seconds(), clip.end.total_seconds()) for clip in missing
+        ]) if missing else []
+        # Only the start of each upcoming clip is read ahead; the window then
+        # follows the clip as it is written
+        for byte_range in ranges[:workers]:
+            readahead.will_need(src, readahead.window(byte_range, 0))
+        positions = iter(range(workers, len(ranges)))
+        clip_ranges = dict(zip(missing, ranges))
+        spanning = self.spanning_parts(config, src_dir, src, missing) if missing else {}
+
+        def write(clip: Clip, dst: Path) -> Optional[Failure]:
+            if not dst.exists():
+                position = next(positions, None)
+                if position is not None:
+                    readahead.will_need(src, readahead.window(ranges[position], 0))
+            try:
+                with readahead.following(src, clip_ranges.get(clip), dst):
+                    checksum = clip.write_with_retries(config, src, dst, spanning.get(clip, ()))
+            except Error as ex:
+                if not config.keep_going:
+                    raise
+                attempts = config.retries + 1 if isinstance(ex, TransientError) else 1
+                print(f"failed to write clip: {dst}: {ex}")
+                return Failure(clip.identity(self.date), dst, str(ex), attempts)
+            if checksum is not None and checksums is not None:
+                checksums[str(dst)] = manifest.entry(checksum, clip.identity(self.date))
+            return None
 
-    def write_clips(self, config: Config, src_dir: Path, dst_dir: Path):
-        "Create all requested clips from the video."
+        try:
+            results = run_parallel(workers, lambda item: write(*item), pending)
+        finally:
+            if missing:
+                readahead.release(src)
+        return [failure for failure in results if failure is not None]
+
+# Bump when the cached form of parsed shards changes, to invalidate them.
+SHARD_CACHE_VERSION = b"2"
+
+def videos_from_data(data: Dict[str, Any]) -> List[Video]:
+    "Validate and deserialize the `videos` list of a job (or job shard) `dict`."
+
+    videos = data.get("videos", [])
+    if not isinstance(videos, list):
+        raise Error(f"invalid videos: {videos}")
+
+    for video in videos:
+        if not isinstance(video, dict):
+            raise Error(f"invalid video entry: {video}")
+
+    return [Video.from_dict(video) for video in videos]
+
+def include_paths(job_path: Path, data: Dict[str, Any]) -> List[Path]:
+    "Get the job shard files included by a job file, in order and without duplicates."
+
+    include = data.get("include", [])
+    if isinstance(include, str):
+        include = [include]
+    if not isinstance(include, list) or [x for x in include if not isinstance(x, str)]:
+        raise Error(f"invalid include: {include}")
+
+    paths: Dict[Path, None] = {}
+    for pattern in include:
+        full = str(job_path.parent / pattern)
+        matches = sorted(glob.glob(full)) if glob.has_magic(full) else [full]
+        for match in matches:
+            paths.setdefault(Path(match), None)
+    return list(paths)
+
+def shard_cache_path(config: Config, content: bytes) -> Path:
+    "Get the cache file path for a parsed job shard."
+    digest = hashlib.sha256(SHARD_CACHE_VERSION + b"\0" + content).hexdigest()
+    return config.cache_dir / "shards" / f"{digest}.json"
+
+def parse_shard(path: Path, content: bytes) -> Dict[str, Any]:
+    """Parse a job shard into a JSON-compatible `dict` (YAML timestamps become
+    strings, which the `from_dict` methods parse the same way)."""
+
+    try:
+        data = yaml.safe_load(content)
+    except yaml.YAMLError as ex:
+        raise Error(f"{path}: {ex}")
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise Error(f"{path}: invalid job shard")
+    return json.loads(json.dumps(data, default=str))
+
+def load_shards(config: Config, paths: Sequence[Path]) -> List[Video]:
+    "Load job shards, parsing only shards whose content is not cached."
+
+    contents = []
+    for path in paths:
+        try:
+            contents.append(path.read_bytes())
+        except OSError as ex:
+            raise Error(f"cannot read job shard: {ex}")
 
-        src_name = config.filename_replace.apply(self.date.strftime(config.video_filename_format))
-        src = (src_dir / src_name).with_suffix(f".{config.video_ext}")
-        if not src.is_file():
-            raise Error(f"missing video file: {src}")
-
-        for clip in self.clips:
-            dst = dst_dir / clip.path_str(
-                config,
-                self.date,
-                self.epoch,
-                self.title,
-            )
-            clip.write(src, dst)
+    shards: List[Optional[Dict[str, Any]]] = []
+    for content in contents:
+        try:
+            with shard_cache_path(config, content).open(encoding="utf-8") as file:
+                data = json.load(file)
+            shards.append(data if isinstance(data, dict) else None)
+        except (OSError, ValueError):
+            shards.append(None)
+
+    missing = [i for (i, data) in enumerate(shards) if data is None]
+    if len(missing) > 1 and config.jobs > 1:
+        with ProcessPoolExecutor(max_workers=min(config.jobs, len(missing))) as pool:
+            parsed = list(pool.map(
+                parse_shard,
+                [paths[i] for i in missing],
+                [contents[i] for i in missing],
+            ))
+    else:
+        parsed = [parse_shard(paths[i], contents[i]) for i in missing]
+
+    for (i, data) in zip(missing, parsed):
+        shards[i] = data
+
+    videos = []
+    for (path, data) in zip(paths, shards):
+        try:
+            videos.append(videos_from_data(data or {}))
+        except Error as ex:
+            raise Error(f"{path}: {ex}")
+
+    # Shards are cached only once they are known to be valid
+    for (i, data) in zip(missing, parsed):
+        dst = shard_cache_path(config, contents[i])
+        tmp = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+        try:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open("w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp, dst)
+        except OSError:
+            pass
+
+    return [video for shard in videos for video in shard]
+
+def failure_report_path(config: Config) -> Path:
+    "Get the path of the failure report written by `--keep-going` runs."
+    return config.job_path.with_name(f"{config.job_path.stem}.failures.json")
+
+ReelType = TypeVar("ReelType", bound="Reel")
+class Reel(NamedTuple):
+    "Compilation of clips from the job, in order."
+
+    # Reel title (for output filename).
+    title: str
+    # Clips in the reel, as (video date, clip title) references.
+    clips: List[Tuple[datetime.datetime, str]] = []
+
+    @classmethod
+    def from_dict(cls: Type[ReelType], data: Dict[str, Any]) -> ReelType:
+        "Create a `Reel` from an untyped `dict` (YAML deserialization result)."
+
+        try:
+            title = str(data["title"])
+            refs = data["clips"]
+        except KeyError as ex:
+            raise Error(f"bad reel data: {ex}: {data}")
+        if not title:
+            raise Error(f"bad reel title: {data}")
+        if not isinstance(refs, list) or not refs:
+            raise Error(f"bad reel clips: {data}")
+
+        clips = []
+        for ref in refs:
+            try:
+                clips.append((datetime_from_str(str(ref["video"])), str(ref["clip"])))
+            except (KeyError, TypeError) as ex:
+                raise Error(f"bad reel clip: {ex}: {ref}")
+        return cls(title=title, clips=clips)
 
 JobType = TypeVar("JobType", bound="Job")
 class Job(NamedTuple):
@@ -178,37 +558,199 @@ class Job(NamedTuple):
     video_dir: Path
     # List of videos to create clips from.
     videos: List[Video] = []
+    # Compilations of clips to create.
+    reels: List[Reel] = []
+    # Additional destinations every clip is also written to.
+    targets: Tuple[Target, ...] = ()
 
     @classmethod
     def from_dict(cls: Type[JobType], config: Config, data: Dict[str, Any]) -> JobType:
         "Create a `Job` from an untyped `dict` (YAML deserialization result)."
 
-        videos = data.get("videos", [])
-        if not isinstance(videos, list):
-            raise Error(f"invalid videos: {videos}")
+        videos = videos_from_data(data)
 
-        for video in videos:
-            if not isinstance(video, dict):
-                raise Error(f"invalid video entry: {video}")
+        reels = data.get("reels", [])
+        if not isinstance(reels, list) or [x for x in reels if not isinstance(x, dict)]:
+            raise Error(f"invalid reels: {reels}")
 
         output_dir = Path(str(data.get("output-dir", config.output_dir)))
         video_dir = Path(str(data.get("video-dir", config.video_dir)))
+        targets = targets_from_list(data["outputs"]) if "outputs" in data else config.targets
 
         return cls(
             output_dir=output_dir,
             video_dir=video_dir,
-            videos=[Video.from_dict(video) for video in videos],
+            videos=videos,
+            reels=[Reel.from_dict(reel) for reel in reels],
+            targets=targets,
         )
 
     @classmethod
     def from_yaml_file(cls: Type[JobType], config: Config) -> JobType:
-        "Create a `Job` from a YAML file."
+        "Create a `Job` from a YAML file and the job shards it includes."
+
+        with trace.span("Job.from_yaml_file", path=config.job_path):
+            with config.job_path.open(encoding="utf-8") as file:
+                data = yaml.safe_load(file)
+            job = cls.from_dict(config, data)
+            shards = include_paths(config.job_path, data)
+            if shards:
+                with trace.span("load_shards", shards=len(shards)):
+                    job = job._replace(videos=job.videos + load_shards(config, shards))
+            return job
+
+    def outputs(self, config: Config) -> List[Tuple[Path, Tuple[Any, ...]]]:
+        "Render the output path and content identity of every clip, in job order."
+
+        renderer = names.renderer(config)
+        return [
+            (
+                self.output_dir / renderer.clip_name(
+                    video.date,
+                    video.epoch,
+                    video.title,
+                    clip.start,
+                    clip.title,
+                ),
+                (video.date, clip.start, clip.end),
+            )
+            for video in self.videos
+            for clip in video.clips
+        ]
 
-        with config.job_path.open(encoding="utf-8") as file:
-            return cls.from_dict(config, yaml.safe_load(file))
+    def output_paths(self, config: Config) -> List[List[Optional[Path]]]:
+        """Render the output path of every clip, resolving name collisions.
 
-    def run(self, config: Config):
-        "Run the batch job and create all requested clips."
+        Returns one list of paths per video, parallel to its clips; a path is
+        `None` when the clip should not be written.
+        """
 
+        with trace.span("Job.output_paths"):
+            resolved = iter(names.disambiguate(self.outputs(config), config.name_collision))
+            return [[next(resolved) for _ in video.clips] for video in self.videos]
+
+    def planned(
+            self,
+            config: Config,
+            paths: Optional[List[List[Optional[Path]]]] = None,
+    ) -> List[Tuple[Path, Dict[str, str]]]:
+        "Get the output path and identity of every clip that will be written (see `output_paths`)."
+        if paths is None:
+            paths = self.output_paths(config)
+        return [
+            (dst, clip.identity(video.date))
+            for (video, dsts) in zip(self.videos, paths)
+            for (clip, dst) in zip(video.clips, dsts)
+            if dst is not None
+        ]
+
+    def only_failed(self, config: Config) -> "Job":
+        "Get the part of the job that failed in the last run (see `failure_report_path`)."
+
+        path = failure_report_path(config)
+        try:
+            with path.open(encoding="utf-8") as file:
+                failed = {
+                    (failure["video"], failure["time"], failure["title"])
+                    for failure in json.load(file)["failures"]
+                }
+        except FileNotFoundError:
+            raise Error(f"no failure report: {path}")
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            raise Error(f"invalid failure report: {path}: {ex}")
+
+        videos = []
         for video in self.videos:
-            video.write_clips(config, self.video_dir, self.output_dir)
+            clips = [
+                clip for clip in video.clips
+                if tuple(clip.identity(video.date).values()) in failed
+            ]
+            if clips:
+                videos.append(video._replace(clips=clips))
+        return self._replace(videos=videos)
+
+    def run(self, config: Config):
+        """Run the batch job and create all requested clips.
+
+        With `keep_going`, every clip is attempted and failures are written to
+        the failure report before an error is raised.
+        """
+
+        config = config._replace(targets=self.targets)
+        failures = []
+        checksums: Dict[str, Dict[str, Any]] = {}
+        paths = self.output_paths(config)
+        try:
+            for (video, dsts) in zip(self.videos, paths):
+                failures.extend(video.write_clips(
+                    config,
+                    self.video_dir,
+                    self.output_dir,
+                    dsts,
+                    checksums,
+                ))
+        finally:
+            # Record the clips written so far, even if the run stops early
+            self.record(config, paths, checksums)
+        self.report(config, failures)
+
+    def record(
+            self,
+            config: Config,
+            paths: List[List[Optional[Path]]],
+            checksums: Dict[str, Dict[str, Any]],
+    ):
+        "Record the existing outputs of the job and the new checksums in its manifest."
+        recorded = manifest.load(config)
+        clips = manifest.update(recorded, self.planned(config, paths), checksums)
+        if clips != recorded:
+            manifest.store(config, clips)
+        try:
+            catalog.record(config, config.job_path.absolute(), self.catalog_entries(config, paths))
+        except Error as ex:
+            # The catalog can be rebuilt, so it never fails a run
+            print(f"warning: {ex}", file=sys.stderr)
+
+    def catalog_entries(
+            self,
+            config: Config,
+            paths: Optional[List[List[Optional[Path]]]] = None,
+    ) -> List[catalog.Entry]:
+        "Get the catalog entries of the job's clips that exist (see `output_paths`)."
+        if paths is None:
+            paths = self.output_paths(config)
+        entries = []
+        for (video, dsts) in zip(self.videos, paths):
+            src = video.src_path(config, self.video_dir)
+            for (clip, dst) in zip(video.clips, dsts):
+                if dst is None:
+                    continue
+                try:
+                    size = dst.stat().st_size
+                except OSError:
+                    continue
+                entries.append(catalog.Entry(
+                    output=dst.absolute(),
+                    job=config.job_path.absolute(),
+                    source=src.absolute(),
+                    video=video.date,
+                    video_title=video.title,
+                    title=clip.title,
+                    start=video.date + clip.start,
+                    end=video.date + clip.end,
+                    size=size,
+                ))
+        return entries
+
+    def report(self, config: Config, failures: Sequence[Failure]):
+        "Write the failure report of a run (or remove a stale one), and fail if clips failed."
+        report = failure_report_path(config)
+        if failures:
+            with report.open("w", encoding="utf-8") as file:
+                json.dump({
+                    "job": str(config.job_path),
+                    "failures": [failure.to_dict() for failure in failures],
+                }, file, indent=2)
+            raise Error(f"{len(failures)} clips failed (see {report})")
+        if config.keep_going and report.exists():
+            report.unlink()
@@ -0,0 +1,174 @@
+"Audio loudness index module."
+
+import datetime
+import os
+import struct
+import subprocess
+from bisect import bisect_left, insort
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Tuple
+
+np: Any
+try:
+    import numpy as np # type: ignore
+except ImportError: # pragma: no cover
+    np = None
+
+from mvcs import cache
+from mvcs.analyze import Window, fill, require_numpy
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Job
+
+# PCM sample rate used for analysis.
+SAMPLE_RATE = 8000
+# Length of one index window in milliseconds.
+WINDOW_MS = 100
+# Index windows read from ffmpeg per batch.
+BATCH_WINDOWS = 4096
+# Index windows averaged when ranking highlights (1 second).
+SMOOTH_WINDOWS = 10
+# Seconds of video to propose before and after each loudness peak.
+CLIP_BEFORE = 20.0
+CLIP_AFTER = 10.0
+
+# Sidecar header: magic, window length in ms, window count.
+HEADER = struct.Struct("<8sII")
+MAGIC = b"MVCSLUD1"
+
+def index_path(config: Config, src: Path) -> Path:
+    "Get the loudness index sidecar path for a source file."
+    return cache.cache_path(config, "loudness", src, ".bin")
+
+def write_index(stream: BinaryIO, dst: BinaryIO, window_samples: int) -> int:
+    "Write (rms, peak) float32 pairs for each window of a s16le PCM stream."
+
+    require_numpy()
+    samples = np.empty((BATCH_WINDOWS, window_samples), dtype=np.int16)
+    view = memoryview(samples).cast("B") # type: ignore
+    window_bytes = window_samples * samples.itemsize
+    count = 0
+    while True:
+        windows = fill(stream, view) // window_bytes
+        if not windows:
+            return count
+        batch = samples[:windows].astype(np.float32) / 32768.0
+        values = np.empty((windows, 2), dtype=np.float32)
+        values[:, 0] = np.sqrt(np.mean(batch * batch, axis=1))
+        values[:, 1] = np.max(np.abs(batch), axis=1)
+        dst.write(values.tobytes())
+        count += windows
+
+def build_index(config: Config, src: Path) -> Path:
+    "Decode the audio of a source file once and store its loudness index."
+
+    require_numpy()
+    path = index_path(config, src)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    cmd = (
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-i", str(src),
+        "-map", "0:a:0",
+        "-ac", "1",
+        "-ar", str(SAMPLE_RATE),
+        "-f", "s16le",
+        "pipe:1",
+    )
+    try:
+        with tmp.open("wb") as file, \
+                subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+            file.write(HEADER.pack(MAGIC, WINDOW_MS, 0))
+            count = write_index(
+                proc.stdout, # type: ignore
+                file,
+                SAMPLE_RATE * WINDOW_MS // 1000,
+            )
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, WINDOW_MS, count))
+        if proc.returncode != 0:
+            raise Error(f"ffmpeg failed to decode audio: {src}")
+        os.replace(tmp, path)
+    except OSError as ex:
+        raise Error(ex)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return path
+
+def load_index(path: Path) -> Any:
+    "Memory-map a loudness index as a (windows, 2) array of (rms, peak)."
+
+    require_numpy()
+    with path.open("rb") as file:
+        (magic, window_ms, count) = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or window_ms != WINDOW_MS:
+        raise Error(f"invalid loudness index: {path}")
+    if not count:
+        return np.zeros((0, 2), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r", offset=HEADER.size, shape=(count, 2))
+
+def find_peaks(
+        index: Any,
+        threshold_db: float,
+        top: int,
+        spacing: float,
+) -> List[Tuple[float, float]]:
+    "Get (time, dBFS) of the loudest moments above a threshold, at least `spacing` s apart."
+
+    require_numpy()
+    if not len(index):
+        return []
+    energy = np.square(index[:, 0], dtype=np.float64)
+    kernel = np.full(SMOOTH_WINDOWS, 1.0 / SMOOTH_WINDOWS)
+    loudness_db = 10 * np.log10(np.convolve(energy, kernel, mode="same") + 1e-12)
+
+    candidates = np.flatnonzero(loudness_db >= threshold_db)
+    order = candidates[np.argsort(loudness_db[candidates], kind="stable")[::-1]]
+    spacing_windows = spacing * 1000 / WINDOW_MS
+    chosen: List[int] = []
+    for window in order.tolist():
+        pos = bisect_left(chosen, window)
+        if pos > 0 and window - chosen[pos - 1] < spacing_windows:
+            continue
+        if pos < len(chosen) and chosen[pos] - window < spacing_windows:
+            continue
+        insort(chosen, window)
+        if len(chosen) >= top:
+            break
+    return [
+        ((window + 0.5) * WINDOW_MS / 1000, float(loudness_db[window]))
+        for window in chosen
+    ]
+
+def peak_windows(peaks: List[Tuple[float, float]]) -> List[Window]:
+    "Get candidate clip windows around loudness peaks."
+    return [
+        Window(max(0.0, time - CLIP_BEFORE), time + CLIP_AFTER, loudness)
+        for (time, loudness) in peaks
+    ]
+
+def highlights(config: Config, job: Job) -> Dict[datetime.datetime, List[Window]]:
+    "Find loud moments in every source video, indexing sources on first use."
+
+    require_numpy()
+    sources = {video.date: video.src_path(config, job.video_dir) for video in job.videos}
+    for src in sources.values():
+        if not src.is_file():
+            raise Error(f"missing video file: {src}")
+
+    missing = [src for src in sources.values() if not index_path(config, src).is_file()]
+    if missing:
+        with ProcessPoolExecutor(max_workers=config.jobs) as pool:
+            list(pool.map(build_index, [config] * len(missing), missing))
+
+    return {
+        date: peak_windows(find_peaks(
+            load_index(index_path(config, src)),
+            config.highlight_threshold,
+            config.highlight_top,
+            config.highlight_spacing,
+        ))
+        for (date, src) in sources.items()
+    }
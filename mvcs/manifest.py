@@ -0,0 +1,190 @@
+"Clip checksum manifest module."
+
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from mvcs.config import Config
+from mvcs.error import Error
+
+# Manifest entry of a clip: its identity, checksum and size.
+Entry = Dict[str, Any]
+# Planned outputs of a job with the identity of their clip.
+Planned = Sequence[Tuple[Path, Dict[str, str]]]
+
+# Hash function used for clip checksums.
+HASH = "blake2b"
+# Bytes read from a file at a time.
+CHUNK_SIZE = 1 << 20
+
+class Checksum(NamedTuple):
+    "Digest and size of a written clip."
+
+    # Hex digest of the file contents.
+    digest: str
+    # File size in bytes.
+    size: int
+
+def manifest_path(config: Config) -> Path:
+    "Get the path of the checksum manifest of the job."
+    return config.job_path.with_name(f"{config.job_path.stem}.manifest.json")
+
+def load(config: Config) -> Dict[str, Entry]:
+    "Load the manifest entries keyed by output path (empty if there is no manifest)."
+    try:
+        with manifest_path(config).open(encoding="utf-8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as ex:
+        raise Error(f"invalid manifest: {manifest_path(config)}: {ex}")
+    clips = data.get("clips") if isinstance(data, dict) else None
+    if not isinstance(clips, dict):
+        raise Error(f"invalid manifest: {manifest_path(config)}")
+    return clips
+
+def store(config: Config, clips: Dict[str, Entry]):
+    "Atomically replace the manifest."
+    store_json(manifest_path(config), {"hash": HASH, "clips": clips}, sort_keys=True)
+
+def store_json(path: Path, data: Any, sort_keys: bool = False):
+    "Atomically replace a JSON file."
+    with tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            dir=path.parent,
+            prefix=f".{path.name}.",
+            delete=False,
+    ) as file:
+        json.dump(data, file, indent=2, sort_keys=sort_keys)
+    os.replace(file.name, path)
+
+def entry(checksum: Checksum, identity: Dict[str, str]) -> Entry:
+    "Get the manifest entry of a clip."
+    return {**identity, HASH: checksum.digest, "size": checksum.size}
+
+def content_key(identity: Dict[str, Any]) -> Tuple[Any, Any]:
+    "Get what the content of a clip depends on: its source video and time range (not its names)."
+    return (identity.get("video"), identity.get("time"))
+
+def plan_renames(clips: Dict[str, Entry], planned: Planned) -> List[Tuple[Path, Path]]:
+    """Find recorded outputs that only need a new name to become planned outputs.
+
+    A planned output that is missing (or holds other content) is taken from an
+    existing recorded output with the same content and extension. Existing
+    files are never overwritten, unless they are renamed themselves.
+    """
+
+    wanted: Dict[str, Dict[str, str]] = {}
+    for (dst, identity) in planned:
+        wanted.setdefault(str(dst), identity)
+
+    def current(path: str) -> bool:
+        return (
+            path in wanted
+            and path in clips
+            and content_key(clips[path]) == content_key(wanted[path])
+        )
+
+    candidates: Dict[Tuple[Any, Any, str], List[str]] = {}
+    for (path, recorded) in sorted(clips.items()):
+        if not current(path) and os.path.exists(path):
+            candidates.setdefault((*content_key(recorded), Path(path).suffix), []).append(path)
+
+    renames: Dict[str, str] = {}
+    for (name, identity) in wanted.items():
+        if current(name) and os.path.exists(name):
+            continue
+        options = candidates.get((*content_key(identity), Path(name).suffix))
+        if options:
+            renames[name] = options.pop(0)
+
+    # Drop renames onto files that stay in place (which can free others' names)
+    while True:
+        moved = set(renames.values())
+        blocked = [name for name in renames if name not in moved and os.path.exists(name)]
+        if not blocked:
+            break
+        for name in blocked:
+            del renames[name]
+    return [(Path(old), Path(name)) for (name, old) in renames.items()]
+
+def renamed(
+        clips: Dict[str, Entry],
+        renames: Sequence[Tuple[Path, Path, Dict[str, str]]],
+) -> Dict[str, Entry]:
+    "Move the entries of renamed `(old, new, identity)` outputs, keeping their checksums."
+    moved = {str(new): {**clips[str(old)], **identity} for (old, new, identity) in renames}
+    old_paths = {str(old) for (old, _, _) in renames}
+    return {
+        **{path: recorded for (path, recorded) in clips.items() if path not in old_paths},
+        **moved,
+    }
+
+def update(
+        clips: Dict[str, Entry],
+        planned: Planned,
+        checksums: Dict[str, Entry],
+) -> Dict[str, Entry]:
+    """Record the planned outputs that exist after a run.
+
+    Entries of deleted outputs are dropped; outputs that are no longer planned
+    stay recorded (see `orphans`).
+    """
+
+    clips = {**clips, **checksums}
+    for (dst, identity) in planned:
+        recorded = clips.get(str(dst))
+        if recorded is None:
+            if dst.exists():
+                clips[str(dst)] = dict(identity)
+        elif content_key(recorded) == content_key(identity):
+            # Titles may have changed without changing the name
+            clips[str(dst)] = {**recorded, **identity}
+    return {path: recorded for (path, recorded) in clips.items() if Path(path).exists()}
+
+def orphans(clips: Dict[str, Entry], planned: Planned) -> List[Path]:
+    "Get recorded outputs that still exist but that no clip of the job produces anymore."
+    used = {str(dst) for (dst, _) in planned}
+    return [Path(path) for path in sorted(clips) if path not in used and Path(path).exists()]
+
+def hash_file(path: Path) -> Checksum:
+    "Compute the checksum of a file."
+    digest = hashlib.new(HASH)
+    size = 0
+    with path.open("rb") as file:
+        while True:
+            data = file.read(CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+            size += len(data)
+    return Checksum(digest.hexdigest(), size)
+
+def check(path: Path, recorded: Entry) -> Optional[str]:
+    "Check a clip against its manifest entry; returns the problem, if any."
+    if HASH not in recorded:
+        # Clips written without --checksum are only known to exist
+        return None if path.exists() else "missing"
+    try:
+        checksum = hash_file(path)
+    except FileNotFoundError:
+        return "missing"
+    except OSError as ex:
+        return f"unreadable: {ex}"
+    if checksum.size != recorded.get("size"):
+        return f"size {checksum.size} != {recorded.get('size')}"
+    if checksum.digest != recorded.get(HASH):
+        return "checksum mismatch"
+    return None
+
+def verify(config: Config, clips: Dict[str, Entry]) -> List[Tuple[str, str]]:
+    "Check every clip in a manifest in parallel; returns `(output, problem)` pairs."
+    paths = sorted(clips)
+    with ThreadPoolExecutor(max_workers=config.jobs) as pool:
+        results = pool.map(lambda path: check(Path(path), clips[path]), paths)
+        return [(path, problem) for (path, problem) in zip(paths, results) if problem is not None]
@@ -0,0 +1,608 @@
+"Native MP4/MOV stream copy cutting module."
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from mvcs.error import Error, UnsupportedError
+
+# File extensions of ISO base media files.
+EXTENSIONS = {".m4v", ".mov", ".mp4"}
+# Track handlers the cutter knows how to cut.
+HANDLERS = {b"soun", b"vide"}
+# Largest offset a `stco` chunk offset table can hold.
+MAX_STCO_OFFSET = 0xFFFFFFFF
+# Size of the 64-bit `mdat` box header written before the sample data.
+MDAT_HEADER_SIZE = 16
+
+class Box(NamedTuple):
+    "Location of an ISO-BMFF box in a buffer."
+
+    # Four character box type.
+    kind: bytes
+    # Offset of the box header.
+    start: int
+    # Offset of the box payload.
+    data: int
+    # Offset just past the end of the box.
+    end: int
+
+def boxes(buf, start: int, end: int) -> Iterator[Box]:
+    "Iterate over the boxes in `buf[start:end]`."
+
+    pos = start
+    while pos + 8 <= end:
+        (size, kind) = struct.unpack_from(">I4s", buf, pos)
+        data = pos + 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", buf, data)
+            data += 8
+        elif size == 0:
+            size = end - pos
+        if size < data - pos or pos + size > end:
+            raise UnsupportedError(f"truncated {kind.decode('latin-1')} box")
+        yield Box(kind, pos, data, pos + size)
+        pos += size
+
+def children(buf, parent: Box) -> Dict[bytes, Box]:
+    "Get the first child box of every type in `parent`."
+    found: Dict[bytes, Box] = {}
+    for item in boxes(buf, parent.data, parent.end):
+        found.setdefault(item.kind, item)
+    return found
+
+def child(buf, parent: Box, *path: bytes) -> Box:
+    "Get a required descendant box of `parent`."
+    for kind in path:
+        found = children(buf, parent).get(kind)
+        if found is None:
+            raise UnsupportedError(f"missing {kind.decode('latin-1')} box")
+        parent = found
+    return parent
+
+def version(buf, full: Box) -> int:
+    "Get the version of a full box."
+    return buf[full.data]
+
+def uints(buf, offset: int, count: int, wide: bool = False) -> array:
+    "Read `count` big-endian 32-bit (or 64-bit) unsigned integers."
+    values = array("Q" if wide else "I")
+    assert values.itemsize == (8 if wide else 4)
+    values.frombytes(buf[offset:offset + count * values.itemsize])
+    if len(values) != count:
+        raise UnsupportedError("truncated sample table")
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+def runs(buf, table: Box, signed: bool = False) -> List[Tuple[int, int]]:
+    "Read a run-length `(count, value)` table (`stts`, `ctts`)."
+    (count,) = struct.unpack_from(">I", buf, table.data + 4)
+    values = uints(buf, table.data + 8, 2 * count)
+    return [
+        (values[i], values[i + 1] - (1 << 32) if signed and values[i + 1] >> 31 else values[i + 1])
+        for i in range(0, len(values), 2)
+    ]
+
+class Track(NamedTuple):
+    "Sample tables of a track."
+
+    # The track's `trak` box.
+    trak: Box
+    # Media handler type (`vide`, `soun`, ...).
+    handler: bytes
+    # Media time units per second.
+    timescale: int
+    # Decode time deltas as `(count, delta)` runs.
+    stts: List[Tuple[int, int]]
+    # Composition offsets as `(count, offset)` runs, if present.
+    ctts: Optional[List[Tuple[int, int]]]
+    # 1-based sync sample numbers, or `None` when every sample is a sync sample.
+    stss: Optional[Sequence[int]]
+    # Size of every sample.
+    sizes: Sequence[int]
+    # Size of every sample if constant, otherwise 0.
+    sample_size: int
+    # File offset of every chunk.
+    chunk_offsets: Sequence[int]
+    # Index of the first sample of every chunk, plus the sample count.
+    chunk_samples: List[int]
+    # Edit list `(media_time, rate)` of a single-entry edit list, if present.
+    edit: Optional[Tuple[int, bytes]]
+
+class Movie(NamedTuple):
+    "Structure of an ISO-BMFF file."
+
+    # The `ftyp` box, if present.
+    ftyp: Optional[Box]
+    # The `moov` box.
+    moov: Box
+    # Movie time units per second.
+    timescale: int
+    # Tracks, in file order.
+    tracks: List[Track]
+
+def parse_edit(buf, trak: Box) -> Optional[Tuple[int, bytes]]:
+    "Parse a track's edit list, which must be absent or a single edit."
+
+    edts = children(buf, trak).get(b"edts")
+    if edts is None:
+        return None
+    elst = child(buf, edts, b"elst")
+    wide = version(buf, elst) == 1
+    (count,) = struct.unpack_from(">I", buf, elst.data + 4)
+    if count != 1:
+        raise UnsupportedError(f"edit list with {count} edits")
+    entry = elst.data + 8 + (8 if wide else 4)
+    (media_time,) = struct.unpack_from(">q" if wide else ">i", buf, entry)
+    if media_time < 0:
+        raise UnsupportedError("empty edit")
+    rate = bytes(buf[entry + (8 if wide else 4):entry + (12 if wide else 8)])
+    return (media_time, rate)
+
+def parse_track(buf, trak: Box) -> Track:
+    "Parse the sample tables of a track."
+
+    mdia = child(buf, trak, b"mdia")
+    handler = bytes(buf[child(buf, mdia, b"hdlr").data + 8:][:4])
+    if handler not in HANDLERS:
+        raise UnsupportedError(f"{handler.decode('latin-1')} track")
+    mdhd = child(buf, mdia, b"mdhd")
+    (timescale,) = struct.unpack_from(">I", buf, mdhd.data + (20 if version(buf, mdhd) else 12))
+    if not timescale:
+        raise UnsupportedError("track without a timescale")
+
+    stbl = child(buf, mdia, b"minf", b"stbl")
+    tables = children(buf, stbl)
+    stts = runs(buf, child(buf, stbl, b"stts"))
+    ctts = runs(buf, tables[b"ctts"], signed=True) if b"ctts" in tables else None
+
+    stss = None
+    if b"stss" in tables:
+        (count,) = struct.unpack_from(">I", buf, tables[b"stss"].data + 4)
+        stss = uints(buf, tables[b"stss"].data + 8, count)
+
+    stsz = child(buf, stbl, b"stsz")
+    (sample_size, count) = struct.unpack_from(">II", buf, stsz.data + 4)
+    sizes = array("I", [sample_size]) * count if sample_size else uints(buf, stsz.data + 12, count)
+    if sum(run for (run, _) in stts) != count:
+        raise UnsupportedError("inconsistent sample tables")
+
+    if b"co64" in tables:
+        (chunks,) = struct.unpack_from(">I", buf, tables[b"co64"].data + 4)
+        chunk_offsets = uints(buf, tables[b"co64"].data + 8, chunks, wide=True)
+    else:
+        (chunks,) = struct.unpack_from(">I", buf, child(buf, stbl, b"stco").data + 4)
+        chunk_offsets = uints(buf, tables[b"stco"].data + 8, chunks)
+
+    stsc = child(buf, stbl, b"stsc")
+    (entries,) = struct.unpack_from(">I", buf, stsc.data + 4)
+    stsc_values = uints(buf, stsc.data + 8, 3 * entries)
+    counts: List[int] = []
+    for i in range(0, len(stsc_values), 3):
+        (first, per_chunk, description) = stsc_values[i:i + 3]
+        if description != 1:
+            raise UnsupportedError("several sample descriptions")
+        last = stsc_values[i + 3] - 1 if i + 3 < len(stsc_values) else chunks
+        counts.extend([per_chunk] * (last - first + 1))
+    chunk_samples = [0, *accumulate(counts)]
+    if len(counts) != chunks or chunk_samples[-1] != count:
+        raise UnsupportedError("inconsistent sample tables")
+
+    return Track(
+        trak=trak,
+        handler=handler,
+        timescale=timescale,
+        stts=stts,
+        ctts=ctts,
+        stss=stss,
+        sizes=sizes,
+        sample_size=sample_size,
+        chunk_offsets=chunk_offsets,
+        chunk_samples=chunk_samples,
+        edit=parse_edit(buf, trak),
+    )
+
+def parse(buf) -> Movie:
+    "Parse the structure of a non-fragmented ISO-BMFF file."
+
+    top = children(buf, Box(b"", 0, 0, len(buf)))
+    if b"moof" in top:
+        raise UnsupportedError("fragmented file")
+    moov = top.get(b"moov")
+    if moov is None:
+        raise UnsupportedError("missing moov box")
+    if b"mvex" in children(buf, moov):
+        raise UnsupportedError("fragmented file")
+
+    mvhd = child(buf, moov, b"mvhd")
+    (timescale,) = struct.unpack_from(">I", buf, mvhd.data + (20 if version(buf, mvhd) else 12))
+    tracks = [parse_track(buf, trak) for trak in boxes(buf, moov.data, moov.end)
+              if trak.kind == b"trak"]
+    if not tracks or not timescale:
+        raise UnsupportedError("no tracks")
+    return Movie(top.get(b"ftyp"), moov, timescale, tracks)
+
+def sample_index(stts: Sequence[Tuple[int, int]], ticks: int) -> int:
+    "Get the index of the first sample decoded at or after `ticks`."
+    (index, time) = (0, 0)
+    for (count, delta) in stts:
+        if ticks <= time:
+            return index
+        if delta and ticks <= time + count * delta:
+            return index + -(-(ticks - time) // delta)
+        index += count
+        time += count * delta
+    return index
+
+def sample_time(stts: Sequence[Tuple[int, int]], index: int) -> int:
+    "Get the decode time of a sample."
+    time = 0
+    for (count, delta) in stts:
+        if index <= count:
+            return time + index * delta
+        index -= count
+        time += count * delta
+    return time
+
+def presentation_times(track: Track) -> List[int]:
+    "Get the presentation time of every sample (decode time plus composition offset)."
+    deltas = (delta for (count, delta) in track.stts for _ in range(count))
+    times = list(accumulate(deltas, initial=0))
+    times.pop()
+    if track.ctts is not None:
+        offsets = [offset for (count, offset) in track.ctts for _ in range(count)]
+        if len(offsets) != len(times):
+            raise UnsupportedError("inconsistent sample tables")
+        times = [time + offset for (time, offset) in zip(times, offsets)]
+    return times
+
+def slice_runs(table: Sequence[Tuple[int, int]], first: int, last: int) -> List[Tuple[int, int]]:
+    "Get the part of a run-length table covering samples `[first, last)`."
+    (sliced, index) = ([], 0)
+    for (count, value) in table:
+        (low, high) = (max(first, index), min(last, index + count))
+        if low < high:
+            sliced.append((high - low, value))
+        index += count
+        if index >= last:
+            break
+    return sliced
+
+class Chunk(NamedTuple):
+    "Contiguous samples of a track copied to the output."
+
+    # Offset of the sample data in the source.
+    offset: int
+    # Size of the sample data.
+    size: int
+    # Number of samples.
+    samples: int
+
+class TrackCut(NamedTuple):
+    "Samples `[first, last)` of a track in the output."
+
+    track: Track
+    first: int
+    last: int
+    chunks: List[Chunk]
+    # Media time of the output presentation start (for the edit list).
+    media_time: int
+
+    @property
+    def duration(self) -> int:
+        "Get the media duration of the cut in track time units."
+        stts = slice_runs(self.track.stts, self.first, self.last)
+        return sum(count * delta for (count, delta) in stts)
+
+def select(track: Track, start: int, end: int) -> Tuple[int, int]:
+    """Get the samples `[first, last)` presented in `[start, end)` (media time
+    units), starting on the sync sample presented at or before the first of them.
+
+    With composition offsets (B-frames) decode order differs from presentation
+    order, so the range is chosen by presentation time."""
+
+    times = presentation_times(track)
+    later = [time for time in times if time >= start]
+    if not later:
+        return (len(times), len(times))
+    syncs = range(len(times)) if track.stss is None else [sync - 1 for sync in track.stss]
+    anchor = min(later)
+    before = [index for index in syncs if times[index] <= anchor]
+    first = before[-1] if before else next(iter(syncs), 0)
+    shown = [index for index in range(first, len(times)) if times[index] < end]
+    return (first, max(shown) + 1 if shown else first)
+
+def cut_track(track: Track, first: int, last: int) -> TrackCut:
+    "Plan the chunks to copy for samples `[first, last)` of a track."
+
+    chunks = []
+    chunk = max(0, bisect_right(track.chunk_samples, first) - 1)
+    while chunk < len(track.chunk_offsets) and track.chunk_samples[chunk] < last:
+        (chunk_first, chunk_last) = track.chunk_samples[chunk:chunk + 2]
+        (low, high) = (max(first, chunk_first), min(last, chunk_last))
+        if low < high:
+            offset = track.chunk_offsets[chunk] + sum(track.sizes[chunk_first:low])
+            chunks.append(Chunk(offset, sum(track.sizes[low:high]), high - low))
+        chunk += 1
+
+    # Keep the presentation of the first sample where the source presents it
+    # (relative to the cut), hiding the samples the source's edit hides
+    media_time = track.edit[0] if track.edit is not None else 0
+    if first < len(track.sizes):
+        decoded = sample_time(track.stts, first)
+        presented = decoded + (slice_runs(track.ctts, first, first + 1)[0][1] if track.ctts else 0)
+        media_time += max(presented - media_time, 0) - decoded
+    return TrackCut(track, first, last, chunks, max(media_time, 0))
+
+def media_ticks(track: Track, seconds: float) -> int:
+    "Convert a presentation time to the track's media time (through its edit list)."
+    return round(seconds * track.timescale) + (track.edit[0] if track.edit is not None else 0)
+
+def plan(movie: Movie, start: float, end: float) -> List[TrackCut]:
+    "Select the samples of every track for `[start, end)`, starting on a video sync sample."
+
+    video = next((track for track in movie.tracks if track.handler == b"vide"), None)
+    if video is not None:
+        (first, last) = select(video, media_ticks(video, start), media_ticks(video, end))
+        if first >= len(video.sizes):
+            raise Error(f"clip starts after the end of the video: {start}")
+        if last <= first:
+            raise Error(f"clip is empty: {start} - {end}")
+        video_cut = cut_track(video, first, last)
+        # The other tracks start where the video now starts
+        decoded = sample_time(video.stts, first)
+        start = max(0, decoded + video_cut.media_time - media_ticks(video, 0)) / video.timescale
+
+    cuts = []
+    for track in movie.tracks:
+        if track is video:
+            cuts.append(video_cut)
+            continue
+        (first, last) = select(track, media_ticks(track, start), media_ticks(track, end))
+        cuts.append(cut_track(track, first, last))
+    return cuts
+
+def box(kind: bytes, *payload: bytes) -> bytes:
+    "Serialize a box."
+    data = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(data), kind) + data
+
+def full_box(kind: bytes, box_version: int, *payload: bytes) -> bytes:
+    "Serialize a full box with no flags."
+    return box(kind, struct.pack(">I", box_version << 24), *payload)
+
+def packed(values: Sequence[int], typecode: str = "I") -> bytes:
+    "Serialize big-endian integers."
+    data = array(typecode, values)
+    if sys.byteorder == "little":
+        data.byteswap()
+    return data.tobytes()
+
+def patch_duration(buf, source: Box, v0_offset: int, v1_offset: int, duration: int) -> bytes:
+    "Copy a `mvhd`, `tkhd` or `mdhd` box with a new duration."
+    data = bytearray(buf[source.start:source.end])
+    if version(buf, source):
+        struct.pack_into(">Q", data, source.data - source.start + v1_offset, duration)
+    else:
+        struct.pack_into(
+            ">I", data, source.data - source.start + v0_offset, min(duration, 0xFFFFFFFF),
+        )
+    return bytes(data)
+
+def sample_table(buf, stbl: Box, track_cut: TrackCut, offsets: Sequence[int], wide: bool) -> bytes:
+    "Serialize the sample tables of a cut track."
+
+    track = track_cut.track
+    stts = slice_runs(track.stts, track_cut.first, track_cut.last)
+    tables = [
+        bytes(buf[child(buf, stbl, b"stsd").start:child(buf, stbl, b"stsd").end]),
+        full_box(
+            b"stts", 0, struct.pack(">I", len(stts)), packed([v for run in stts for v in run]),
+        ),
+    ]
+    if track.ctts is not None:
+        ctts = slice_runs(track.ctts, track_cut.first, track_cut.last)
+        signed = any(offset < 0 for (_, offset) in ctts)
+        tables.append(full_box(
+            b"ctts",
+            1 if signed else 0,
+            struct.pack(">I", len(ctts)),
+            packed([v for run in ctts for v in run], "i" if signed else "I"),
+        ))
+    if track.stss is not None:
+        syncs = track.stss[
+            bisect_left(track.stss, track_cut.first + 1):bisect_left(track.stss, track_cut.last + 1)
+        ]
+        tables.append(full_box(
+            b"stss",
+            0,
+            struct.pack(">I", len(syncs)),
+            packed([sync - track_cut.first for sync in syncs]),
+        ))
+    count = track_cut.last - track_cut.first
+    if track.sample_size:
+        tables.append(full_box(b"stsz", 0, struct.pack(">II", track.sample_size, count)))
+    else:
+        tables.append(full_box(
+            b"stsz",
+            0,
+            struct.pack(">II", 0, count),
+            packed(track.sizes[track_cut.first:track_cut.last]),
+        ))
+
+    stsc: List[int] = []
+    for (number, chunk) in enumerate(track_cut.chunks, 1):
+        if not stsc or stsc[-2] != chunk.samples:
+            stsc.extend((number, chunk.samples, 1))
+    tables.append(full_box(b"stsc", 0, struct.pack(">I", len(stsc) // 3), packed(stsc)))
+    tables.append(full_box(
+        b"co64" if wide else b"stco",
+        0,
+        struct.pack(">I", len(offsets)),
+        packed(offsets, "Q" if wide else "I"),
+    ))
+    return box(b"stbl", *tables)
+
+def build_moov(
+        buf,
+        movie: Movie,
+        cuts: List[TrackCut],
+        offsets: List[List[int]],
+        wide: bool,
+) -> bytes:
+    "Serialize the `moov` box of the cut file."
+
+    def copy(source: Box) -> bytes:
+        return bytes(buf[source.start:source.end])
+
+    def rebuild(parent: Box, replace: Dict[bytes, bytes]) -> bytes:
+        return box(parent.kind, *(
+            replace.get(item.kind, copy(item)) for item in boxes(buf, parent.data, parent.end)
+        ))
+
+    movie_durations = []
+    traks = []
+    for (track_cut, chunk_offsets) in zip(cuts, offsets):
+        track = track_cut.track
+        media = track_cut.duration
+        media_time = track_cut.media_time if track.edit is not None else 0
+        duration = max(0, media - media_time) * movie.timescale // track.timescale
+        movie_durations.append(duration)
+
+        mdia = child(buf, track.trak, b"mdia")
+        minf = child(buf, mdia, b"minf")
+        stbl = child(buf, minf, b"stbl")
+        replace = {
+            b"tkhd": patch_duration(buf, child(buf, track.trak, b"tkhd"), 20, 28, duration),
+            b"mdia": rebuild(mdia, {
+                b"mdhd": patch_duration(buf, child(buf, mdia, b"mdhd"), 16, 24, media),
+                b"minf": rebuild(minf, {
+                    b"stbl": sample_table(buf, stbl, track_cut, chunk_offsets, wide),
+                }),
+            }),
+        }
+        if track.edit is not None:
+            (_, rate) = track.edit
+            wide_edit = duration > 0x7FFFFFFF or media_time > 0x7FFFFFFF
+            entry = (struct.pack(">Qq", duration, media_time) if wide_edit
+                     else struct.pack(">Ii", duration, media_time))
+            replace[b"edts"] = box(b"edts", full_box(
+                b"elst", 1 if wide_edit else 0, struct.pack(">I", 1), entry, rate,
+            ))
+        traks.append(rebuild(track.trak, replace))
+
+    parts = []
+    remaining = iter(traks)
+    for item in boxes(buf, movie.moov.data, movie.moov.end):
+        if item.kind == b"mvhd":
+            parts.append(patch_duration(buf, item, 16, 24, max(movie_durations)))
+        elif item.kind == b"trak":
+            parts.append(next(remaining))
+        else:
+            parts.append(copy(item))
+    return box(b"moov", *parts)
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, size: int):
+    "Copy `size` bytes at `offset` of `src_fd` to the current position of `dst_fd`."
+    copy_file_range = getattr(os, "copy_file_range", None)
+    while size > 0:
+        copied = 0
+        if copy_file_range is not None:
+            try:
+                copied = copy_file_range(src_fd, dst_fd, size, offset)
+            except OSError:
+                # Unsupported by this kernel or file system pair
+                copy_file_range = None
+        if copy_file_range is None:
+            data = os.pread(src_fd, min(size, 1 << 20), offset)
+            copied = os.write(dst_fd, data) if data else 0
+        if not copied:
+            raise Error("unexpected end of file while copying sample data")
+        offset += copied
+        size -= copied
+
+def supported(src: Path, dst: Path) -> bool:
+    "Check whether a cut can be attempted natively (both files are ISO-BMFF)."
+    return src.suffix.lower() in EXTENSIONS and dst.suffix.lower() in EXTENSIONS
+
+def cut(src: Path, dst: Path, start: float, end: float):
+    """Stream copy `[start, end)` of an MP4/MOV file without ffmpeg.
+
+    Times are presentation times (after composition offsets and the edit
+    list), and the cut starts on the video sync sample presented at or before
+    `start`. Raises `UnsupportedError` for files that need ffmpeg (fragmented
+    files, edit lists with several edits, other track types, ...).
+    """
+
+    with src.open("rb") as file:
+        try:
+            buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as ex:
+            raise UnsupportedError(ex)
+        with buf:
+            try:
+                movie = parse(buf)
+            except struct.error as ex:
+                raise UnsupportedError(ex)
+            cuts = plan(movie, start, end)
+
+            # Lay out the chunks of all tracks in source order, so the source
+            # is read sequentially and the tracks stay interleaved
+            order = sorted(
+                ((chunk.offset, index, number) for (index, track_cut) in enumerate(cuts)
+                 for (number, chunk) in enumerate(track_cut.chunks)),
+            )
+            relative = [[0] * len(track_cut.chunks) for track_cut in cuts]
+            position = 0
+            for (_, index, number) in order:
+                relative[index][number] = position
+                position += cuts[index].chunks[number].size
+
+            ftyp = bytes(buf[movie.ftyp.start:movie.ftyp.end]) if movie.ftyp else b""
+            # The moov size depends only on the offset width, not the values
+            wide = False
+            moov = build_moov(buf, movie, cuts, relative, wide)
+            base = len(ftyp) + len(moov) + MDAT_HEADER_SIZE
+            if base + position > MAX_STCO_OFFSET:
+                wide = True
+                moov = build_moov(buf, movie, cuts, relative, wide)
+                base = len(ftyp) + len(moov) + MDAT_HEADER_SIZE
+            offsets = [[base + offset for offset in track] for track in relative]
+            moov = build_moov(buf, movie, cuts, offsets, wide)
+
+        with tempfile.NamedTemporaryFile(
+                dir=dst.parent,
+                prefix=f".{dst.stem}.",
+                suffix=dst.suffix,
+                delete=False,
+        ) as out:
+            tmp = Path(out.name)
+            try:
+                out.write(ftyp)
+                out.write(moov)
+                out.write(struct.pack(">I4sQ", 1, b"mdat", MDAT_HEADER_SIZE + position))
+                out.flush()
+
+                # Coalesce chunks that are contiguous in the source
+                ranges: List[List[int]] = []
+                for (offset, index, number) in order:
+                    size = cuts[index].chunks[number].size
+                    if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                        ranges[-1][1] += size
+                    else:
+                        ranges.append([offset, size])
+                for (offset, size) in ranges:
+                    copy_range(file.fileno(), out.fileno(), offset, size)
+            except BaseException:
+                out.close()
+                tmp.unlink()
+                raise
+    os.replace(tmp, dst)
@@ -0,0 +1,179 @@
+"Output filename rendering module."
+
+import datetime
+import functools
+import re
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Pattern, Sequence, Tuple, Type, TypeVar
+
+from mvcs.config import Config, NameCollision, Replace
+from mvcs.error import Error
+from mvcs.time import timedelta_to_path_str
+
+# Characters that are not allowed in output filenames.
+BAD_CHARS = "\"*/:?\\|<>"
+
+RendererType = TypeVar("RendererType", bound="NameRenderer")
+class NameRenderer(NamedTuple):
+    "Compiled filename replacement rules for rendering file names."
+
+    # `str.translate` table for characters that are not allowed in filenames.
+    table: Dict[int, str]
+    # Alternation of all `filename_replace` keys, longest first.
+    pattern: Optional[Pattern]
+    # `filename_replace` mapping.
+    replace: Dict[str, str]
+    # Output clip file extension.
+    output_ext: str
+    # Input video filename format.
+    video_filename_format: str
+    # Input video file extension.
+    video_ext: str
+
+    @classmethod
+    def from_config(cls: Type[RendererType], config: Config) -> RendererType:
+        "Compile the filename rules of a config."
+        replace = dict(config.filename_replace)
+        keys = sorted(replace, key=len, reverse=True)
+        return cls(
+            table=str.maketrans({bad: "-" for bad in BAD_CHARS}),
+            pattern=re.compile("|".join(re.escape(key) for key in keys)) if keys else None,
+            replace=replace,
+            output_ext=config.output_ext,
+            video_filename_format=config.video_filename_format,
+            video_ext=config.video_ext,
+        )
+
+    def apply(self, target: str) -> str:
+        "Apply `filename_replace` to a string in a single pass."
+        if self.pattern is None:
+            return target
+        return self.pattern.sub(lambda match: self.replace[match.group(0)], target)
+
+    def clip_name(
+            self,
+            date: datetime.datetime,
+            epoch: datetime.timedelta,
+            title: str,
+            start: datetime.timedelta,
+            clip_title: str,
+    ) -> str:
+        "Get the output file name for a clip."
+        name = " - ".join((
+            (date + epoch).strftime("%Y-%m-%d %H:%M:%S"),
+            f"T+{timedelta_to_path_str(start - epoch)}",
+            title,
+            clip_title,
+        )).casefold()
+        return f"{self.apply(name.translate(self.table))}.{self.output_ext}"
+
+    def reel_name(self, title: str) -> str:
+        "Get the output file name for a reel."
+        return f"{self.apply(title.casefold().translate(self.table))}.{self.output_ext}"
+
+    def source_name(self, date: datetime.datetime) -> str:
+        "Get the file name of the source video recorded at `date`."
+        return f"{self.apply(date.strftime(self.video_filename_format))}.{self.video_ext}"
+
+    def source_date(self, name: str) -> datetime.datetime:
+        "Get the recording date of a source video file name (see `source_name`)."
+        path = Path(name)
+        if path.suffix != f".{self.video_ext}":
+            raise Error(f"{path} has invalid file extension")
+
+        fmt = self.apply(self.video_filename_format)
+        try:
+            return datetime.datetime.strptime(path.stem, fmt)
+        except ValueError:
+            raise Error(f"{path} does not match format {fmt}")
+
+@functools.lru_cache(maxsize=16)
+def _renderer(
+        replace: Tuple[Tuple[str, str], ...],
+        output_ext: str,
+        video_filename_format: str,
+        video_ext: str,
+) -> NameRenderer:
+    config = Config.default()._replace(
+        filename_replace=Replace(replace),
+        output_ext=output_ext,
+        video_filename_format=video_filename_format,
+        video_ext=video_ext,
+    )
+    return NameRenderer.from_config(config)
+
+def renderer(config: Config) -> NameRenderer:
+    "Get the (cached) compiled filename renderer for a config."
+    return _renderer(
+        tuple(config.filename_replace.items()),
+        config.output_ext,
+        config.video_filename_format,
+        config.video_ext,
+    )
+
+def numbered(path: Path, number: int) -> Path:
+    "Get a numbered variant of an output path."
+    return path.with_name(f"{path.stem} ({number}){path.suffix}")
+
+def collisions(outputs: Sequence[Tuple[Path, Hashable]]) -> List[List[Path]]:
+    "Get groups of output paths that different clip identities render to."
+    groups: Dict[str, Dict[Hashable, Path]] = {}
+    for (path, identity) in outputs:
+        groups.setdefault(str(path).casefold(), {}).setdefault(identity, path)
+    return [list(group.values()) for group in groups.values() if len(group) > 1]
+
+def disambiguate(
+        outputs: Sequence[Tuple[Path, Any]],
+        policy: NameCollision,
+) -> List[Optional[Path]]:
+    """Resolve output paths that different clips render to.
+
+    `outputs` pairs each path with the (orderable) identity of the clip
+    content; clips with the same identity may share a path. Of the clips
+    rendering to one path, the one with the lowest identity keeps it and the
+    others are numbered in identity order, so the result doesn't depend on the
+    order of the job. Returns the path to write each clip to, or `None` for
+    clips that should be skipped.
+    """
+
+    owners: Dict[str, Any] = {}
+    for (path, identity) in outputs:
+        key = str(path).casefold()
+        if key not in owners or identity < owners[key]:
+            owners[key] = identity
+
+    numbers: Dict[Tuple[str, Any], Path] = {}
+    if policy == NameCollision.NUMBER:
+        others: Dict[Tuple[str, Any], Path] = {}
+        for (path, identity) in outputs:
+            key = str(path).casefold()
+            if owners[key] != identity:
+                others.setdefault((key, identity), path)
+        for ((key, identity), path) in sorted(others.items(), key=lambda item: item[0]):
+            number = 2
+            while True:
+                candidate = numbered(path, number)
+                owner = owners.setdefault(str(candidate).casefold(), identity)
+                if owner == identity:
+                    break
+                number += 1
+            numbers[(key, identity)] = candidate
+
+    conflicts: List[str] = []
+    resolved: List[Optional[Path]] = []
+    for (path, identity) in outputs:
+        key = str(path).casefold()
+        if owners[key] == identity:
+            resolved.append(path)
+        elif policy == NameCollision.ERROR:
+            conflicts.append(str(path))
+            resolved.append(None)
+        elif policy == NameCollision.SKIP:
+            print(f"skipping clip with colliding output name: {path}")
+            resolved.append(None)
+        else:
+            resolved.append(numbers[(key, identity)])
+
+    if conflicts:
+        raise Error("output name collisions:\n  " + "\n  ".join(sorted(set(conflicts))))
+    return resolved
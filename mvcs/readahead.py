@@ -0,0 +1,124 @@
+"Source read-ahead and page cache hygiene module."
+
+import contextlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from mvcs import ffmpeg
+from mvcs.config import Config
+from mvcs.error import Error
+
+# Seconds of source around each clip that are read ahead (keyframe slack).
+MARGIN_SECONDS = 5.0
+# Sources modified more recently than this may still be recording, so their pages are kept.
+RECORDING_IDLE_SECONDS = 10.0
+# Bytes of a clip's source read ahead of the position it is being read from.
+WINDOW_BYTES = 32 * 1024 * 1024
+# Seconds between advances of the read-ahead window of a clip being written.
+ADVANCE_SECONDS = 0.5
+
+ByteRange = Tuple[int, int]
+
+def estimate_ranges(
+        size: int,
+        duration: float,
+        spans: Sequence[Tuple[float, float]],
+) -> List[ByteRange]:
+    "Estimate the `(offset, length)` of each `(start, end)` span of a source from its bitrate."
+
+    ranges = []
+    rate = size / duration if duration > 0 else 0.0
+    for (start, end) in spans:
+        offset = max(0, int((start - MARGIN_SECONDS) * rate))
+        stop = min(size, int((end + MARGIN_SECONDS) * rate))
+        ranges.append((offset, max(0, stop - offset)))
+    return ranges
+
+def clip_ranges(config: Config, src: Path, spans: Sequence[Tuple[float, float]]) -> List[Optional[ByteRange]]:
+    "Estimate the byte range of each clip of a source, or `None` where it is unknown."
+    try:
+        size = src.stat().st_size
+        duration = ffmpeg.duration(config, src)
+    except (Error, OSError):
+        return [None] * len(spans)
+    return list(estimate_ranges(size, duration, spans))
+
+def advise(src: Path, byte_range: ByteRange, advice_name: str):
+    "Give the kernel `posix_fadvise` advice about a byte range of a file (best-effort)."
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(src, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, byte_range[0], byte_range[1], advice)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def will_need(src: Path, byte_range: Optional[ByteRange]):
+    "Start reading a byte range of a source into the page cache in the background."
+    if byte_range is not None and byte_range[1] > 0:
+        advise(src, byte_range, "POSIX_FADV_WILLNEED")
+
+def window(byte_range: Optional[ByteRange], position: int) -> Optional[ByteRange]:
+    "Get the part of a byte range read ahead when `position` bytes of it have been read."
+    if byte_range is None:
+        return None
+    (offset, length) = byte_range
+    position = min(max(0, position), length)
+    return (offset + position, min(WINDOW_BYTES, length - position))
+
+def written(dst: Path) -> int:
+    "Get the size of a clip being written (0 until it exists)."
+    try:
+        return dst.stat().st_size
+    except OSError:
+        return 0
+
+@contextlib.contextmanager
+def following(src: Path, byte_range: Optional[ByteRange], dst: Path) -> Iterator[None]:
+    """Read a clip's byte range of a source ahead while it is written to `dst`,
+    one window at a time. The read position is estimated from the bytes
+    written so far, which stream copies keep close to the bytes read."""
+
+    if byte_range is None or byte_range[1] <= 0:
+        yield
+        return
+    done = threading.Event()
+
+    def advance():
+        advised = byte_range[0]
+        end = byte_range[0] + byte_range[1]
+        while advised < end:
+            ahead = window(byte_range, written(dst))
+            if ahead is not None and ahead[0] + ahead[1] > advised:
+                start = max(advised, ahead[0])
+                will_need(src, (start, ahead[0] + ahead[1] - start))
+                advised = ahead[0] + ahead[1]
+            if done.wait(ADVANCE_SECONDS):
+                return
+
+    thread = threading.Thread(target=advance, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+def release(src: Path):
+    """Drop a finished source from the page cache, so batch runs don't evict
+    other programs' working set. Sources that may still be recording are kept."""
+    try:
+        if time.time() - src.stat().st_mtime < RECORDING_IDLE_SECONDS:
+            return
+    except OSError:
+        return
+    advise(src, (0, 0), "POSIX_FADV_DONTNEED")
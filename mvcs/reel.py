@@ -0,0 +1,135 @@
+"Highlight reel module."
+
+import datetime
+import os
+import shlex
+import tempfile
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+from mvcs import ffmpeg, names
+from mvcs.config import Config
+from mvcs.encode import concat_quote
+from mvcs.error import Error
+from mvcs.job import Clip, Job, Reel
+
+# Stream parameters that must match for reel parts to be stream copied.
+VIDEO_PARAMS = ("codec_name", "profile", "pix_fmt", "width", "height")
+AUDIO_PARAMS = ("codec_name", "sample_rate", "channels")
+
+class Part(NamedTuple):
+    "Range of a source video in a reel."
+
+    # Source video file.
+    src: Path
+    # Source video timestamp for the start of the part.
+    start: datetime.timedelta
+    # Source video timestamp for the end of the part.
+    end: datetime.timedelta
+
+def reel_parts(config: Config, job: Job, reel: Reel) -> List[Part]:
+    "Resolve the clip references of a reel to source ranges."
+
+    clips: Dict[Tuple[datetime.datetime, str], List[Tuple[Path, Clip]]] = {}
+    for video in job.videos:
+        src = video.src_path(config, job.video_dir)
+        for clip in video.clips:
+            clips.setdefault((video.date, clip.title), []).append((src, clip))
+
+    parts = []
+    for (date, title) in reel.clips:
+        matches = clips.get((date, title), [])
+        if len(matches) != 1:
+            problem = "unknown" if not matches else "ambiguous"
+            raise Error(f"{reel.title}: {problem} clip reference: {date}: {title}")
+        (src, clip) = matches[0]
+        parts.append(Part(src, clip.start, clip.end))
+    return parts
+
+def stream_params(src: Path) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    "Get the video and audio parameters of a source that must match to concatenate."
+    video = ffmpeg.stream_info(src, "v:0")
+    audio = ffmpeg.stream_info(src, "a:0")
+    return (
+        tuple(video.get(key, "") for key in VIDEO_PARAMS),
+        tuple(audio.get(key, "") for key in AUDIO_PARAMS),
+    )
+
+def concat_list(parts: List[Part]) -> str:
+    "Get a concat demuxer list that reads the parts straight from their sources."
+    return "".join(
+        f"file {concat_quote(str(part.src.resolve()))}\n"
+        f"inpoint {part.start.total_seconds()}\n"
+        f"outpoint {part.end.total_seconds()}\n"
+        for part in parts
+    )
+
+def encode_args(config: Config, parts: List[Part], width: str, height: str) -> List[str]:
+    "Get ffmpeg arguments that re-encode parts with different codec parameters."
+
+    args: List[str] = []
+    filters = []
+    for (i, part) in enumerate(parts):
+        args.extend((
+            "-ss", str(part.start.total_seconds()),
+            "-t", str((part.end - part.start).total_seconds()),
+            "-i", str(part.src),
+        ))
+        filters.append(
+            f"[{i}:v:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p[v{i}];"
+            f"[{i}:a:0]aformat=sample_rates=48000:channel_layouts=stereo[a{i}]"
+        )
+    streams = "".join(f"[v{i}][a{i}]" for i in range(len(parts)))
+    filters.append(f"{streams}concat=n={len(parts)}:v=1:a=1[v][a]")
+    return [
+        *args,
+        "-filter_complex", ";".join(filters),
+        "-map", "[v]",
+        "-map", "[a]",
+        *shlex.split(config.encode_args),
+        "-c:a", "aac",
+    ]
+
+def write_reel(config: Config, job: Job, reel: Reel) -> Path:
+    "Write a reel, stream copying when all sources share codec parameters."
+
+    dst = job.output_dir / names.renderer(config).reel_name(reel.title)
+    if dst.exists():
+        print(f"skipping existing reel: {dst}")
+        return dst
+
+    parts = reel_parts(config, job, reel)
+    sources = {part.src for part in parts}
+    for src in sources:
+        if not src.is_file():
+            raise Error(f"missing video file: {src}")
+    params = {src: stream_params(src) for src in sources}
+
+    with tempfile.TemporaryDirectory(prefix=".mvcs-", dir=str(dst.parent)) as tmp_s:
+        out = Path(tmp_s) / dst.name
+        if len(set(params.values())) == 1:
+            concat = Path(tmp_s) / "concat.txt"
+            concat.write_text(concat_list(parts), encoding="utf-8")
+            ffmpeg.concat(concat, [(out, {})])
+        else:
+            print(f"re-encoding reel with mixed codec parameters: {dst}")
+            (video, _) = params[parts[0].src]
+            (width, height) = (
+                video[VIDEO_PARAMS.index("width")],
+                video[VIDEO_PARAMS.index("height")],
+            )
+            ffmpeg.run((*encode_args(config, parts, width, height), str(out)))
+        os.replace(out, dst)
+    return dst
+
+def write_reels(config: Config, job: Job):
+    "Write the job's reels (only those titled in `config.args`, if any)."
+
+    titles = set(config.args)
+    unknown = titles - {reel.title for reel in job.reels}
+    if unknown:
+        raise Error(f"unknown reels: {', '.join(sorted(unknown))}")
+    for reel in job.reels:
+        if not titles or reel.title in titles:
+            write_reel(config, job, reel)
@@ -0,0 +1,179 @@
+"Output renaming module."
+
+import errno
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from mvcs import manifest, thumbs
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Job
+
+def companions(config: Config) -> Sequence[Callable[[Path], Path]]:
+    "Get functions mapping a clip output path to the paths of the files that go with it."
+    return [target.path for target in config.targets] + [thumbs.poster_path, thumbs.sheet_path]
+
+def staging_path(path: Path) -> Path:
+    "Get the hidden path a file is moved to while outputs trade names."
+    return path.with_name(f".{path.name}.rename")
+
+def unstage(src: Path, dst: Path) -> bool:
+    "Move a staged file to its new name, or back to its old one if that fails."
+    try:
+        if dst.exists():
+            raise FileExistsError(errno.EEXIST, "file exists", str(dst))
+        os.replace(staging_path(src), dst)
+        return True
+    except OSError as ex:
+        os.replace(staging_path(src), src)
+        print(f"cannot rename {src}: {ex}")
+        return False
+
+def journal_path(config: Config) -> Path:
+    "Get the path of the journal of an unfinished rename of the job's outputs."
+    return config.job_path.with_name(f"{config.job_path.stem}.rename.json")
+
+def load_journal(config: Config) -> Optional[Dict[str, Any]]:
+    "Load the rename journal (`None` if no rename was interrupted)."
+    path = journal_path(config)
+    try:
+        with path.open(encoding="utf-8") as file:
+            journal = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as ex:
+        raise Error(f"invalid rename journal: {path}: {ex}")
+    if not isinstance(journal, dict) or not isinstance(journal.get("renames"), list):
+        raise Error(f"invalid rename journal: {path}")
+    return journal
+
+def store_journal(config: Config, journal: Dict[str, Any]):
+    "Atomically replace the rename journal."
+    manifest.store_json(journal_path(config), journal)
+
+def moves(entry: Dict[str, Any]) -> List[Tuple[Path, Path]]:
+    "Get the `(old, new)` paths of the files of a journaled clip rename."
+    return [(Path(src), Path(dst)) for (src, dst) in entry["moves"]]
+
+def stage(journal: Dict[str, Any]):
+    "Move every file of the journal aside, so outputs can trade names."
+    for entry in journal["renames"]:
+        for (src, _) in moves(entry):
+            if src.exists():
+                os.replace(src, staging_path(src))
+
+def roll_back(journal: Dict[str, Any]):
+    "Move the staged files of the journal back to their old names."
+    for entry in journal["renames"]:
+        for (src, _) in moves(entry):
+            if staging_path(src).exists():
+                os.replace(staging_path(src), src)
+
+def finish(config: Config, journal: Dict[str, Any]) -> int:
+    """Move the staged files of the journal to their new names (or back where
+    that fails), record the renamed clips in the manifest and remove the
+    journal; returns the number of clips renamed."""
+
+    outcomes = journal["renamed"]
+    for (index, entry) in enumerate(journal["renames"]):
+        (old, new) = (Path(entry["old"]), Path(entry["new"]))
+        others = [(src, dst) for (src, dst) in moves(entry) if src != old]
+        if outcomes[index] is None:
+            # Decide before moving anything, so a crash cannot lose track of the clip
+            outcomes[index] = staging_path(old).exists() and not new.exists()
+            store_journal(config, journal)
+        if outcomes[index] and staging_path(old).exists() and not unstage(old, new):
+            outcomes[index] = False
+            store_journal(config, journal)
+        elif not outcomes[index] and staging_path(old).exists():
+            os.replace(staging_path(old), old)
+        for (src, dst) in others:
+            if not staging_path(src).exists():
+                continue
+            if outcomes[index]:
+                unstage(src, dst)
+            else:
+                os.replace(staging_path(src), src)
+        if outcomes[index]:
+            print(f"renamed clip: {old} -> {new}")
+
+    done = [
+        (Path(entry["old"]), Path(entry["new"]), entry["identity"])
+        for (entry, outcome) in zip(journal["renames"], outcomes)
+        if outcome
+    ]
+    clips = manifest.load(config)
+    # Renames recorded before a crash are not moved again
+    pending = [
+        (old, new, identity) for (old, new, identity) in done
+        if str(old) in clips and not (
+            str(new) in clips
+            and manifest.content_key(clips[str(new)]) == manifest.content_key(identity)
+        )
+    ]
+    manifest.store(config, manifest.renamed(clips, pending))
+    journal_path(config).unlink()
+    return len(done)
+
+def recover(config: Config) -> int:
+    """Finish a rename interrupted after every file was moved aside, or roll it
+    back if it was interrupted before; returns the number of clips renamed."""
+
+    journal = load_journal(config)
+    if journal is None:
+        return 0
+    if not journal.get("staged"):
+        roll_back(journal)
+        journal_path(config).unlink()
+        return 0
+    return finish(config, journal)
+
+def rename_outputs(config: Config, job: Job) -> int:
+    """Rename existing clips whose names changed but whose content did not
+    (e.g. after fixing a title or an epoch), instead of extracting them again.
+
+    Clips are recognized by their manifest entries; the destinations and
+    thumbnails of a clip are renamed with it. The renames are journaled next
+    to the job file first, and a rename interrupted by a crash is finished or
+    rolled back by the next run. Returns the number of clips.
+    """
+
+    config = config._replace(targets=job.targets)
+    recover(config)
+    planned = job.planned(config)
+    renames = manifest.plan_renames(manifest.load(config), planned)
+    if not renames:
+        return 0
+
+    identities = {str(dst): identity for (dst, identity) in planned}
+    journal = {
+        "renames": [
+            {
+                "old": str(old),
+                "new": str(new),
+                "identity": identities[str(new)],
+                "moves": [
+                    (str(src), str(dst))
+                    for (src, dst) in [(old, new)] + [
+                        (path(old), path(new)) for path in companions(config)
+                    ]
+                    if src.exists()
+                ],
+            }
+            for (old, new) in renames
+        ],
+        "staged": False,
+        "renamed": [None] * len(renames),
+    }
+    store_journal(config, journal)
+    stage(journal)
+    journal["staged"] = True
+    store_journal(config, journal)
+    return finish(config, journal)
+
+def orphaned_outputs(config: Config, job: Job) -> List[Path]:
+    "Get the recorded clips that no clip of the job produces anymore."
+    config = config._replace(targets=job.targets)
+    return manifest.orphans(manifest.load(config), job.planned(config))
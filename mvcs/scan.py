@@ -0,0 +1,258 @@
+"Source integrity scan module."
+
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, List, NamedTuple, Optional, Sequence, Tuple
+
+from mvcs import cache, ffmpeg, mp4, readahead, trace
+from mvcs.config import Config
+from mvcs.error import Error, UnsupportedError
+
+# Matroska element IDs (with their length markers).
+EBML_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+CLUSTER_ID = 0x1F43B675
+CUES_ID = 0x1C53BB6B
+# File extensions of Matroska files.
+MATROSKA_EXTENSIONS = {".mka", ".mkv", ".webm"}
+# First bytes of other containers, by file extension.
+MAGIC = {
+    ".flv": (0, b"FLV"),
+    ".ts": (0, b"\x47"),
+}
+
+# Seconds at the end of a source that must decode.
+TAIL_SECONDS = 5.0
+# Seconds before the declared end that are searched for the last packet.
+END_WINDOW_SECONDS = 30.0
+# Largest gap between the last packet and the declared duration in seconds.
+DURATION_TOLERANCE = 2.0
+# Range of plausible average bitrates (bits per second) for a recording.
+MIN_BITRATE = 8_000
+MAX_BITRATE = 1_000_000_000
+
+class Report(NamedTuple):
+    "Integrity problems found in a source video."
+
+    # Path to the source video file.
+    path: Path
+    # Description of every problem (empty if the source is intact).
+    problems: List[str]
+
+def read_vint(file: BinaryIO, keep_marker: bool) -> Optional[int]:
+    """Read an EBML variable-length integer (an element ID with `keep_marker`,
+    otherwise a data size, where all ones means unknown)."""
+
+    first = file.read(1)
+    if not first:
+        return None
+    length = 1
+    while length <= 8 and not first[0] & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise UnsupportedError("invalid element header")
+    rest = file.read(length - 1)
+    if len(rest) != length - 1:
+        return None
+    value = int.from_bytes(first + rest, "big")
+    if keep_marker:
+        return value
+    value &= (1 << (7 * length)) - 1
+    return -1 if value == (1 << (7 * length)) - 1 else value
+
+def read_element(file: BinaryIO) -> Optional[Tuple[int, int, int]]:
+    "Read an element header; returns its ID, data offset and data size (-1 if unknown)."
+    element_id = read_vint(file, True)
+    if element_id is None:
+        return None
+    size = read_vint(file, False)
+    if size is None:
+        return None
+    return (element_id, file.tell(), size)
+
+def matroska_problems(path: Path) -> List[str]:
+    "Check the header, seeking index (cues) and completeness of a Matroska file."
+
+    size = path.stat().st_size
+    with path.open("rb") as file:
+        try:
+            header = read_element(file)
+            if header is None or header[0] != EBML_ID or header[2] < 0:
+                return ["missing Matroska header"]
+            file.seek(header[1] + header[2])
+            segment = read_element(file)
+            if segment is None or segment[0] != SEGMENT_ID:
+                return ["missing Matroska segment"]
+
+            problems = []
+            (_, start, length) = segment
+            end = size if length < 0 else start + length
+            if end > size:
+                problems.append(f"truncated: {size} of {end} bytes")
+            # Walk the top-level elements (clusters are skipped by their size)
+            cues = False
+            position = start
+            while position < min(end, size):
+                file.seek(position)
+                element = read_element(file)
+                if element is None:
+                    break
+                (element_id, data, length) = element
+                if element_id == CUES_ID:
+                    cues = True
+                if length < 0:
+                    # A live (unfinished) element runs to the end of the file
+                    break
+                if data + length > size:
+                    if not problems:
+                        problems.append(f"truncated: {size} of {data + length} bytes")
+                    break
+                position = data + length
+        except UnsupportedError as ex:
+            return [f"corrupt Matroska structure: {ex}"]
+    if not cues:
+        problems.append("missing cues (seeking index)")
+    return problems
+
+def mp4_problems(path: Path) -> List[str]:
+    "Check the header, movie index (moov) and completeness of an MP4/MOV file."
+
+    with path.open("rb") as file:
+        if os.fstat(file.fileno()).st_size < 8:
+            return ["missing MP4 header"]
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            kinds = []
+            problem: Optional[str] = None
+            try:
+                for box in mp4.boxes(buf, 0, len(buf)):
+                    kinds.append(box.kind)
+            except UnsupportedError as ex:
+                problem = f"truncated: {ex}"
+    if not kinds or kinds[0] not in (b"ftyp", b"free", b"mdat", b"moov", b"skip", b"wide"):
+        return ["missing MP4 header"]
+    problems = [problem] if problem is not None else []
+    if b"moov" not in kinds:
+        problems.append("missing moov box (movie index)")
+    return problems
+
+def container_problems(path: Path) -> List[str]:
+    "Check the container structure of a source with a known format."
+
+    suffix = path.suffix.lower()
+    if suffix in MATROSKA_EXTENSIONS:
+        return matroska_problems(path)
+    if suffix in mp4.EXTENSIONS:
+        return mp4_problems(path)
+    if suffix in MAGIC:
+        (offset, magic) = MAGIC[suffix]
+        with path.open("rb") as file:
+            file.seek(offset)
+            if file.read(len(magic)) != magic:
+                return [f"missing {suffix.lstrip('.').upper()} header"]
+    return []
+
+def last_packet(path: Path, duration: float) -> Optional[float]:
+    "Get the timestamp of the last packet near the declared end of a source."
+
+    output = ffmpeg.probe((
+        "-read_intervals", f"{max(0.0, duration - END_WINDOW_SECONDS)}%",
+        "-show_entries", "packet=pts_time",
+        "-of", "csv=p=0",
+        str(path),
+    ))
+    times = []
+    for line in output.splitlines():
+        try:
+            times.append(float(line.strip().rstrip(",")))
+        except ValueError:
+            continue
+    return max(times) if times else None
+
+def source_problems(config: Config, path: Path) -> Tuple[List[str], bool]:
+    """Check the structure, duration and tail of a source.
+
+    Returns the problems and whether every check ran (ffprobe and ffmpeg
+    errors are reported, but the result should not be cached).
+    """
+
+    try:
+        problems = container_problems(path)
+        size = path.stat().st_size
+    except OSError as ex:
+        return ([f"unreadable: {ex}"], False)
+
+    try:
+        duration = ffmpeg.duration(config, path)
+    except Error as ex:
+        return (problems + [f"unreadable duration: {ex}"], False)
+    if duration <= 0:
+        return (problems + ["zero duration"], True)
+    bitrate = size * 8 / duration
+    if not MIN_BITRATE <= bitrate <= MAX_BITRATE:
+        problems.append(
+            f"duration {duration:.1f}s does not match the file size ({size} bytes)",
+        )
+
+    try:
+        end = last_packet(path, duration)
+        tail = ffmpeg.errors((
+            "-sseof", f"-{TAIL_SECONDS}",
+            "-i", str(path),
+            "-map", "0:v?",
+            "-map", "0:a?",
+            "-f", "null",
+            "-",
+        ))
+    except Error as ex:
+        return (problems + [f"cannot check the end: {ex}"], False)
+    if end is None:
+        problems.append(f"no packets before the declared end ({duration:.1f}s)")
+    elif duration - end > DURATION_TOLERANCE:
+        problems.append(f"declared duration {duration:.1f}s, but packets end at {end:.1f}s")
+    if tail:
+        problems.append(f"tail does not decode: {tail[0]}")
+    return (problems, True)
+
+def scan_source(config: Config, path: Path) -> Optional[Report]:
+    "Check a source, with cached results; returns `None` for sources that may still be recording."
+
+    try:
+        if time.time() - path.stat().st_mtime < readahead.RECORDING_IDLE_SECONDS:
+            return None
+    except OSError as ex:
+        return Report(path, [f"unreadable: {ex}"])
+    cached = cache.load(config, "scan", path)
+    if isinstance(cached, list):
+        return Report(path, [str(problem) for problem in cached])
+    with trace.span("scan_source", src=path):
+        (problems, complete) = source_problems(config, path)
+    if complete:
+        cache.store(config, "scan", path, problems)
+    return Report(path, problems)
+
+def scan_sources(config: Config, paths: Sequence[Path]) -> List[Report]:
+    "Check sources in parallel, skipping those that may still be recording."
+    with ThreadPoolExecutor(max_workers=config.jobs) as pool:
+        reports = pool.map(lambda path: scan_source(config, path), paths)
+        return [report for report in reports if report is not None]
+
+def repair(path: Path) -> Path:
+    """Remux a broken source into a new file (rebuilding its index and duration),
+    keeping the original as `<name>.broken`; returns the path of the original."""
+
+    backup = path.with_name(f"{path.name}.broken")
+    if backup.exists():
+        raise Error(f"cannot repair {path}: {backup} exists")
+    tmp = path.with_name(f".{path.stem}.repair{path.suffix}")
+    try:
+        ffmpeg.remux(path, [(tmp, {})])
+    except Error:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+    os.replace(path, backup)
+    os.replace(tmp, path)
+    return backup
@@ -0,0 +1,275 @@
+"Multi-job clip scheduling module."
+
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from mvcs import manifest, readahead, timeline, trace
+from mvcs.config import Config, WriteMode
+from mvcs.error import Error, TransientError
+from mvcs.job import Clip, Failure, Job, Video, run_parallel
+
+class JobRun:
+    "Progress and results of one job of a run."
+
+    def __init__(self, config: Config, job: Job):
+        # Configuration of the job (its job path and destinations).
+        self.config = config._replace(targets=job.targets)
+        self.job = job
+        # Output paths of the job's clips (see `Job.output_paths`).
+        self.paths = job.output_paths(self.config)
+        self.total = 0
+        self.done = 0
+        self.shared = 0
+        self.failures: List[Failure] = []
+        self.checksums: Dict[str, Dict[str, Any]] = {}
+
+class Task(NamedTuple):
+    "Clip to write for one of the jobs of a run."
+
+    # Position of the job in the run.
+    job: int
+    # Video the clip is taken from.
+    video: Video
+    # Clip to write.
+    clip: Clip
+    # Path to the source video file.
+    src: Path
+    # Output path of the clip.
+    dst: Path
+    # Recording pieces of a clip that runs past its source (see `Video.spanning_parts`).
+    parts: Sequence[timeline.Part]
+
+    def content_key(self) -> Tuple[Any, ...]:
+        "Get what the output depends on: the source range and the output format."
+        return (str(self.src.resolve()), self.clip.start, self.clip.end, self.dst.suffix.lower())
+
+class DeviceLimits:
+    "Limit on the clips reading or writing each disk at once."
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.semaphores: Dict[int, threading.Semaphore] = {}
+
+    def semaphore(self, device: int) -> threading.Semaphore:
+        "Get the semaphore of a device."
+        with self.lock:
+            return self.semaphores.setdefault(device, threading.Semaphore(self.limit))
+
+    @contextlib.contextmanager
+    def hold(self, *paths: Path) -> Iterator[None]:
+        "Hold a slot on the devices of all paths (acquired in a fixed order)."
+        if self.limit <= 0:
+            yield
+            return
+        devices = set()
+        for path in paths:
+            try:
+                devices.add(os.stat(path).st_dev)
+            except OSError:
+                continue
+        semaphores = [self.semaphore(device) for device in sorted(devices)]
+        for semaphore in semaphores:
+            semaphore.acquire()
+        try:
+            yield
+        finally:
+            for semaphore in reversed(semaphores):
+                semaphore.release()
+
+def link_or_copy(src: Path, dst: Path):
+    "Give `dst` the contents of `src`, as a hard link if possible."
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    with tempfile.NamedTemporaryFile(dir=dst.parent, prefix=f".{dst.stem}.", suffix=dst.suffix,
+                                     delete=False) as file:
+        tmp = Path(file.name)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except OSError:
+        tmp.unlink()
+        raise
+
+def plan_tasks(runs: Sequence[JobRun]) -> List[Task]:
+    "List the clips of every job, failing (or recording failures) for missing sources."
+
+    tasks: List[Task] = []
+    for (position, run) in enumerate(runs):
+        (config, job) = (run.config, run.job)
+        for (video, dsts) in zip(job.videos, run.paths):
+            pending = [(clip, dst) for (clip, dst) in zip(video.clips, dsts) if dst is not None]
+            run.total += len(pending)
+            src = video.src_path(config, job.video_dir)
+            if not pending:
+                continue
+            if not src.is_file():
+                if not config.keep_going:
+                    raise Error(f"{config.job_path}: missing video file: {src}")
+                run.failures.extend(
+                    Failure(clip.identity(video.date), dst, f"missing video file: {src}", 0)
+                    for (clip, dst) in pending
+                )
+                run.done += len(pending)
+                continue
+            missing = [clip for (clip, dst) in pending if not dst.exists()]
+            spanning = video.spanning_parts(config, job.video_dir, src, missing) if missing else {}
+            tasks.extend(
+                Task(position, video, clip, src, dst, spanning.get(clip, ()))
+                for (clip, dst) in pending
+            )
+    return tasks
+
+def plan_primaries(tasks: Sequence[Task]) -> Tuple[List[Task], Dict[Tuple[Any, ...], List[Task]]]:
+    """Pick the task that writes each distinct clip (its primary), in an order
+    that keeps each source's reads together; also returns the other tasks
+    wanting the same clip (its followers) by content key."""
+
+    primaries: Dict[Tuple[Any, ...], Task] = {}
+    followers: Dict[Tuple[Any, ...], List[Task]] = {}
+    for task in tasks:
+        key = task.content_key()
+        if key in primaries:
+            followers.setdefault(key, []).append(task)
+        else:
+            primaries[key] = task
+    order = sorted(primaries.values(), key=lambda task: (str(task.src), task.clip.start))
+    return (order, followers)
+
+class Scheduler:
+    "Writes of the primary tasks of a run, shared with their followers."
+
+    def __init__(
+            self,
+            config: Config,
+            runs: Sequence[JobRun],
+            order: Sequence[Task],
+            followers: Dict[Tuple[Any, ...], List[Task]],
+    ):
+        self.runs = runs
+        self.followers = followers
+        # Primary tasks left to write from each source, to release it after the last one.
+        self.remaining: Dict[Path, int] = {}
+        for task in order:
+            self.remaining[task.src] = self.remaining.get(task.src, 0) + 1
+        # Sources read by this run (only those are released).
+        self.read: Set[Path] = set()
+        self.lock = threading.Lock()
+        self.limits = DeviceLimits(config.device_jobs)
+
+    def finish(self, task: Task, checksum: Optional[manifest.Checksum], failure: Optional[Failure]):
+        "Count a task as done, with its checksum or failure."
+        run = self.runs[task.job]
+        with self.lock:
+            run.done += 1
+            if failure is not None:
+                run.failures.append(failure)
+            elif checksum is not None:
+                run.checksums[str(task.dst)] = manifest.entry(checksum, task.clip.identity(task.video.date))
+            print(f"{run.config.job_path}: {run.done}/{run.total} clips")
+
+    def failure(self, task: Task, ex: Error) -> Failure:
+        "Get the failure of a task, or raise the error if its job does not keep going."
+        run = self.runs[task.job]
+        if not run.config.keep_going:
+            raise ex
+        attempts = run.config.retries + 1 if isinstance(ex, TransientError) else 1
+        print(f"failed to write clip: {task.dst}: {ex}")
+        return Failure(task.clip.identity(task.video.date), task.dst, str(ex), attempts)
+
+    def share(self, task: Task, primary: Task, checksum: Optional[manifest.Checksum]):
+        "Give a follower the clip written by its primary."
+        run = self.runs[task.job]
+        try:
+            if task.dst != primary.dst:
+                if task.dst.exists():
+                    # The existing file was not written by this run
+                    checksum = None
+                else:
+                    link_or_copy(primary.dst, task.dst)
+                    with self.lock:
+                        run.shared += 1
+            if run.config.targets:
+                # Fan the shared clip out to this job's other destinations
+                task.clip.write_with_retries(run.config, task.src, task.dst)
+        except OSError as ex:
+            self.finish(task, None, self.failure(task, Error(ex)))
+        except Error as ex:
+            self.finish(task, None, self.failure(task, ex))
+        else:
+            self.finish(task, checksum, None)
+
+    def write(self, task: Task):
+        "Write the clip of a primary task and share it with its followers."
+        run = self.runs[task.job]
+        if not task.dst.exists():
+            with self.lock:
+                self.read.add(task.src)
+        try:
+            with self.limits.hold(task.src, task.dst.parent):
+                checksum = task.clip.write_with_retries(run.config, task.src, task.dst, task.parts)
+        except Error as ex:
+            error = self.failure(task, ex)
+            self.finish(task, None, error)
+            for follower in self.followers.get(task.content_key(), []):
+                self.finish(follower, None, error._replace(
+                    clip=follower.clip.identity(follower.video.date),
+                    output=follower.dst,
+                ))
+        else:
+            self.finish(task, checksum, None)
+            for follower in self.followers.get(task.content_key(), []):
+                self.share(follower, task, checksum)
+        finally:
+            with self.lock:
+                self.remaining[task.src] -= 1
+                release = self.remaining[task.src] == 0 and task.src in self.read
+            if release:
+                readahead.release(task.src)
+
+def report_runs(runs: Sequence[JobRun]):
+    "Print the summary and write the failure report of every job of a run."
+    failed = []
+    for run in runs:
+        print(f"{run.config.job_path}: {run.total - len(run.failures)} of {run.total} clips done "
+              f"({run.shared} linked from identical clips, {len(run.failures)} failed)")
+        try:
+            run.job.report(run.config, run.failures)
+        except Error as ex:
+            print(f"{run.config.job_path}: {ex}")
+            failed.append(run)
+    if failed:
+        raise Error(f"{len(failed)} of {len(runs)} jobs had failed clips")
+
+def run_jobs(config: Config, jobs: Sequence[Tuple[Config, Job]]):
+    """Run several jobs as one: their clips share the workers and per-disk
+    limits, and a source range wanted by several jobs is extracted once.
+
+    Every job gets its own manifest, failure report and summary.
+    """
+
+    runs = [JobRun(job_config, job) for (job_config, job) in jobs]
+    tasks = plan_tasks(runs)
+    # Identical clips are written once and shared with the other destinations
+    (order, followers) = plan_primaries(tasks)
+    scheduler = Scheduler(config, runs, order, followers)
+
+    # Encoding modes already spread each clip over the workers
+    copying = config.write_mode in (WriteMode.COPY, WriteMode.NATIVE)
+    workers = min(config.jobs, len(order)) if copying else 1
+    try:
+        with trace.span("run_jobs", jobs=len(runs), clips=len(tasks)):
+            run_parallel(workers, scheduler.write, order)
+    finally:
+        # Record the clips written so far, even if the run stops early
+        for run in runs:
+            run.job.record(run.config, run.paths, run.checksums)
+    report_runs(runs)
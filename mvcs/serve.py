@@ -0,0 +1,380 @@
+"On-demand clip server module."
+
+import contextlib
+import html
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Generator, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+from mvcs import timeline, trace
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Clip, Job
+
+# Bytes of remuxed clip per cached segment.
+SEGMENT_SIZE = 1 << 20
+# Number of recently served segments kept in memory.
+CACHE_SEGMENTS = 64
+# Format of clips whose output extension cannot be written to a pipe.
+FALLBACK_EXT = "mkv"
+
+# ffmpeg output options for containers that can be written to a pipe.
+PIPE_FORMATS = {
+    "mka": ("-f", "matroska"),
+    "mkv": ("-f", "matroska"),
+    "ts": ("-f", "mpegts"),
+    "webm": ("-f", "webm"),
+    # MP4 and MOV need a seekable output unless they are fragmented
+    "m4v": ("-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof"),
+    "mov": ("-f", "mov", "-movflags", "frag_keyframe+empty_moov+default_base_moof"),
+    "mp4": ("-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof"),
+}
+
+CONTENT_TYPES = {
+    "m4v": "video/mp4",
+    "mka": "audio/x-matroska",
+    "mkv": "video/x-matroska",
+    "mov": "video/quicktime",
+    "mp4": "video/mp4",
+    "ts": "video/mp2t",
+    "webm": "video/webm",
+}
+
+class Served(NamedTuple):
+    "Clip of the job exposed by the server."
+
+    # File name of the clip in URLs.
+    name: str
+    # Clip to remux.
+    clip: Clip
+    # Path to the source video file.
+    src: Path
+    # Recording pieces of a clip that runs past its source (see `Video.spanning_parts`).
+    parts: Sequence[timeline.Part]
+
+    @property
+    def ext(self) -> str:
+        "Get the extension (and format) of the served clip."
+        return Path(self.name).suffix.lstrip(".").lower()
+
+    def command(self) -> Tuple[Tuple[str, ...], Optional[bytes]]:
+        """Get the ffmpeg command stream copying the clip to stdout, and its
+        input (the ffconcat script of spanning clips).
+
+        Output is bit-exact, so every remux of a clip yields the same bytes and
+        segments of separate remuxes can be mixed.
+        """
+
+        if len(self.parts) > 1:
+            inputs: Tuple[str, ...] = (
+                "-f", "concat",
+                "-safe", "0",
+                "-protocol_whitelist", "file,pipe",
+                "-i", "pipe:0",
+            )
+            script: Optional[bytes] = timeline.concat_script(self.parts).encode("utf-8")
+            limits: Tuple[str, ...] = ()
+        else:
+            inputs = ("-ss", str(self.clip.start.total_seconds()), "-i", str(self.src))
+            script = None
+            limits = ("-t", str((self.clip.end - self.clip.start).total_seconds()))
+        pipe = pipe_args(Path(self.name))
+        assert pipe is not None
+        return ((
+            "ffmpeg",
+            "-loglevel", "error",
+            *(() if script is not None else ("-nostdin",)),
+            "-fflags", "+bitexact",
+            *inputs,
+            "-c:a", "copy",
+            "-c:v", "copy",
+            "-map", "0:v",
+            "-map", "0:a",
+            *limits,
+            "-flags:v", "+bitexact",
+            "-flags:a", "+bitexact",
+            *pipe,
+            "pipe:1",
+        ), script)
+
+def pipe_args(dst: Path) -> Optional[Tuple[str, ...]]:
+    "Get ffmpeg options to write the format of `dst` to a pipe, if it can be."
+    return PIPE_FORMATS.get(dst.suffix.lstrip(".").lower())
+
+def served_clips(config: Config, job: Job) -> List[Served]:
+    "List the clips of the job under their output names, in job order."
+
+    ext = config.output_ext.lstrip(".").lower()
+    if pipe_args(Path(f"clip.{ext}")) is None:
+        ext = FALLBACK_EXT
+    served: List[Served] = []
+    for (video, dsts) in zip(job.videos, job.output_paths(config)):
+        src = video.src_path(config, job.video_dir)
+        clips = [(clip, dst) for (clip, dst) in zip(video.clips, dsts) if dst is not None]
+        spanning = video.spanning_parts(config, job.video_dir, src, [clip for (clip, _) in clips])
+        served.extend(
+            Served(dst.with_suffix(f".{ext}").name, clip, src, spanning.get(clip, ()))
+            for (clip, dst) in clips
+        )
+    return served
+
+def parse_range(header: str, size: Optional[int]) -> Optional[Tuple[int, Optional[int]]]:
+    """Parse a single-range `Range` header into `(start, stop)` byte offsets.
+
+    `stop` is `None` for a range to the end when the size is unknown. Returns
+    `None` for headers that are not understood (the whole clip is served);
+    raises `ValueError` for ranges outside the clip.
+    """
+
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", header)
+    if match is None or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        # Suffix range: the last N bytes
+        if size is None:
+            return None
+        length = int(match.group(2))
+        if length == 0:
+            raise ValueError(header)
+        return (max(0, size - length), size)
+    start = int(match.group(1))
+    stop = int(match.group(2)) + 1 if match.group(2) else None
+    if stop is not None and stop <= start:
+        return None
+    if size is not None:
+        if start >= size:
+            raise ValueError(header)
+        stop = size if stop is None else min(stop, size)
+    return (start, stop)
+
+class SegmentCache:
+    "Least recently used segments of remuxed clips."
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.segments: "OrderedDict[Tuple[str, int], bytes]" = OrderedDict()
+
+    def get(self, key: Tuple[str, int]) -> Optional[bytes]:
+        "Get a segment, if it is cached."
+        with self.lock:
+            data = self.segments.get(key)
+            if data is not None:
+                self.segments.move_to_end(key)
+            return data
+
+    def put(self, key: Tuple[str, int], data: bytes):
+        "Cache a segment, evicting the least recently used ones."
+        with self.lock:
+            self.segments[key] = data
+            self.segments.move_to_end(key)
+            while len(self.segments) > self.capacity:
+                self.segments.popitem(last=False)
+
+class ClipStreams:
+    "Remuxed bytes of the served clips, produced on demand and never written to disk."
+
+    def __init__(self, clips: Sequence[Served], capacity: int = CACHE_SEGMENTS):
+        self.clips: Dict[str, Served] = {served.name: served for served in clips}
+        self.cache = SegmentCache(capacity)
+        self.lock = threading.Lock()
+        # Sizes of the clips remuxed to the end so far.
+        self.sizes: Dict[str, int] = {}
+
+    def size(self, name: str) -> Optional[int]:
+        "Get the size of a remuxed clip, if it is known."
+        with self.lock:
+            return self.sizes.get(name)
+
+    def measure(self, name: str) -> int:
+        "Get the size of a remuxed clip, remuxing it to the end if needed."
+        size = self.size(name)
+        if size is None:
+            for _ in self.read(name, 0):
+                pass
+            size = self.size(name)
+            assert size is not None
+        return size
+
+    def read(self, name: str, start: int, stop: Optional[int] = None) -> Generator[bytes, None, None]:
+        """Get the bytes in `[start, stop)` of a clip (to its end if `stop` is `None`).
+
+        Cached segments are served from memory; from the first missing one on,
+        the clip is remuxed from its start (caching the segments on the way).
+        """
+
+        position = start
+        while stop is None or position < stop:
+            index = position // SEGMENT_SIZE
+            data = self.cache.get((name, index))
+            if data is None:
+                yield from self.remux(name, position, stop)
+                return
+            offset = position - index * SEGMENT_SIZE
+            end = len(data) if stop is None else min(len(data), stop - index * SEGMENT_SIZE)
+            if offset >= end:
+                return
+            yield data[offset:end]
+            position += end - offset
+            if len(data) < SEGMENT_SIZE:
+                return
+
+    def remux(self, name: str, start: int, stop: Optional[int]) -> Generator[bytes, None, None]:
+        "Run ffmpeg for a clip and get the bytes in `[start, stop)`."
+
+        (cmd, script) = self.clips[name].command()
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(trace.span("remux", clip=name, start=start))
+            try:
+                proc = stack.enter_context(subprocess.Popen(
+                    cmd,
+                    stdin=subprocess.PIPE if script is not None else subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                ))
+            except OSError as ex:
+                raise Error(ex)
+            assert proc.stdout is not None
+            if proc.stdin is not None:
+                try:
+                    proc.stdin.write(script or b"")
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    # ffmpeg failed early; its exit status tells why
+                    pass
+            try:
+                index = 0
+                while stop is None or index * SEGMENT_SIZE < stop:
+                    data = proc.stdout.read(SEGMENT_SIZE)
+                    begin = index * SEGMENT_SIZE
+                    end = begin + len(data)
+                    last = len(data) < SEGMENT_SIZE
+                    if last:
+                        # The end of a clip is only cached if ffmpeg succeeded
+                        if proc.wait():
+                            raise Error(f"cannot remux clip: {name}: ffmpeg exited with {proc.returncode}")
+                        with self.lock:
+                            self.sizes[name] = end
+                    if data:
+                        self.cache.put((name, index), data)
+                    if end > start:
+                        yield data[max(0, start - begin):(end if stop is None else min(end, stop)) - begin]
+                    if last:
+                        return
+                    index += 1
+            finally:
+                if proc.poll() is None:
+                    # The client stopped reading, or has all it asked for
+                    proc.kill()
+
+class ClipServer(ThreadingHTTPServer):
+    "HTTP server of the clips of a job."
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], streams: ClipStreams):
+        super().__init__(address, ClipHandler)
+        self.streams = streams
+
+class ClipHandler(BaseHTTPRequestHandler):
+    "Request handler serving the clip index and clips with byte ranges."
+
+    server: ClipServer
+
+    def do_HEAD(self): # pylint: disable=invalid-name
+        "Serve the headers of a clip or the index."
+        self.handle_request(body=False)
+
+    def do_GET(self): # pylint: disable=invalid-name
+        "Serve a clip or the index."
+        self.handle_request(body=True)
+
+    def handle_request(self, body: bool):
+        "Serve a clip or the index."
+        path = unquote(self.path.split("?", 1)[0])
+        if path == "/":
+            self.send_index(body)
+        elif path.startswith("/clips/") and path[len("/clips/"):] in self.server.streams.clips:
+            self.send_clip(path[len("/clips/"):], body)
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def send_index(self, body: bool):
+        "Serve the list of clips."
+        items = "".join(
+            f'<li><a href="/clips/{quote(name)}">{html.escape(name)}</a></li>\n'
+            for name in self.server.streams.clips
+        )
+        page = f"<!DOCTYPE html>\n<title>mvcs clips</title>\n<ul>\n{items}</ul>\n".encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        if body:
+            self.wfile.write(page)
+
+    def send_clip(self, name: str, body: bool):
+        """Serve a clip, or the requested byte range of it.
+
+        A range from the start of a clip of unknown size gets the whole clip
+        while it is remuxed; other ranges wait for its size.
+        """
+
+        streams = self.server.streams
+        header = self.headers.get("Range")
+        size = streams.size(name)
+        try:
+            if header is not None and size is None and not re.match(r"\s*bytes\s*=\s*0+\s*-", header):
+                size = streams.measure(name)
+            byte_range = parse_range(header, size) if header is not None else None
+        except ValueError:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return
+        except Error as ex:
+            self.send_error(HTTPStatus.BAD_GATEWAY, str(ex))
+            return
+
+        if byte_range is not None and size is not None:
+            (start, stop) = byte_range
+            assert stop is not None
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{stop - 1}/{size}")
+            self.send_header("Content-Length", str(stop - start))
+        else:
+            (start, stop) = (0, None)
+            self.send_response(HTTPStatus.OK)
+            if size is not None:
+                self.send_header("Content-Length", str(size))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", CONTENT_TYPES.get(streams.clips[name].ext, "application/octet-stream"))
+        self.end_headers()
+        if not body:
+            return
+
+        with contextlib.closing(streams.read(name, start, stop)) as chunks:
+            try:
+                for chunk in chunks:
+                    self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            except Error as ex:
+                # Headers are out: the client sees a short body
+                self.log_error("%s", ex)
+
+def serve(config: Config, job: Job, port: int):
+    "Serve the clips of the job on the loopback interface until interrupted."
+
+    clips = served_clips(config, job)
+    with ClipServer(("127.0.0.1", port), ClipStreams(clips)) as server:
+        print(f"serving {len(clips)} clips at http://127.0.0.1:{server.server_address[1]}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
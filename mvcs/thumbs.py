@@ -0,0 +1,113 @@
+"Clip thumbnail and contact sheet module."
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from mvcs import ffmpeg
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Clip, Job, Video
+
+# Width of poster frames and contact sheet tiles in pixels.
+THUMB_WIDTH = 320
+# Contact sheet layout (columns, rows).
+SHEET_TILES = (4, 4)
+# Clips closer than this (in seconds) share one decode pass; farther clips are
+# reached with their own seek instead of decoding the keyframes in between.
+PASS_GAP_SECONDS = 30.0
+
+def poster_path(dst: Path) -> Path:
+    "Get the poster frame path for a clip output path."
+    return dst.with_suffix(".jpg")
+
+def sheet_path(dst: Path) -> Path:
+    "Get the contact sheet path for a clip output path."
+    return dst.with_suffix(".sheet.jpg")
+
+def plan_passes(clips: Sequence[Tuple[Clip, Path]]) -> List[List[Tuple[Clip, Path]]]:
+    "Group clips into decode passes over nearby parts of a source, in source order."
+
+    passes: List[List[Tuple[Clip, Path]]] = []
+    end = None
+    for (clip, dst) in sorted(clips, key=lambda item: (item[0].start, item[0].end)):
+        if end is None or (clip.start - end).total_seconds() > PASS_GAP_SECONDS:
+            passes.append([])
+            end = clip.end
+        passes[-1].append((clip, dst))
+        end = max(end, clip.end)
+    return passes
+
+def thumbnail_args(
+        src: Path,
+        clips: Sequence[Tuple[Clip, Path]],
+) -> List[str]:
+    "Get ffmpeg arguments that write images for nearby clips in one pass over `src`."
+
+    base = min(clip.start for (clip, _) in clips).total_seconds()
+    length = max(clip.end for (clip, _) in clips).total_seconds() - base
+    (columns, rows) = SHEET_TILES
+    scale = f"scale={THUMB_WIDTH}:-2"
+
+    # Decode keyframes only; every output filters the same decoded frames
+    args = [
+        "-y",
+        "-skip_frame", "nokey",
+        "-ss", str(base),
+        "-t", str(length),
+        "-i", str(src),
+    ]
+    for (clip, dst) in clips:
+        start = clip.start.total_seconds() - base
+        end = clip.end.total_seconds() - base
+        step = (end - start) / (columns * rows)
+        args.extend((
+            "-map", "0:v:0",
+            "-vf", f"select='gte(t,{start})',{scale}",
+            "-frames:v", "1",
+            "-update", "1",
+            str(poster_path(dst)),
+            "-map", "0:v:0",
+            "-vf", (
+                f"select='between(t,{start},{end})"
+                f"*(isnan(prev_selected_t)+gte(t-prev_selected_t,{step}))',"
+                f"{scale},tile={columns}x{rows}"
+            ),
+            "-frames:v", "1",
+            "-update", "1",
+            str(sheet_path(dst)),
+        ))
+    return args
+
+def write_video_thumbnails(
+        config: Config,
+        video: Video,
+        src_dir: Path,
+        dsts: Sequence[Optional[Path]],
+):
+    "Write the missing poster frames and contact sheets for one source video."
+
+    clips = [
+        (clip, dst)
+        for (clip, dst) in zip(video.clips, dsts)
+        if dst is not None and not (poster_path(dst).exists() and sheet_path(dst).exists())
+    ]
+    if not clips:
+        return
+
+    src = video.src_path(config, src_dir)
+    if not src.is_file():
+        raise Error(f"missing video file: {src}")
+    for clips_pass in plan_passes(clips):
+        ffmpeg.run(thumbnail_args(src, clips_pass))
+
+def write_thumbnails(config: Config, job: Job):
+    "Write thumbnails for every clip in the job, one decode pass per group of nearby clips."
+
+    with ThreadPoolExecutor(max_workers=config.jobs) as pool:
+        futures = [
+            pool.submit(write_video_thumbnails, config, video, job.video_dir, dsts)
+            for (video, dsts) in zip(job.videos, job.output_paths(config))
+        ]
+        for future in futures:
+            future.result()
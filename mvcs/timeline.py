@@ -0,0 +1,174 @@
+"Wall-clock recording timeline module."
+
+import datetime
+import os
+import tempfile
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Type, TypeVar
+
+from mvcs import encode, ffmpeg, names, trace
+from mvcs.config import Config
+from mvcs.error import Error
+
+# Recordings started before a range that are indexed when scanning near it.
+EARLIER_RECORDINGS = 2
+
+class Recording(NamedTuple):
+    "Source video on the timeline."
+
+    # Wall-clock start of the recording.
+    start: datetime.datetime
+    # Wall-clock end of the recording (the next start, or open, if its length is unknown).
+    end: datetime.datetime
+    # Path to the source video file.
+    path: Path
+
+class Part(NamedTuple):
+    "Piece of a recording covered by a wall-clock range."
+
+    # Recording the piece is taken from.
+    recording: Recording
+    # Offset of the start of the piece in the recording.
+    start: datetime.timedelta
+    # Offset of the end of the piece in the recording.
+    end: datetime.timedelta
+
+def recordings(config: Config, video_dir: Path) -> Dict[datetime.datetime, Path]:
+    "Find the recordings of a video directory by their start (from their file names)."
+
+    renderer = names.renderer(config)
+    sources = {}
+    try:
+        with os.scandir(video_dir) as entries:
+            for entry in entries:
+                try:
+                    sources[renderer.source_date(entry.name)] = video_dir / entry.name
+                except Error:
+                    continue
+    except OSError as ex:
+        raise Error(f"cannot read video directory: {ex}")
+    return sources
+
+def nearby(
+        sources: Dict[datetime.datetime, Path],
+        start: datetime.datetime,
+        end: datetime.datetime,
+) -> Dict[datetime.datetime, Path]:
+    """Select the recordings that can cover a wall-clock range: those started
+    in it and the last few started before it."""
+    starts = sorted(when for when in sources if when < end)
+    first = max(0, bisect_right(starts, start) - EARLIER_RECORDINGS)
+    return {when: sources[when] for when in starts[first:]}
+
+TimelineType = TypeVar("TimelineType", bound="Timeline")
+class Timeline(NamedTuple):
+    """Interval index of recordings: sorted by start, with the running maximum
+    end, so the recordings covering a range are found by bisection."""
+
+    # Recordings in order of their start.
+    recordings: List[Recording]
+    # Start of every recording.
+    starts: List[datetime.datetime]
+    # Latest end of the recordings up to each position.
+    max_ends: List[datetime.datetime]
+
+    @classmethod
+    def from_lengths(
+            cls: Type[TimelineType],
+            lengths: Dict[datetime.datetime, Tuple[Path, Optional[datetime.timedelta]]],
+    ) -> TimelineType:
+        "Build the timeline from the path and length (`None` if unknown) of each recording start."
+
+        starts = sorted(lengths)
+        indexed = []
+        for (position, start) in enumerate(starts):
+            (path, length) = lengths[start]
+            if length is not None:
+                end = start + length
+            elif position + 1 < len(starts):
+                end = starts[position + 1]
+            else:
+                # Probably still recording
+                end = datetime.datetime.max
+            indexed.append(Recording(start, end, path))
+        return cls(
+            recordings=indexed,
+            starts=starts,
+            max_ends=list(accumulate((recording.end for recording in indexed), max)),
+        )
+
+    @classmethod
+    def scan(
+            cls: Type[TimelineType],
+            config: Config,
+            video_dir: Path,
+            start: Optional[datetime.datetime] = None,
+            end: Optional[datetime.datetime] = None,
+    ) -> TimelineType:
+        """Index the recordings of a video directory, with their (cached) durations.
+
+        With `start` and `end`, only the recordings that can cover that range
+        are probed and indexed.
+        """
+
+        with trace.span("Timeline.scan", path=video_dir):
+            sources = recordings(config, video_dir)
+            if start is not None and end is not None:
+                sources = nearby(sources, start, end)
+
+            def length(path: Path) -> Optional[datetime.timedelta]:
+                try:
+                    return datetime.timedelta(seconds=ffmpeg.duration(config, path))
+                except Error:
+                    return None
+
+            with ThreadPoolExecutor(max_workers=config.jobs) as pool:
+                lengths = dict(zip(sources, pool.map(length, sources.values())))
+            return cls.from_lengths({
+                start: (path, lengths[start]) for (start, path) in sources.items()
+            })
+
+    def covering(self, start: datetime.datetime, end: datetime.datetime) -> List[Part]:
+        """Map a wall-clock range to consecutive pieces of the recordings covering it.
+
+        Gaps between recordings are skipped, and a recording overlapping the
+        next one is cut where the next one starts.
+        """
+
+        found = []
+        position = bisect_left(self.starts, end) - 1
+        while position >= 0 and self.max_ends[position] > start:
+            if self.recordings[position].end > start:
+                found.append(self.recordings[position])
+            position -= 1
+        found.reverse()
+
+        parts = []
+        for (index, recording) in enumerate(found):
+            begin = max(start, recording.start)
+            stop = min(end, recording.end)
+            if index + 1 < len(found):
+                stop = min(stop, found[index + 1].start)
+            if begin < stop:
+                parts.append(Part(recording, begin - recording.start, stop - recording.start))
+        return parts
+
+def concat_script(parts: Sequence[Part]) -> str:
+    "Get an ffconcat script joining consecutive pieces of recordings."
+    lines = ["ffconcat version 1.0"]
+    for part in parts:
+        lines.append(f"file {encode.concat_quote(str(part.recording.path.resolve()))}")
+        lines.append(f"inpoint {part.start.total_seconds()}")
+        lines.append(f"outpoint {part.end.total_seconds()}")
+    return "".join(f"{line}\n" for line in lines)
+
+def write_parts(parts: Sequence[Part], outputs: Sequence[Tuple[Path, Dict[str, str]]]):
+    "Stream copy consecutive pieces of recordings into `outputs` as one clip."
+
+    with tempfile.TemporaryDirectory(prefix="mvcs-") as tmp:
+        concat = Path(tmp) / "concat.txt"
+        concat.write_text(concat_script(parts), encoding="utf-8")
+        ffmpeg.concat(concat, outputs)
@@ -0,0 +1,83 @@
+"Pipeline tracing module."
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Recorded Chrome trace events, or `None` when tracing is disabled.
+_events: Optional[List[Dict[str, Any]]] = None
+# Profiler running while tracing, if requested.
+_profiler: Optional[cProfile.Profile] = None
+# Shared no-op context returned by `span` when tracing is disabled.
+_DISABLED = contextlib.nullcontext()
+
+def now() -> int:
+    "Get the current trace clock value in nanoseconds."
+    return time.perf_counter_ns()
+
+def enabled() -> bool:
+    "Check whether spans are being recorded."
+    return _events is not None
+
+def record(name: str, start: int, end: Optional[int] = None, **args: Any):
+    "Record a completed span between two `now()` values."
+    if _events is None:
+        return
+    end = end if end is not None else now()
+    _events.append({
+        "name": name,
+        "ph": "X",
+        "ts": start / 1000,
+        "dur": (end - start) / 1000,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "args": {key: str(value) for (key, value) in args.items()},
+    })
+
+class Span:
+    "Context manager recording a span from entry to exit."
+
+    def __init__(self, name: str, args: Dict[str, Any]):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self) -> "Span":
+        self.start = now()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, self.start, **self.args)
+
+def span(name: str, **args: Any):
+    "Get a context manager recording a span (a shared no-op when disabled)."
+    if _events is None:
+        return _DISABLED
+    return Span(name, args)
+
+def start(*, profile: bool = False):
+    "Start recording spans, and optionally profiling with cProfile."
+    global _events, _profiler # pylint: disable=global-statement
+    _events = []
+    if profile:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def stop(trace_path: Optional[Path], profile_path: Optional[Path]):
+    "Stop tracing and write the Chrome trace-event JSON and profile, if requested."
+    global _events, _profiler # pylint: disable=global-statement
+    (events, profiler) = (_events, _profiler)
+    (_events, _profiler) = (None, None)
+
+    if profiler is not None:
+        profiler.disable()
+        if profile_path is not None:
+            profiler.dump_stats(str(profile_path))
+    if events is not None and trace_path is not None:
+        with trace_path.open("w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,53 @@
+"Tests for the analyze module."
+
+import io
+
+import pytest # type: ignore
+
+from mvcs.analyze import (
+    CLIP_AFTER,
+    CLIP_BEFORE,
+    FRAME_SIZE,
+    Window,
+    detect_windows,
+    merge_windows,
+    window_entries,
+)
+
+@pytest.mark.parametrize("windows,expected", [
+    ([], []),
+    # Overlapping windows are merged and keep the highest score
+    (
+        [Window(10.0, 20.0, 0.5), Window(0.0, 15.0, 0.2), Window(30.0, 40.0, 0.3)],
+        [Window(0.0, 20.0, 0.5), Window(30.0, 40.0, 0.3)],
+    ),
+    # Touching windows are merged
+    ([Window(0.0, 10.0, 0.2), Window(10.0, 20.0, 0.1)], [Window(0.0, 20.0, 0.2)]),
+])
+def test_merge_windows(windows, expected):
+    "Candidate windows are merged as expected."
+    assert merge_windows(windows) == expected
+
+def test_window_entries():
+    "Windows are converted to job file clip entries covering the whole window."
+    entries = window_entries([Window(0.5, 30.5, 1.0), Window(3600.0, 3630.0, 1.0)], "scene")
+    assert entries == [
+        {"time": "0 - 31", "title": "scene 1"},
+        {"time": "1:00:00 - 1:00:30", "title": "scene 2"},
+    ]
+
+def test_detect_windows():
+    "Scene changes in a raw grayscale stream produce candidate windows."
+    np = pytest.importorskip("numpy")
+    (width, height) = FRAME_SIZE
+    # Three "scenes" of constant brightness, long enough to span several batches
+    frames = np.concatenate([
+        np.full((2000, height, width), 10, dtype=np.uint8),
+        np.full((2000, height, width), 200, dtype=np.uint8),
+        np.full((10, height, width), 10, dtype=np.uint8),
+    ])
+    windows = detect_windows(io.BytesIO(frames.tobytes()), rate=10)
+    assert windows == [
+        Window(200.0 - CLIP_BEFORE, 200.0 + CLIP_AFTER, pytest.approx(190 / 255)),
+        Window(400.0 - CLIP_BEFORE, 400.0 + CLIP_AFTER, pytest.approx(190 / 255)),
+    ]
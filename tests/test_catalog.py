@@ -0,0 +1,97 @@
+"Tests for the catalog module."
+
+import datetime
+
+import pytest # type: ignore
+
+from mvcs import catalog
+from mvcs.config import Config
+
+def make_entry(tmp_path, title, start, video=datetime.datetime(2020, 1, 1), job="a.yaml"):
+    "Get the entry of an existing clip `start` seconds into a recording."
+    output = tmp_path / f"{title}.mkv"
+    output.write_text(title)
+    return catalog.Entry(
+        output=output,
+        job=tmp_path / job,
+        source=tmp_path / "src.mkv",
+        video=video,
+        video_title="Stream",
+        title=title,
+        start=video + datetime.timedelta(seconds=start),
+        end=video + datetime.timedelta(seconds=start + 30),
+        size=len(title),
+    )
+
+@pytest.fixture
+def config(tmp_path):
+    "Get a config with its catalog in a temporary directory."
+    return Config.default()._replace(cache_dir=tmp_path / "cache")
+
+@pytest.mark.parametrize("text,expected", [
+    ("boss", '"boss"*'),
+    ("Big  boss", '"Big"* "boss"*'),
+    ('say "hi"', '"say"* """hi"""*'),
+])
+def test_text_query(text, expected):
+    "Search words are quoted and match word prefixes."
+    assert catalog.text_query(text) == expected
+
+def test_entry_row(tmp_path):
+    "Entries survive a round trip through a database row."
+    entry = make_entry(tmp_path, "clip", 12.5)
+    assert catalog.Entry.from_row(entry.to_row()) == entry
+    assert entry.duration == datetime.timedelta(seconds=30)
+
+def test_search(tmp_path, config):
+    "Clips are found by title words, time range and recording, in wall-clock order."
+    later = datetime.datetime(2020, 1, 2)
+    entries = [
+        make_entry(tmp_path, "Boss fight", 600),
+        make_entry(tmp_path, "Bossa nova", 0),
+        make_entry(tmp_path, "Speedrun", 60, video=later),
+    ]
+    catalog.record(config, tmp_path / "a.yaml", entries)
+
+    def titles(*args, **kwargs):
+        "Get the titles of the clips found by a search."
+        return [entry.title for entry in catalog.search(config, *args, **kwargs)]
+
+    assert titles() == ["Bossa nova", "Boss fight", "Speedrun"]
+    assert catalog.search(config, "boss FIGHT") == [entries[0]]
+    assert titles("boss") == ["Bossa nova", "Boss fight"]
+    assert titles("stream") == ["Bossa nova", "Boss fight", "Speedrun"]
+    middle = datetime.datetime(2020, 1, 1, 0, 5)
+    assert catalog.search(config, since=middle) == [entries[0], entries[2]]
+    assert catalog.search(config, until=middle) == [entries[1]]
+    assert catalog.search(config, video=later) == [entries[2]]
+    assert catalog.search(config, "nothing") == []
+
+def test_record_updates(tmp_path, config):
+    "Recording a job again updates retitled clips and drops deleted ones."
+    (first, second) = (make_entry(tmp_path, "one", 0), make_entry(tmp_path, "two", 60))
+    catalog.record(config, tmp_path / "a.yaml", [first, second])
+
+    retitled = first._replace(title="renamed")
+    second.output.unlink()
+    catalog.record(config, tmp_path / "a.yaml", [retitled])
+    assert catalog.search(config) == [retitled]
+    assert catalog.search(config, "one") == []
+    assert catalog.search(config, "renamed") == [retitled]
+
+def test_rebuild(tmp_path, config):
+    "Rebuilding replaces the entries of the jobs and drops clips that are gone."
+    (kept, gone, old) = (
+        make_entry(tmp_path, "kept", 0, job="b.yaml"),
+        make_entry(tmp_path, "gone", 60, job="b.yaml"),
+        make_entry(tmp_path, "old", 120),
+    )
+    catalog.record(config, tmp_path / "b.yaml", [kept, gone])
+    catalog.record(config, tmp_path / "a.yaml", [old])
+    gone.output.unlink()
+
+    new = make_entry(tmp_path, "new", 180)
+    assert catalog.rebuild(config, [tmp_path / "a.yaml"], [new]) == 2
+    assert catalog.search(config) == [kept, new]
+    assert catalog.search(config, "old") == []
+    assert catalog.catalog_path(config) == tmp_path / "cache" / "catalog.sqlite"
@@ -0,0 +1,98 @@
+"Tests for the check module."
+
+from pathlib import Path
+
+from mvcs import check as check_module
+from mvcs.check import Problem, check_job, check_overlaps
+from mvcs.config import Config, NameCollision
+from mvcs.job import Job, Video
+
+def make_job(tmp_path: Path) -> Job:
+    "Get a job with one of each kind of problem."
+    (tmp_path / "videos").mkdir()
+    (tmp_path / "clips").mkdir()
+    (tmp_path / "videos" / "1970-01-01 00-00-00.mkv").touch()
+    return Job.from_dict(Config.default(), {
+        "video-dir": str(tmp_path / "videos"),
+        "output-dir": str(tmp_path / "clips"),
+        "videos": [
+            {
+                "date": "1970-01-01T00:00:00",
+                "title": "present",
+                "clips": [
+                    {"time": "0 - 10", "title": "ok"},
+                    {"time": "0:00 - 0:10", "title": "ok"},
+                    {"time": "5 - 15", "title": "overlap"},
+                    {"time": "5 - 15", "title": "overlap"},
+                    {"time": "50 - 70", "title": "tail"},
+                    {"time": "2:00 - 2:10", "title": "late"},
+                    {"time": "2:00 - 2:20", "title": "late"},
+                ],
+            },
+            {
+                "date": "1970-01-02T00:00:00",
+                "title": "missing",
+                "clips": [{"time": "0 - 10", "title": "ok"}],
+            },
+            # Videos without clips don't need a source file
+            {"date": "1970-01-03T00:00:00", "title": "unused"},
+        ],
+    })
+
+def test_check_job(tmp_path, monkeypatch):
+    "Every problem is reported in one pass."
+    monkeypatch.setattr(check_module.ffmpeg, "duration", lambda config, src: 60.0)
+    job = make_job(tmp_path)
+    problems = check_job(Config.default(), job)
+
+    summary = [(problem.fatal, problem.message.split(":")[0]) for problem in problems]
+    assert summary == [
+        (True, "missing video file"),
+        (False, "clip ends after the end of the video (0"),
+        (True, "clip starts after the end of the video (0"),
+        (True, "clip starts after the end of the video (0"),
+        (False, "duplicate clip time"),
+        (False, "overlapping clips"),
+        (False, "duplicate clip time"),
+        (False, "overlapping clips"),
+        (False, "clips share an output name (number)"),
+    ]
+    assert problems[0].message.endswith("1970-01-02 00-00-00.mkv")
+    assert problems[-1].message.endswith("late.mkv")
+
+def test_check_overlaps_long_clip():
+    "A long clip is reported against every later clip it covers."
+    video = Video.from_dict({
+        "date": "1970-01-01T00:00:00",
+        "title": "v",
+        "clips": [
+            {"time": "0 - 100", "title": "A"},
+            {"time": "10 - 20", "title": "B"},
+            {"time": "30 - 40", "title": "C"},
+        ],
+    })
+    assert [problem.message for problem in check_overlaps(video)] == [
+        "overlapping clips: v (1970-01-01 00:00:00): A / B",
+        "overlapping clips: v (1970-01-01 00:00:00): A / C",
+    ]
+
+def test_check_job_collision_policy(tmp_path, monkeypatch):
+    "Name collisions are fatal when the policy is to fail."
+    monkeypatch.setattr(check_module.ffmpeg, "duration", lambda config, src: 600.0)
+    job = make_job(tmp_path)
+    config = Config.default()._replace(name_collision=NameCollision.ERROR)
+    assert check_job(config, job)[-1].fatal
+
+def test_check_job_missing_dirs(tmp_path):
+    "Missing directories are reported once instead of once per video."
+    job = Job.from_dict(Config.default(), {
+        "video-dir": str(tmp_path / "nope"),
+        "output-dir": str(tmp_path / "nope"),
+        "videos": [
+            {"date": "1970-01-01T00:00:00", "title": "a", "clips": [{"time": "0-1", "title": "a"}]},
+            {"date": "1970-01-02T00:00:00", "title": "b", "clips": [{"time": "0-1", "title": "b"}]},
+        ],
+    })
+    problems = check_job(Config.default(), job)
+    assert [problem.fatal for problem in problems] == [True, True]
+    assert isinstance(problems[0], Problem)
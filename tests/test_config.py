@@ -1,10 +1,11 @@
 "Tests for the config module."
 
+import datetime
 from pathlib import Path
 
 import pytest # type: ignore
 
-from mvcs.config import Config, Prefs, Replace, Subcommand
+from mvcs.config import Config, NameCollision, Prefs, Replace, Subcommand, Target, WriteMode
 from mvcs.error import Error
 
 @pytest.mark.parametrize("prefs,expected", [
@@ -75,6 +76,81 @@ def test_config_from_argv_filename_replace(optargs, expected):
         config = Config.from_argv(argv)
         assert config.filename_replace == expected
 
+@pytest.mark.parametrize("optarg,expected", [
+    ("1", 1),
+    ("32", 32),
+])
+def test_config_from_argv_jobs(optarg, expected):
+    "The number of concurrent workers can be changed."
+    config = Config.from_argv(["", "--jobs", optarg])
+    assert config.jobs == expected
+
+@pytest.mark.parametrize("optarg", ["", "-1", "many"])
+def test_config_from_argv_jobs_invalid(optarg):
+    "Invalid worker counts are rejected."
+    with pytest.raises(Error):
+        Config.from_argv(["", "--jobs", optarg])
+
+def test_config_from_argv_highlights():
+    "Highlight selection options are parsed."
+    config = Config.from_argv(["", "--threshold", "-12.5", "--top", "3", "--spacing", "90"])
+    assert config.highlight_threshold == -12.5
+    assert config.highlight_top == 3
+    assert config.highlight_spacing == 90.0
+
+@pytest.mark.parametrize("argv", [
+    ["", "--threshold", "loud"],
+    ["", "--top", "0"],
+    ["", "--top", "1.5"],
+    ["", "--spacing", "-1"],
+])
+def test_config_from_argv_highlights_invalid(argv):
+    "Invalid highlight selection options are rejected."
+    with pytest.raises(Error):
+        Config.from_argv(argv)
+
+@pytest.mark.parametrize("optarg,expected", [
+    ("number", NameCollision.NUMBER),
+    ("skip", NameCollision.SKIP),
+    ("Error", NameCollision.ERROR),
+])
+def test_config_from_argv_name_collision(optarg, expected):
+    "The output name collision policy can be changed."
+    assert Config.from_argv(["", "--name-collision", optarg]).name_collision == expected
+
+def test_config_from_argv_keep_going():
+    "Retrying failed clips implies continuing past failures."
+    assert not Config.from_argv([""]).keep_going
+    assert Config.from_argv(["", "--keep-going"]).keep_going
+    config = Config.from_argv(["", "--retry-failed", "--retries", "5", "run"])
+    assert config.keep_going and config.retry_failed
+    assert config.retries == 5
+    with pytest.raises(Error):
+        Config.from_argv(["", "--retries", "-1"])
+
+def test_config_from_argv_background():
+    "Background mode and its thresholds can be set from the command line."
+    config = Config.from_argv([""])
+    assert not config.background
+    config = Config.from_argv([
+        "", "--background", "--max-load", "0.5", "--max-disk-queue", "2",
+        "--max-pressure", "5", "run",
+    ])
+    assert config.background
+    assert (config.max_load, config.max_disk_queue, config.max_pressure) == (0.5, 2, 5)
+    with pytest.raises(Error):
+        Config.from_argv(["", "--max-load", "-1"])
+
+def test_config_from_argv_trace():
+    "Tracing and profiling are off unless an output path is given."
+    config = Config.from_argv([""])
+    assert config.trace_path is None and config.profile_path is None
+    config = Config.from_argv(["", "--trace", "run.json", "--profile", "run.prof", "run"])
+    assert config.trace_path == Path("run.json")
+    assert config.profile_path == Path("run.prof")
+    with pytest.raises(Error):
+        Config.from_argv(["", "--trace", ""])
+
 @pytest.mark.parametrize("opt", ["-o", "--output-dir"])
 def test_config_from_argv_output_dir(opt):
     "The default path to the output clips directory can be changed."
@@ -117,19 +193,89 @@ def test_config_from_argv_filename_replace_invalid(optarg):
 @pytest.mark.parametrize("subcommand_str,expected", [
     ("clip", Subcommand.CLIP),
     ("help", Subcommand.HELP),
+    ("highlights", Subcommand.HIGHLIGHTS),
+    ("index", Subcommand.INDEX),
+    ("match", Subcommand.MATCH),
+    ("reel", Subcommand.REEL),
     ("run", Subcommand.RUN),
+    ("thumbs", Subcommand.THUMBS),
 ])
 def test_config_from_argv_subcommand(subcommand_str, expected):
     "The subcommand is set from the first non-option argument."
     config = Config.from_argv(["", subcommand_str])
     assert config.subcommand == expected
 
+def test_config_from_argv_subcommand_args():
+    "Arguments after the subcommand are kept."
+    config = Config.from_argv(["", "--jobs", "2", "match", "a.mkv", "b.mkv"])
+    assert config.subcommand == Subcommand.MATCH
+    assert config.args == ("a.mkv", "b.mkv")
+
 @pytest.mark.parametrize("subcommand_str", [""])
 def test_config_from_argv_subcommand_invalid(subcommand_str):
     "Invalid subcommands are rejected."
     with pytest.raises(Error):
         Config.from_argv(["", subcommand_str])
 
+def test_config_from_argv_at():
+    "Clips can be triggered for a past moment."
+    assert Config.from_argv([""]).at is None
+    config = Config.from_argv(["", "--at", "2020-01-01 12:34:00", "clip"])
+    assert config.at == datetime.datetime(2020, 1, 1, 12, 34)
+    with pytest.raises(Error):
+        Config.from_argv(["", "--at", "noon", "clip"])
+
+def test_config_from_argv_job_paths(tmp_path):
+    "Several job files are given by repeating -j or with a glob."
+    for name in ("b.yaml", "a.yaml"):
+        (tmp_path / name).touch()
+    config = Config.from_argv(["", "-j", "x.yaml", "-j", str(tmp_path / "*.yaml"), "run"])
+    assert config.job_path == Path("x.yaml")
+    assert config.job_paths == (Path("x.yaml"), tmp_path / "a.yaml", tmp_path / "b.yaml")
+    assert Config.from_argv([""]).job_paths == ()
+    with pytest.raises(Error):
+        Config.from_argv(["", "-j", str(tmp_path / "*.yml")])
+
+def test_config_from_argv_checksum():
+    "Clip checksums can be enabled."
+    assert not Config.from_argv([""]).checksum
+    assert Config.from_argv(["", "--checksum", "run"]).checksum
+    assert Config.from_argv(["", "verify"]).subcommand == Subcommand.VERIFY
+
+def test_config_from_argv_catalog_filters():
+    "Catalog listings can be limited to a time range and a recording."
+    config = Config.from_argv([
+        "",
+        "--since", "2020-01-01 00:00:00",
+        "--until", "2020-01-02T00:00:00",
+        "--recording", "2020-01-01 12:00:00",
+        "--rebuild",
+        "search", "boss", "fight",
+    ])
+    assert config.subcommand == Subcommand.SEARCH
+    assert config.args == ("boss", "fight")
+    assert config.since == datetime.datetime(2020, 1, 1)
+    assert config.until == datetime.datetime(2020, 1, 2)
+    assert config.recording == datetime.datetime(2020, 1, 1, 12)
+    assert config.rebuild
+    default = Config.from_argv(["", "ls"])
+    assert default.subcommand == Subcommand.LS
+    assert (default.since, default.until, default.recording, default.rebuild) == (None, None, None, False)
+    with pytest.raises(Error):
+        Config.from_argv(["", "--since", "yesterday", "ls"])
+
+def test_config_from_argv_repair():
+    "Broken sources can be repaired by scans."
+    assert not Config.from_argv(["", "scan"]).repair
+    config = Config.from_argv(["", "--repair", "scan"])
+    assert config.subcommand == Subcommand.SCAN
+    assert config.repair
+
+def test_config_from_argv_thumbnails():
+    "Thumbnail generation during runs can be enabled."
+    assert not Config.from_argv([""]).thumbnails
+    assert Config.from_argv(["", "--thumbnails", "run"]).thumbnails
+
 @pytest.mark.parametrize("opt", ["-i", "--video-dir"])
 def test_config_from_argv_video_dir(opt):
     "The default path to the input video directory can be changed."
@@ -169,6 +315,23 @@ def test_config_from_argv_video_filename_format_invalid(fmt):
     with pytest.raises(Error):
         Config.from_argv(["", "--video-filename-format", fmt])
 
+@pytest.mark.parametrize("optarg,expected", [
+    ("copy", WriteMode.COPY),
+    ("encode", WriteMode.ENCODE),
+    ("ENCODE", WriteMode.ENCODE),
+    ("smart", WriteMode.SMART),
+])
+def test_config_from_argv_write_mode(optarg, expected):
+    "The clip write mode can be changed."
+    config = Config.from_argv(["", "--write-mode", optarg])
+    assert config.write_mode == expected
+
+@pytest.mark.parametrize("optarg", ["", "transcode"])
+def test_config_from_argv_write_mode_invalid(optarg):
+    "Invalid write modes are rejected."
+    with pytest.raises(Error):
+        Config.from_argv(["", "--write-mode", optarg])
+
 @pytest.mark.parametrize("data,expected", [
     # Default preferences from an empty dict
     ({}, Prefs()),
@@ -182,17 +345,28 @@ def test_config_from_argv_video_filename_format_invalid(fmt):
             "video-dir": "/dev/null",
             "video-ext": "rm",
             "video-filename-format": "%s",
+            "jobs": 3,
+            "outputs": [{"dir": "/srv/edit", "ext": "mp4", "options": {"movflags": "+faststart"}}],
+            "write-mode": "encode",
         },
         Prefs(
             job_path=Path("/dev/null"),
+            jobs=3,
+            write_mode=WriteMode.ENCODE,
             filename_replace=Replace.from_dict({" ": "_"}),
             output_dir=Path("/dev/null"),
             output_ext="rm",
             video_dir=Path("/dev/null"),
             video_ext="rm",
             video_filename_format="%s",
+            targets=(Target(Path("/srv/edit"), "mp4", {"movflags": "+faststart"}),),
         ),
     ),
+    # Boolean preferences accept YAML booleans and their spellings as strings
+    ({"thumbnails": True}, Prefs(thumbnails=True)),
+    ({"thumbnails": "false"}, Prefs(thumbnails=False)),
+    ({"thumbnails": "Yes"}, Prefs(thumbnails=True)),
+    ({"checksum": "off"}, Prefs(checksum=False)),
 ])
 def test_prefs_from_dict(data, expected):
     "User preferences are deserialized from dicts correctly."
@@ -202,8 +376,22 @@ def test_prefs_from_dict(data, expected):
 @pytest.mark.parametrize("data", [
     # Unknown preferences are invalid
     {"not-a-real-pref": "test"},
+    # Output destinations need a directory and an extension
+    {"outputs": {"dir": "/srv/edit", "ext": "mp4"}},
+    {"outputs": [{"dir": "/srv/edit"}]},
+    {"outputs": [{"dir": "/srv/edit", "ext": "mp4", "format": "mp4"}]},
+    {"outputs": [{"dir": "/srv/edit", "ext": "mp4", "options": "+faststart"}]},
+    # Boolean preferences must be booleans
+    {"thumbnails": "sometimes"},
+    {"thumbnails": 2},
+    {"checksum": "false-ish"},
 ])
 def test_prefs_from_dict_invalid(data):
     "Invalid user preferences are rejected."
     with pytest.raises(Error):
         Prefs.from_dict(data)
+
+def test_target_path():
+    "Destinations keep the clip name and change the directory and extension."
+    target = Target(Path("/srv/edit"), "mp4")
+    assert target.path(Path("clips/2020-01-01 game.x.mkv")) == Path("/srv/edit/2020-01-01 game.x.mp4")
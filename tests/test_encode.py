@@ -0,0 +1,114 @@
+"Tests for the encode module."
+
+from pathlib import Path
+
+import pytest # type: ignore
+
+from mvcs.encode import (
+    MIN_CHUNK_SECONDS,
+    Segment,
+    plan_chunks,
+    plan_smart_cut,
+    smart_cut_encoder,
+    write_concat_list,
+)
+
+@pytest.mark.parametrize("keyframes,start,end,jobs,expected", [
+    # Short clips are encoded in a single chunk
+    ([0.0, 2.0, 4.0], 1.0, 5.0, 8, [(1.0, 5.0)]),
+    # No keyframes means a single chunk
+    ([], 0.0, 600.0, 8, [(0.0, 600.0)]),
+    # Chunks start on keyframes and the first chunk starts at the clip start
+    (
+        [float(t) for t in range(0, 200, 10)],
+        5.0,
+        95.0,
+        4,
+        [(5.0, 20.0), (20.0, 30.0), (30.0, 40.0), (40.0, 50.0), (50.0, 60.0),
+         (60.0, 70.0), (70.0, 80.0), (80.0, 95.0)],
+    ),
+    # Chunk length grows with the clip length relative to the worker count
+    (
+        [float(t) for t in range(0, 1000, 10)],
+        0.0,
+        400.0,
+        2,
+        [(0.0, 50.0), (50.0, 100.0), (100.0, 150.0), (150.0, 200.0), (200.0, 250.0),
+         (250.0, 300.0), (300.0, 350.0), (350.0, 400.0)],
+    ),
+])
+def test_plan_chunks(keyframes, start, end, jobs, expected):
+    "Clips are split into GOP-aligned chunks as expected."
+    chunks = plan_chunks(keyframes, start, end, jobs)
+    assert chunks == expected
+
+@pytest.mark.parametrize("jobs", [1, 4, 32])
+def test_plan_chunks_coverage(jobs):
+    "Chunks cover the clip exactly, without gaps or short trailing chunks."
+    keyframes = [t * 2.5 for t in range(10000)]
+    chunks = plan_chunks(keyframes, 3.0, 2403.0, jobs)
+    assert chunks[0][0] == 3.0
+    assert chunks[-1][1] == 2403.0
+    for (prev, cur) in zip(chunks, chunks[1:]):
+        assert prev[1] == cur[0]
+        assert cur[0] in keyframes
+    assert chunks[-1][1] - chunks[-1][0] >= MIN_CHUNK_SECONDS
+
+def test_write_concat_list(tmp_path: Path):
+    "Concat lists quote file names for the concat demuxer."
+    path = tmp_path / "list.txt"
+    write_concat_list(path, ["a.mkv", "it's.mkv"])
+    assert path.read_text(encoding="utf-8") == "file 'a.mkv'\nfile 'it'\\''s.mkv'\n"
+
+@pytest.mark.parametrize("keyframes,start,end,expected", [
+    # Partial GOPs at both ends are re-encoded, the middle is copied
+    (
+        [0.0, 10.0, 20.0, 30.0, 40.0],
+        5.0,
+        35.0,
+        [Segment(5.0, 10.0, False), Segment(10.0, 30.0, True), Segment(30.0, 35.0, False)],
+    ),
+    # Boundaries on keyframes need no re-encoding
+    ([0.0, 10.0, 20.0, 30.0], 10.0, 30.0, [Segment(10.0, 30.0, True)]),
+    ([0.0, 10.0, 20.0, 30.0], 10.0, 25.0, [Segment(10.0, 20.0, True), Segment(20.0, 25.0, False)]),
+    # Clips within a single GOP are fully re-encoded
+    ([0.0, 10.0, 20.0], 11.0, 19.0, [Segment(11.0, 19.0, False)]),
+    ([0.0, 10.0, 20.0], 9.0, 19.0, [Segment(9.0, 19.0, False)]),
+    ([], 0.0, 5.0, [Segment(0.0, 5.0, False)]),
+])
+def test_plan_smart_cut(keyframes, start, end, expected):
+    "Smart cuts copy everything between the first and last keyframe in the clip."
+    assert plan_smart_cut(keyframes, start, end) == expected
+
+@pytest.mark.parametrize("info,expected", [
+    # The profile, level, pixel format and known colors of the source are kept
+    (
+        {
+            "codec_name": "h264", "profile": "High", "level": "41", "pix_fmt": "yuv420p",
+            "color_range": "tv", "color_space": "bt709", "color_transfer": "unknown",
+        },
+        ("-c:v", "libx264", "-preset", "fast", "-crf", "16", "-profile:v", "high",
+         "-pix_fmt", "yuv420p", "-level", "4.1", "-color_range", "tv", "-colorspace", "bt709",
+         "-f", "mpegts"),
+    ),
+    (
+        {"codec_name": "hevc", "profile": "Main 10", "level": "123", "pix_fmt": "yuv420p10le"},
+        ("-c:v", "libx265", "-preset", "fast", "-crf", "18", "-profile:v", "main10",
+         "-pix_fmt", "yuv420p10le", "-x265-params", "level-idc=4.1:repeat-headers=1",
+         "-f", "mpegts"),
+    ),
+    # Unknown levels are left to the encoder
+    (
+        {"codec_name": "h264", "profile": "Main", "level": "-99", "pix_fmt": "yuv420p"},
+        ("-c:v", "libx264", "-preset", "fast", "-crf", "16", "-profile:v", "main",
+         "-pix_fmt", "yuv420p", "-f", "mpegts"),
+    ),
+    # Codecs and profiles the encoders cannot match
+    ({"codec_name": "vp9", "profile": "Profile 0", "pix_fmt": "yuv420p"}, None),
+    ({"codec_name": "h264", "profile": "Extended", "pix_fmt": "yuv420p"}, None),
+    ({"codec_name": "hevc", "profile": "Rext", "pix_fmt": "yuv444p"}, None),
+    ({"codec_name": "h264", "profile": "High"}, None),
+])
+def test_smart_cut_encoder(info, expected):
+    "Boundary segments are encoded to match the source stream or not smart cut."
+    assert smart_cut_encoder(info) == expected
@@ -0,0 +1,59 @@
+"Tests for the ffmpeg module."
+
+import errno
+from pathlib import Path
+
+import pytest # type: ignore
+
+from mvcs.error import TransientError
+from mvcs.ffmpeg import os_error, output_args, parse_keyframes, process_error
+
+@pytest.mark.parametrize("output,expected", [
+    ("", []),
+    # Only keyframe packets are kept
+    ("0.000000,K__\n0.033000,___\n2.000000,K_\n", [0.0, 2.0]),
+    # Packets without timestamps are ignored and results are sorted
+    ("4.000000,K__\nN/A,K__\n2.000000,K__\n", [2.0, 4.0]),
+])
+def test_parse_keyframes(output, expected):
+    "Keyframe timestamps are parsed from ffprobe output."
+    assert parse_keyframes(output) == expected
+
+@pytest.mark.parametrize("outputs,expected", [
+    # A single plain output needs no tee muxer
+    ([(Path("a b.mkv"), {})], ("a b.mkv",)),
+    (
+        [(Path("/archive/a|b.mkv"), {}), (Path("/ssd/a.mp4"), {"movflags": "+faststart"})],
+        ("-f", "tee", "[onfail=abort]/archive/a\\|b.mkv|[onfail=abort:movflags=+faststart]/ssd/a.mp4"),
+    ),
+    # Option values are escaped for both the tee muxer and the option parser
+    (
+        [(Path("a.mkv"), {"metadata": "k=v:w"})],
+        ("-f", "tee", "[onfail=abort:metadata=k\\\\=v\\\\:w]a.mkv"),
+    ),
+])
+def test_output_args(outputs, expected):
+    "Several outputs are written in one pass with the tee muxer."
+    assert output_args(outputs) == expected
+
+@pytest.mark.parametrize("log,transient", [
+    ("", False),
+    ("src.mkv: Invalid data found when processing input\n", False),
+    ("[matroska @ 0x1] Error writing: No space left on device\n", True),
+    ("src.mkv: Input/output error\n", True),
+])
+def test_process_error(log, transient):
+    "Only failures the log blames on the system are retried, and the error quotes the log."
+    ex = process_error(1, ("ffmpeg", "-i", "src.mkv"), log)
+    assert isinstance(ex, TransientError) == transient
+    assert str(ex).endswith(log.strip())
+
+@pytest.mark.parametrize("code,transient", [
+    (errno.ENOSPC, True),
+    (errno.EIO, True),
+    (errno.ENOENT, False),
+    (errno.EACCES, False),
+])
+def test_os_error(code, transient):
+    "OS errors are transient only when they may not happen again."
+    assert isinstance(os_error(OSError(code, "error")), TransientError) == transient
@@ -0,0 +1,79 @@
+"Tests for the fingerprint module."
+
+import pytest # type: ignore
+
+from mvcs.fingerprint import (
+    MATCH_DISTANCE,
+    FingerprintIndex,
+    neighbours,
+    parse_showinfo_times,
+    phash,
+    popcount,
+)
+
+np = pytest.importorskip("numpy")
+
+def test_parse_showinfo_times():
+    "Frame times come from the showinfo log lines, skipping everything else."
+    output = (
+        "Input #0, matroska,webm, from 'a.mkv':\n"
+        "[Parsed_showinfo_2 @ 0x5581] config in time_base: 1/1000, frame_rate: 30/1\n"
+        "[Parsed_showinfo_2 @ 0x5581] n:   0 pts:     33 pts_time:0.033   duration:33 "
+        "pos: 4321 fmt:gray sar:1/1 s:32x32 i:P iskey:1 type:I\n"
+        "[Parsed_showinfo_2 @ 0x5581] n:   1 pts:   2033 pts_time:2.033   duration:33 "
+        "pos: 98765 fmt:gray sar:1/1 s:32x32 i:P iskey:1 type:I\n"
+        "[Parsed_showinfo_2 @ 0x5581]   color_range:tv color_space:unknown\n"
+    )
+    assert parse_showinfo_times(output) == [0.033, 2.033]
+
+@pytest.mark.parametrize("value,radius,expected", [
+    (0, 0, 1),
+    (0, 1, 17),
+    (0xFFFF, 2, 137),
+])
+def test_neighbours(value, radius, expected):
+    "All values within the radius are enumerated exactly once."
+    values = neighbours(value, radius)
+    assert len(values) == len(set(values)) == expected
+    assert all(bin(v ^ value).count("1") <= radius for v in values)
+
+def test_phash_is_perceptual():
+    "Similar frames hash alike and different frames do not."
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (32, 32)).astype(np.uint8)
+    brighter = np.clip(frame.astype(np.int16) + 20, 0, 255).astype(np.uint8)
+    other = rng.integers(0, 256, (32, 32)).astype(np.uint8)
+    (a, b, c) = phash(np.stack([frame, brighter, other])).tolist()
+    assert bin(a ^ b).count("1") <= MATCH_DISTANCE
+    assert bin(a ^ c).count("1") > MATCH_DISTANCE
+
+def test_index_search_matches_brute_force(tmp_path):
+    "Multi-index search finds exactly the hashes a linear scan finds."
+    rng = np.random.default_rng(1)
+    hashes = rng.integers(0, 2 ** 63, 5000, dtype=np.uint64)
+    # Plant near-duplicates of the first hash
+    for (i, bits) in enumerate((1, 3, MATCH_DISTANCE, MATCH_DISTANCE + 1), start=1):
+        flipped = int(hashes[0])
+        for bit in range(bits):
+            flipped ^= 1 << (bit * 9)
+        hashes[i] = flipped
+    index = FingerprintIndex.build([("a", np.arange(5000, dtype=np.float64), hashes)])
+    index.save(tmp_path / "index")
+    loaded = FingerprintIndex.load(tmp_path / "index")
+
+    for value in hashes[:20].tolist():
+        expected = np.flatnonzero(popcount(hashes ^ np.uint64(value)) <= MATCH_DISTANCE)
+        assert sorted(loaded.search(value).tolist()) == expected.tolist()
+    assert sorted(loaded.search(int(hashes[0])).tolist())[:4] == [0, 1, 2, 3]
+
+def test_index_matches_vote_on_offset():
+    "Matches are grouped by file and offset and ranked by matching frames."
+    rng = np.random.default_rng(2)
+    hashes = rng.integers(0, 2 ** 63, 100, dtype=np.uint64)
+    times = np.arange(100, dtype=np.float64) * 2
+    index = FingerprintIndex.build([
+        ("long.mkv", times, hashes),
+        ("clip.mkv", times[10:20] - 20, hashes[10:20]),
+    ])
+    matches = index.matches(times[12:18] - 24, hashes[12:18])
+    assert matches == [("long.mkv", 24.0, 6), ("clip.mkv", 4.0, 6)]
@@ -0,0 +1,147 @@
+"Tests for the gen module."
+
+import datetime
+
+import pytest # type: ignore
+import yaml
+
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.gen import clips_document, coalesce_clip, merge_clips, shard_path, timeline_clip
+from mvcs.timeline import Timeline
+
+def test_merge_clips(tmp_path):
+    "Clips are merged into the job file in one pass, skipping known times."
+    document = tmp_path / "clip.yaml"
+    document.write_text(
+        "videos:\n"
+        "  - date: 2020-01-01T00:00:00\n"
+        "    title: first\n"
+        "    clips:\n"
+        "      - time: 0 - 10\n"
+        "        title: existing\n",
+        encoding="utf-8",
+    )
+    added = merge_clips(document, {
+        datetime.datetime(2020, 1, 1): [
+            {"time": "0 - 10", "title": "duplicate"},
+            {"time": "20 - 30", "title": "new"},
+        ],
+        datetime.datetime(2020, 1, 2): [{"time": "1 - 2", "title": "other"}],
+    })
+
+    assert added == 2
+    videos = yaml.safe_load(document.read_text(encoding="utf-8"))["videos"]
+    assert [clip["title"] for clip in videos[0]["clips"]] == ["existing", "new"]
+    assert videos[1]["date"] == "2020-01-02T00:00:00"
+    assert videos[1]["clips"] == [{"time": "1 - 2", "title": "other"}]
+
+def test_clips_document():
+    "Clip entries are grouped by video in date order."
+    entry = {"time": "0 - 1", "title": "a"}
+    document = clips_document({
+        datetime.datetime(2020, 1, 2): [entry],
+        datetime.datetime(2020, 1, 1): [entry],
+        datetime.datetime(2020, 1, 3): [],
+    })
+    assert document == {"videos": [
+        {"date": "2020-01-01T00:00:00", "clips": [entry]},
+        {"date": "2020-01-02T00:00:00", "clips": [entry]},
+    ]}
+
+def test_merge_clips_shard_format(tmp_path):
+    "Clips are written to the shard named by their video's date."
+    document = tmp_path / "clip.yaml"
+    document.write_text('shard-format: "days/%Y-%m-%d.yaml"\n', encoding="utf-8")
+    added = merge_clips(document, {
+        datetime.datetime(2020, 1, 1, 12): [{"time": "0 - 10", "title": "a"}],
+        datetime.datetime(2020, 1, 2, 12): [{"time": "0 - 10", "title": "b"}],
+    })
+
+    assert added == 2
+    contents = yaml.safe_load(document.read_text(encoding="utf-8"))
+    assert contents["include"] == ["days/2020-01-01.yaml", "days/2020-01-02.yaml"]
+    shard = yaml.safe_load((tmp_path / "days" / "2020-01-02.yaml").read_text(encoding="utf-8"))
+    assert shard["videos"][0]["clips"] == [{"time": "0 - 10", "title": "b"}]
+
+def test_merge_clips_shard_format_glob(tmp_path):
+    "New shards already covered by an include pattern are not listed again."
+    document = tmp_path / "clip.yaml"
+    document.write_text(
+        'shard-format: "days/%Y-%m-%d.yaml"\ninclude: ["days/*.yaml"]\n',
+        encoding="utf-8",
+    )
+    merge_clips(document, {datetime.datetime(2020, 1, 1, 12): [{"time": "0 - 10", "title": "a"}]})
+
+    contents = yaml.safe_load(document.read_text(encoding="utf-8"))
+    assert contents["include"] == ["days/*.yaml"]
+    assert (tmp_path / "days" / "2020-01-01.yaml").is_file()
+
+def test_shard_path_existing_video(tmp_path):
+    "Without a shard format, the shard that lists the video is used."
+    document = tmp_path / "clip.yaml"
+    document.write_text("include: [other.yaml]\nvideos: []\n", encoding="utf-8")
+    (tmp_path / "other.yaml").write_text(
+        "videos:\n  - date: 2020-01-01T00:00:00\n    title: x\n",
+        encoding="utf-8",
+    )
+    assert shard_path(document, datetime.datetime(2020, 1, 1)) == tmp_path / "other.yaml"
+    assert shard_path(document, datetime.datetime(2020, 1, 2)) == document
+
+@pytest.mark.parametrize("window,expected", [
+    # Far from every clip: added
+    ("20:00 - 25:30", ["0 - 5:30", "10:00 - 15:30", "20:00 - 25:30"]),
+    # Overlapping a trigger clip: extended
+    ("1:00 - 6:30", ["0 - 6:30", "10:00 - 15:30"]),
+    # Within the gap of a trigger clip: extended
+    ("15:50 - 21:20", ["0 - 5:30", "10:00 - 21:20"]),
+    # Bridging two trigger clips: merged into one
+    ("5:00 - 10:30", ["0 - 15:30"]),
+])
+def test_coalesce_clip(window, expected):
+    "Triggered clips near clips with the same title are merged."
+    clips = [
+        {"time": "0 - 5:30", "title": "CLIP IT!"},
+        {"time": "3:00 - 4:00", "title": "manual"},
+        {"time": "10:00 - 15:30", "title": "CLIP IT!"},
+    ]
+    coalesce_clip(clips, window, "CLIP IT!", 30)
+    assert [clip["time"] for clip in clips if clip["title"] == "CLIP IT!"] == expected
+    # Clips with other titles are left alone
+    assert {"time": "3:00 - 4:00", "title": "manual"} in clips
+
+def test_coalesce_clip_burst():
+    "A burst of triggers leaves a single clip covering all of them."
+    clips = []
+    for second in range(300, 400, 7):
+        coalesce_clip(clips, f"{second - 300} - {second + 30}", "CLIP IT!", 30)
+    assert clips == [{"time": "0 - 7:08", "title": "CLIP IT!"}]
+
+def test_coalesce_clip_chain():
+    "Clips brought into reach by an earlier merge are merged too."
+    clips = [
+        {"time": "12:20 - 13:00", "title": "CLIP IT!"},
+        {"time": "0:30 - 12:00", "title": "CLIP IT!"},
+    ]
+    coalesce_clip(clips, "0 - 1:00", "CLIP IT!", 30)
+    assert clips == [{"time": "0 - 13:00", "title": "CLIP IT!"}]
+
+def test_timeline_clip(tmp_path):
+    "Clips are added to the recording their window starts in, even across a split."
+    document = tmp_path / "clip.yaml"
+    document.write_text("videos: []\n", encoding="utf-8")
+    start = datetime.datetime(2020, 1, 1, 12)
+    index = Timeline.from_lengths({
+        start: (tmp_path / "a.mkv", datetime.timedelta(seconds=600)),
+        start + datetime.timedelta(seconds=600): (tmp_path / "b.mkv", None),
+    })
+    config = Config.default()._replace(coalesce=0)
+    when = start + datetime.timedelta(seconds=700)
+    assert timeline_clip(config, index, when, 300, 30, document, "clip") == "6:40 - 12:10"
+
+    videos = yaml.safe_load(document.read_text(encoding="utf-8"))["videos"]
+    assert [video["date"] for video in videos] == ["2020-01-01T12:00:00"]
+    assert videos[0]["clips"] == [{"time": "6:40 - 12:10", "title": "clip"}]
+
+    with pytest.raises(Error):
+        timeline_clip(config, index, start - datetime.timedelta(hours=1), 300, 30, document, "clip")
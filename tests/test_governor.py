@@ -0,0 +1,119 @@
+"Tests for the governor module."
+
+import os
+import threading
+import time
+
+import pytest # type: ignore
+
+from mvcs import governor
+from mvcs.config import Config
+from mvcs.governor import Governor, Load
+
+DISKSTATS = """\
+   8       0 sda 100 0 800 50 200 0 1600 70 3 120 120 0 0 0 0
+   8       1 sda1 90 0 700 40 180 0 1500 60 2 100 100 0 0 0 0
+ 259       0 nvme0n1 10 0 80 5 20 0 160 7 12 12 12 0 0 0 0
+"""
+
+PRESSURE = """\
+some avg10=12.50 avg60=3.00 avg300=1.00 total=12345
+full avg10=4.00 avg60=1.00 avg300=0.50 total=2345
+"""
+
+def test_parse_loadavg():
+    "The 1-minute load average is parsed."
+    assert governor.parse_loadavg("1.50 0.75 0.25 2/300 1234\n") == 1.5
+    assert governor.parse_loadavg("") == 0.0
+
+@pytest.mark.parametrize("devices,expected", [
+    (set(), 0),
+    ({(8, 1)}, 2),
+    ({(8, 0), (259, 0)}, 12),
+])
+def test_parse_disk_queue(devices, expected):
+    "In-flight requests are taken from the busiest watched device."
+    assert governor.parse_disk_queue(DISKSTATS, devices) == expected
+
+def test_parse_pressure():
+    "The 10 second `some` stall percentage is parsed."
+    assert governor.parse_pressure(PRESSURE) == 12.5
+    assert governor.parse_pressure("") == 0.0
+
+@pytest.mark.parametrize("load,limit,expected", [
+    (Load(cpu=0.1, disk_queue=0, pressure=0.0), 1, [2, 3, 4, 4]),
+    (Load(cpu=0.9, disk_queue=0, pressure=0.0), 4, [2, 1, 1]),
+    (Load(cpu=0.1, disk_queue=9, pressure=0.0), 3, [1, 1]),
+    (Load(cpu=0.1, disk_queue=0, pressure=50.0), 4, [2, 1]),
+])
+def test_governor_adjust(load, limit, expected):
+    "The worker limit grows by one when idle and halves when overloaded."
+    gov = Governor(Config.default()._replace(jobs=4))
+    gov.limit = limit
+    limits = []
+    for _ in expected:
+        gov.adjust(load)
+        limits.append(gov.limit)
+    assert limits == expected
+
+def test_growing_recording(tmp_path):
+    "Only a recently modified newest recording counts as growing."
+    config = Config.default()._replace(video_dir=tmp_path, video_ext="mkv")
+    now = time.time()
+    old = tmp_path / "old.mkv"
+    new = tmp_path / "new.mkv"
+    other = tmp_path / "notes.txt"
+    for path in (old, new, other):
+        path.touch()
+    os.utime(old, (now - 3600, now - 3600))
+    os.utime(new, (now - 1, now - 1))
+    os.utime(other, (now, now))
+    assert governor.growing_recording(config, now) == new
+    assert governor.growing_recording(config, now + 60) is None
+    assert governor.growing_recording(config._replace(video_dir=tmp_path / "none"), now) is None
+
+def test_governor_slots(tmp_path, monkeypatch):
+    "No more workers than the current limit run at once."
+    monkeypatch.setattr(governor, "sample", lambda devices: Load(0.0, 0, 0.0))
+    config = Config.default()._replace(jobs=2, video_dir=tmp_path, output_dir=tmp_path)
+    gov = Governor(config)
+    gov.limit = 2
+    gov.sampled = float("inf")
+
+    (lock, running, peak) = (threading.Lock(), [0], [0])
+    def work():
+        with gov.slot():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+    assert gov.active == 0
+
+def test_slot_disabled():
+    "Slots are shared no-ops when background mode is disabled."
+    assert governor.slot() is governor.slot()
+    with governor.slot():
+        pass
+
+def test_governor_watch(tmp_path, monkeypatch):
+    "Jobs loaded after the governor starts point it at their recordings and disks."
+    monkeypatch.setattr(governor, "sample", lambda devices: Load(0.0, 0, 0.0))
+    config = Config.default()._replace(video_dir=tmp_path / "none", video_ext="mkv")
+    gov = Governor(config)
+    recording = tmp_path / "live.mkv"
+    recording.touch()
+    gov.update()
+    assert gov.paused is None
+
+    gov.watch([config._replace(video_dir=tmp_path, output_dir=tmp_path)])
+    assert gov.devices == governor.disk_devices(tmp_path)
+    gov.update()
+    assert gov.paused == recording
@@ -0,0 +1,85 @@
+"Tests for the ingest module."
+
+import datetime
+import json
+
+import pytest # type: ignore
+
+from mvcs import ingest, timeline
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.timeline import Timeline
+
+def make_config(tmp_path, monkeypatch) -> Config:
+    "Get a config for a video directory with two one-hour recordings."
+    for name in ("2020-01-01 10-00-00.mkv", "2020-01-01 14-00-00.mkv", "notes.txt"):
+        (tmp_path / name).touch()
+    monkeypatch.setattr(timeline.ffmpeg, "duration", lambda config, path: 3600.0)
+    return Config.default()._replace(video_dir=tmp_path, coalesce=30)
+
+def test_locate(tmp_path):
+    "Wall-clock times map to the recording running at that moment."
+    start = datetime.datetime(2020, 1, 1, 10)
+    index = Timeline.from_lengths({
+        start: (tmp_path / "a.mkv", datetime.timedelta(hours=1)),
+        start + datetime.timedelta(minutes=30): (tmp_path / "b.mkv", datetime.timedelta(hours=1)),
+        start + datetime.timedelta(hours=4): (tmp_path / "c.mkv", datetime.timedelta(hours=1)),
+    })
+    assert ingest.locate(index, datetime.datetime(2020, 1, 1, 9)) is None
+    assert ingest.locate(index, datetime.datetime(2020, 1, 1, 10)) == start
+    # Overlapping recordings: the later one
+    assert ingest.locate(index, datetime.datetime(2020, 1, 1, 10, 40)) == start + datetime.timedelta(minutes=30)
+    # Between and after the recordings
+    assert ingest.locate(index, datetime.datetime(2020, 1, 1, 12)) is None
+    assert ingest.locate(index, datetime.datetime(2020, 1, 1, 14, 30)) == start + datetime.timedelta(hours=4)
+    assert ingest.locate(index, datetime.datetime(2020, 1, 1, 15)) is None
+
+def test_ingest(tmp_path, monkeypatch, capsys):
+    "Markers become deduplicated clip windows keyed by recording."
+    lines = [json.dumps(record) for record in (
+        {"time": "2020-01-01T10:10:00"},
+        # Duplicate and clustered markers are merged
+        {"time": "2020-01-01T10:10:00"},
+        {"time": "2020-01-01T10:10:20"},
+        # Relative markers and custom windows
+        {"video": "2020-01-01T14:00:00", "offset": "1:00", "before": 10, "after": 5, "title": "ban"},
+        {"video": "2020-01-01T14:00:00", "offset": 70, "title": "ban", "before": 0},
+        # Before, between and after the recordings
+        {"time": "2019-12-31T23:00:00"},
+        {"time": "2020-01-01T12:00:00"},
+        {"time": "2020-01-01T16:00:00"},
+    )] + [""]
+    (clips, count, skipped) = ingest.ingest(make_config(tmp_path, monkeypatch), lines, "markers")
+    assert (count, skipped) == (8, 3)
+    assert capsys.readouterr().err.splitlines() == [
+        "markers:6: no recording at 2019-12-31T23:00:00",
+        "markers:7: no recording at 2020-01-01T12:00:00",
+        "markers:8: no recording at 2020-01-01T16:00:00",
+    ]
+    assert clips == {
+        datetime.datetime(2020, 1, 1, 10): [{"time": "5:00 - 10:50", "title": "marker"}],
+        datetime.datetime(2020, 1, 1, 14): [{"time": "50 - 1:40", "title": "ban"}],
+    }
+
+@pytest.mark.parametrize("line", [
+    "not json",
+    "[1, 2]",
+    '{"title": "no time"}',
+    '{"offset": 10}',
+    '{"time": "yesterday"}',
+])
+def test_ingest_invalid(tmp_path, monkeypatch, line):
+    "Invalid records are reported with their line number."
+    with pytest.raises(Error, match="markers:2"):
+        ingest.ingest(make_config(tmp_path, monkeypatch), ['{"time": "2020-01-01T10:10:00"}', line], "markers")
+
+def test_ingest_many(tmp_path, monkeypatch):
+    "Large marker streams are handled in one pass."
+    start = datetime.datetime(2020, 1, 1, 10)
+    lines = (
+        json.dumps({"time": (start + datetime.timedelta(seconds=i)).isoformat(), "before": 1, "after": 1})
+        for i in range(0, 100000, 10)
+    )
+    (clips, count, _) = ingest.ingest(make_config(tmp_path, monkeypatch), lines, "markers")
+    assert count == 10000
+    assert sum(len(entries) for entries in clips.values()) == 2
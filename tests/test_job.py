@@ -1,13 +1,17 @@
 "Tests for the job module."
 
+import contextlib
 from pathlib import Path
 import datetime
+import json
+import threading
 
 import pytest # type: ignore
 
-from mvcs.config import Config, Replace
-from mvcs.error import Error
-from mvcs.job import Clip, Job, Video
+from mvcs.config import Config, Replace, Target, WriteMode
+from mvcs.error import Error, TransientError
+from mvcs import job as job_module
+from mvcs.job import Clip, Job, Video, run_parallel
 
 @pytest.mark.parametrize("data,expected", [
     # Times can be specified in any parsable format
@@ -312,3 +316,341 @@ def test_job_from_dict_invalid(data):
     "Deserializing an invalid job dict results in an error."
     with pytest.raises(Error):
         Job.from_dict(Config.default(), data)
+
+def test_job_output_paths():
+    "Output paths are rendered for the whole job and collisions are resolved."
+    job = Job.from_dict(Config.default(), {
+        "output-dir": "out",
+        "videos": [
+            {
+                "date": "1970-01-01T00:00:00",
+                "title": "test",
+                "clips": [
+                    {"time": "0 - 10", "title": "same"},
+                    {"time": "0 - 20", "title": "same"},
+                    {"time": "0 - 10", "title": "same"},
+                ],
+            },
+            {"date": "1970-01-02T00:00:00", "title": "test"},
+        ],
+    })
+    name = "1970-01-01 00-00-00 - t+0h00m00s - test - same"
+    assert job.output_paths(Config.default()) == [
+        [Path(f"out/{name}.mkv"), Path(f"out/{name} (2).mkv"), Path(f"out/{name}.mkv")],
+        [],
+    ]
+
+def write_shard(path: Path, date: str, title: str):
+    "Write a job shard with a single video."
+    path.write_text(f'videos:\n  - date: "{date}"\n    title: "{title}"\n', encoding="utf-8")
+
+def test_job_from_yaml_file_includes(tmp_path, monkeypatch):
+    "Included shards are loaded in order and only changed shards are parsed again."
+    (tmp_path / "shards").mkdir()
+    write_shard(tmp_path / "shards" / "b.yaml", "1970-01-02T00:00:00", "b")
+    write_shard(tmp_path / "shards" / "a.yaml", "1970-01-01T00:00:00", "a")
+    write_shard(tmp_path / "extra.yaml", "1970-01-03T00:00:00", "extra")
+    job_path = tmp_path / "clip.yaml"
+    job_path.write_text(
+        'include: ["shards/*.yaml", "extra.yaml", "shards/a.yaml"]\n'
+        'videos:\n  - date: "1970-01-04T00:00:00"\n    title: "root"\n',
+        encoding="utf-8",
+    )
+    config = Config.default()._replace(job_path=job_path, cache_dir=tmp_path / "cache", jobs=1)
+
+    parsed = []
+    parse_shard = job_module.parse_shard
+    monkeypatch.setattr(job_module, "parse_shard", lambda *args: parsed.append(args[0]) \
+            or parse_shard(*args))
+
+    job = Job.from_yaml_file(config)
+    assert [video.title for video in job.videos] == ["root", "a", "b", "extra"]
+    assert len(parsed) == 3
+
+    parsed.clear()
+    write_shard(tmp_path / "shards" / "b.yaml", "1970-01-02T00:00:00", "b2")
+    job = Job.from_yaml_file(config)
+    assert [video.title for video in job.videos] == ["root", "a", "b2", "extra"]
+    assert parsed == [tmp_path / "shards" / "b.yaml"]
+
+def test_job_from_yaml_file_invalid_shard(tmp_path):
+    "Errors in a shard name the shard."
+    (tmp_path / "bad.yaml").write_text("videos: {}\n", encoding="utf-8")
+    job_path = tmp_path / "clip.yaml"
+    job_path.write_text("include: bad.yaml\n", encoding="utf-8")
+    config = Config.default()._replace(job_path=job_path, cache_dir=tmp_path / "cache")
+    with pytest.raises(Error, match="bad.yaml"):
+        Job.from_yaml_file(config)
+
+def make_failing_job(tmp_path: Path) -> Job:
+    "Get a job with one existing and one missing source video."
+    (tmp_path / "1970-01-01 00-00-00.mkv").touch()
+    return Job.from_dict(Config.default(), {
+        "output-dir": str(tmp_path),
+        "video-dir": str(tmp_path),
+        "videos": [
+            {
+                "date": "1970-01-01T00:00:00",
+                "title": "present",
+                "clips": [
+                    {"time": "0 - 10", "title": "flaky"},
+                    {"time": "10 - 20", "title": "broken"},
+                    {"time": "20 - 30", "title": "fine"},
+                ],
+            },
+            {
+                "date": "1970-01-02T00:00:00",
+                "title": "missing",
+                "clips": [{"time": "0 - 10", "title": "lost"}],
+            },
+        ],
+    })
+
+def test_job_run_keep_going(tmp_path, monkeypatch):
+    "Failures are isolated per clip, retried, reported, and can be re-run alone."
+    attempts = {"flaky": 0, "broken": 0, "fine": 0}
+    def write(clip, config, src, dst, parts=()):
+        attempts[clip.title] += 1
+        if clip.title == "broken" or (clip.title == "flaky" and attempts["flaky"] < 2):
+            raise TransientError("ffmpeg failed")
+    monkeypatch.setattr(Clip, "write", write)
+    monkeypatch.setattr(job_module.time, "sleep", lambda seconds: None)
+
+    job = make_failing_job(tmp_path)
+    config = Config.default()._replace(job_path=tmp_path / "clip.yaml", keep_going=True)
+    with pytest.raises(Error, match="2 clips failed"):
+        job.run(config)
+    assert attempts == {"flaky": 2, "broken": 3, "fine": 1}
+
+    report = json.loads((tmp_path / "clip.failures.json").read_text(encoding="utf-8"))
+    assert [(f["title"], f["attempts"]) for f in report["failures"]] == [
+        ("broken", 3),
+        ("lost", 0),
+    ]
+
+    retry = job.only_failed(config)
+    assert [[clip.title for clip in video.clips] for video in retry.videos] == [
+        ["broken"],
+        ["lost"],
+    ]
+
+def test_job_run_stops_on_failure(tmp_path, monkeypatch):
+    "Without keep-going the first failure stops the run."
+    def write(clip, config, src, dst, parts=()):
+        raise TransientError("ffmpeg failed")
+    monkeypatch.setattr(Clip, "write", write)
+    monkeypatch.setattr(job_module.time, "sleep", lambda seconds: None)
+
+    config = Config.default()._replace(job_path=tmp_path / "clip.yaml", retries=0)
+    with pytest.raises(TransientError):
+        make_failing_job(tmp_path).run(config)
+    assert not (tmp_path / "clip.failures.json").exists()
+
+def test_video_write_clips_concurrent(tmp_path, monkeypatch):
+    "Stream copied clips of a video are written concurrently."
+    barrier = threading.Barrier(3, timeout=5)
+    def write(clip, config, src, dst, parts=()):
+        barrier.wait()
+    monkeypatch.setattr(Clip, "write", write)
+
+    job = make_failing_job(tmp_path)
+    config = Config.default()._replace(jobs=3)
+    assert not job.videos[0].write_clips(config, tmp_path, tmp_path)
+
+def test_run_parallel_stops_on_failure():
+    "A failure cancels the items that have not started and is raised."
+    started = []
+    def work(item):
+        started.append(item)
+        if item == 1:
+            raise Error("failed")
+        return item
+
+    assert run_parallel(2, lambda item: item * 2, [1, 2, 3]) == [2, 4, 6]
+    with pytest.raises(Error, match="failed"):
+        run_parallel(2, work, list(range(100)))
+    assert len(started) < 100
+
+def test_video_write_clips_duplicates(tmp_path, monkeypatch):
+    "Identical clips sharing an output path are written once."
+    written = []
+    monkeypatch.setattr(Clip, "write", lambda clip, config, src, dst, parts=(): written.append(dst))
+    (tmp_path / "1970-01-01 00-00-00.mkv").touch()
+    video = Video.from_dict({
+        "date": "1970-01-01T00:00:00",
+        "title": "video",
+        "clips": [{"time": "0 - 10", "title": "a"}, {"time": "0:00 - 0:10", "title": "a"}],
+    })
+    dst = tmp_path / "a.mkv"
+    video.write_clips(Config.default()._replace(jobs=4), tmp_path, tmp_path, [dst, dst])
+    assert written == [dst]
+
+def test_clip_write_targets(tmp_path, monkeypatch):
+    "Clips are read once for every destination, and missing copies are remuxed."
+    commands = []
+    monkeypatch.setattr(job_module.ffmpeg, "check_call", lambda cmd: commands.append(cmd))
+    monkeypatch.setattr(job_module.ffmpeg, "run", lambda args: commands.append(args))
+
+    (tmp_path / "ssd").mkdir()
+    config = Config.default()._replace(targets=(
+        Target(tmp_path / "ssd", "mp4", {"movflags": "+faststart"}),
+    ))
+    clip = Clip.from_dict({"time": "0 - 10", "title": "clip"})
+    dst = tmp_path / "clip.mkv"
+    clip.write(config, tmp_path / "src.mkv", dst)
+    assert len(commands) == 1
+    assert commands[0][-3:] == (
+        "-f",
+        "tee",
+        f"[onfail=abort]{dst}|[onfail=abort:movflags=+faststart]{tmp_path}/ssd/clip.mp4",
+    )
+
+    # Existing clips are fanned out to the missing destinations only
+    dst.touch()
+    clip.write(config, tmp_path / "src.mkv", dst)
+    assert commands[1][:2] == ("-i", str(dst))
+    assert commands[1][-1] == f"[onfail=abort:movflags=+faststart]{tmp_path}/ssd/clip.mp4"
+
+    (tmp_path / "ssd" / "clip.mp4").touch()
+    clip.write(config, tmp_path / "src.mkv", dst)
+    assert len(commands) == 2
+
+def test_clip_write_targets_failure(tmp_path, monkeypatch):
+    "Partial outputs of every destination are removed when writing fails."
+    def check_call(cmd):
+        for path in (tmp_path / "clip.mkv", tmp_path / "clip.mp4"):
+            path.touch()
+        raise job_module.ffmpeg.process_error(1, cmd, "Input/output error")
+    monkeypatch.setattr(job_module.ffmpeg, "check_call", check_call)
+
+    config = Config.default()._replace(targets=(Target(tmp_path, "mp4"),))
+    clip = Clip.from_dict({"time": "0 - 10", "title": "clip"})
+    with pytest.raises(TransientError):
+        clip.write(config, tmp_path / "src.mkv", tmp_path / "clip.mkv")
+    assert not list(tmp_path.iterdir())
+
+def test_clip_write_native_fallback(tmp_path, monkeypatch):
+    "Native cuts fall back to ffmpeg for files the cutter cannot handle."
+    commands = []
+    monkeypatch.setattr(job_module.ffmpeg, "check_call", lambda cmd: commands.append(cmd))
+    config = Config.default()._replace(write_mode=WriteMode.NATIVE)
+    clip = Clip.from_dict({"time": "0 - 10", "title": "clip"})
+    src = tmp_path / "src.mp4"
+    src.write_bytes(b"not an mp4 file")
+    clip.write(config, src, tmp_path / "clip.mp4")
+    assert len(commands) == 1
+
+def test_job_run_checksum(tmp_path, monkeypatch):
+    "Written clips are hashed once they are finished and recorded in the manifest."
+    commands = []
+    def check_call(cmd):
+        commands.append(cmd)
+        Path(cmd[-1]).write_bytes(b"clip")
+    monkeypatch.setattr(job_module.ffmpeg, "check_call", check_call)
+
+    job = Job.from_dict(Config.default(), {
+        "video-dir": str(tmp_path),
+        "output-dir": str(tmp_path),
+        "videos": [{
+            "date": "1970-01-01T00:00:00",
+            "title": "video",
+            "clips": [{"time": "0 - 10", "title": "clip"}],
+        }],
+    })
+    (tmp_path / "1970-01-01 00-00-00.mkv").touch()
+    config = Config.default()._replace(
+        job_path=tmp_path / "clip.yaml",
+        cache_dir=tmp_path / "cache",
+        checksum=True,
+    )
+    job.run(config)
+    # Written as usual, not through a pipe
+    assert commands[0][-1].endswith(".mkv")
+
+    clips = job_module.manifest.load(config)
+    assert list(clips.values()) == [{
+        "video": "1970-01-01T00:00:00",
+        "time": "0 - 10",
+        "title": "clip",
+        "blake2b": job_module.manifest.hash_file(Path(next(iter(clips)))).digest,
+        "size": 4,
+    }]
+
+    # Skipped clips keep their entries
+    job.run(config)
+    assert len(commands) == 1
+    assert job_module.manifest.load(config) == clips
+
+def test_job_catalog_entries(tmp_path):
+    "Existing clips are cataloged with their wall-clock range."
+    job = Job.from_dict(Config.default(), {
+        "video-dir": str(tmp_path),
+        "output-dir": str(tmp_path),
+        "videos": [{
+            "date": "1970-01-01T01:00:00",
+            "title": "video",
+            "clips": [{"time": "1:00 - 1:30", "title": "made"}, {"time": "2:00 - 2:30", "title": "missing"}],
+        }],
+    })
+    config = Config.default()._replace(job_path=tmp_path / "clip.yaml", cache_dir=tmp_path / "cache")
+    (made, _) = job.output_paths(config)[0]
+    made.write_bytes(b"clip")
+
+    (entry,) = job.catalog_entries(config)
+    assert entry.output == made
+    assert entry.job == tmp_path / "clip.yaml"
+    assert entry.source == tmp_path / "1970-01-01 01-00-00.mkv"
+    assert (entry.title, entry.video_title, entry.size) == ("made", "video", 4)
+    assert entry.start == datetime.datetime(1970, 1, 1, 1, 1)
+    assert entry.end == datetime.datetime(1970, 1, 1, 1, 1, 30)
+
+    job.record(config, job.output_paths(config), {})
+    assert job_module.catalog.search(config, "made") == [entry]
+
+def test_video_write_clips_spanning(tmp_path, monkeypatch):
+    "Clips running past a recording split are joined from the next recording."
+    monkeypatch.setattr(job_module.ffmpeg, "duration", lambda config, src: 60.0)
+    commands = []
+    monkeypatch.setattr(job_module.timeline.ffmpeg, "run", lambda args: commands.append(args))
+    monkeypatch.setattr(job_module.ffmpeg, "check_call", lambda cmd: commands.append(cmd))
+    for name in ("1970-01-01 00-00-00.mkv", "1970-01-01 00-01-00.mkv"):
+        (tmp_path / name).touch()
+
+    video = Video.from_dict({
+        "date": "1970-01-01T00:00:00",
+        "title": "video",
+        "clips": [{"time": "50 - 70", "title": "split"}, {"time": "0 - 10", "title": "plain"}],
+    })
+    video.write_clips(Config.default(), tmp_path, tmp_path)
+    assert [command[:3] for command in commands] == [
+        ("-f", "concat", "-safe"),
+        ("ffmpeg", "-nostdin", "-ss"),
+    ]
+
+def test_video_write_clips_readahead(tmp_path, monkeypatch):
+    """Each clip being written reads the start of the next missing clip ahead
+    and its own range as it goes, and the source is released."""
+    events = []
+
+    @contextlib.contextmanager
+    def following(src, byte_range, dst):
+        events.append(("following", byte_range))
+        yield
+
+    monkeypatch.setattr(Clip, "write", lambda clip, config, src, dst, parts=(): events.append(clip.title))
+    monkeypatch.setattr(job_module.readahead, "clip_ranges",
+                        lambda config, src, spans: [(int(start), 1) for (start, _) in spans])
+    monkeypatch.setattr(job_module.readahead, "will_need",
+                        lambda src, byte_range: events.append(byte_range))
+    monkeypatch.setattr(job_module.readahead, "following", following)
+    monkeypatch.setattr(job_module.readahead, "release", lambda src: events.append("release"))
+
+    job = make_failing_job(tmp_path)
+    job.videos[0].write_clips(Config.default()._replace(jobs=1), tmp_path, tmp_path)
+    assert events == [
+        (0, 1),
+        (10, 1), ("following", (0, 1)), "flaky",
+        (20, 1), ("following", (10, 1)), "broken",
+        ("following", (20, 1)), "fine",
+        "release",
+    ]
@@ -0,0 +1,58 @@
+"Tests for the loudness module."
+
+import io
+
+import pytest # type: ignore
+
+from mvcs.loudness import HEADER, MAGIC, WINDOW_MS, find_peaks, load_index, write_index
+
+np = pytest.importorskip("numpy")
+
+def make_index(levels):
+    "Get an in-memory index with the given RMS level per window."
+    index = np.zeros((len(levels), 2), dtype=np.float32)
+    index[:, 0] = levels
+    index[:, 1] = levels
+    return index
+
+def test_write_index_round_trip(tmp_path):
+    "Windowed RMS/peak values are written to a memory-mappable sidecar."
+    samples = np.zeros(800 * 5, dtype=np.int16)
+    samples[800:1600] = 16384
+    samples[1600:2400:2] = -32768
+
+    path = tmp_path / "index.bin"
+    with path.open("wb") as file:
+        file.write(HEADER.pack(MAGIC, WINDOW_MS, 0))
+        count = write_index(io.BytesIO(samples.tobytes()), file, 800)
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, WINDOW_MS, count))
+
+    index = load_index(path)
+    assert count == 5
+    assert index.shape == (5, 2)
+    assert index[0].tolist() == [0.0, 0.0]
+    assert index[1].tolist() == [0.5, 0.5]
+    assert index[2, 0] == pytest.approx(2 ** -0.5)
+    assert index[2, 1] == 1.0
+
+def test_find_peaks_spacing():
+    "Peaks are ranked by loudness and kept apart by the minimum spacing."
+    levels = np.full(6000, 0.001, dtype=np.float32)
+    levels[1000:1010] = 1.0
+    levels[1050:1060] = 0.9
+    levels[4000:4010] = 0.5
+    peaks = find_peaks(make_index(levels), -20.0, 10, 30.0)
+    assert [time for (time, _) in peaks] == [
+        pytest.approx(100.5, abs=0.2),
+        pytest.approx(400.5, abs=0.2),
+    ]
+
+def test_find_peaks_threshold_and_top():
+    "Quiet windows are ignored and the number of peaks is limited."
+    levels = np.full(6000, 0.001, dtype=np.float32)
+    for start in (1000, 2000, 3000):
+        levels[start:start + 10] = 1.0
+    assert find_peaks(make_index(levels), 1.0, 10, 1.0) == []
+    assert len(find_peaks(make_index(levels), -20.0, 2, 1.0)) == 2
+    assert find_peaks(make_index([]), -20.0, 2, 1.0) == []
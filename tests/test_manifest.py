@@ -0,0 +1,98 @@
+"Tests for the manifest module."
+
+import hashlib
+
+from mvcs import manifest
+from mvcs.config import Config
+from mvcs.manifest import Checksum
+
+def checksum(data: bytes) -> Checksum:
+    "Get the expected checksum of some contents."
+    return Checksum(hashlib.blake2b(data).hexdigest(), len(data))
+
+def test_hash_file(tmp_path):
+    "Files are hashed in chunks."
+    path = tmp_path / "clip.mkv"
+    data = bytes(range(256)) * (manifest.CHUNK_SIZE // 100)
+    path.write_bytes(data)
+    assert manifest.hash_file(path) == checksum(data)
+
+def test_store_load(tmp_path):
+    "Manifests are stored next to the job file."
+    config = Config.default()._replace(job_path=tmp_path / "clip.yaml")
+    assert manifest.load(config) == {}
+    clips = {"a.mkv": manifest.entry(checksum(b"a"), {"title": "a"})}
+    manifest.store(config, clips)
+    assert (tmp_path / "clip.manifest.json").is_file()
+    assert manifest.load(config) == clips
+
+def test_verify(tmp_path):
+    "Missing, truncated and corrupted clips are reported."
+    config = Config.default()._replace(jobs=2)
+    clips = {}
+    for (name, data) in (("good", b"good"), ("short", b"short"), ("bad", b"bad"), ("lost", b"")):
+        path = tmp_path / f"{name}.mkv"
+        clips[str(path)] = manifest.entry(checksum(data), {"title": name})
+    (tmp_path / "good.mkv").write_bytes(b"good")
+    (tmp_path / "short.mkv").write_bytes(b"sho")
+    (tmp_path / "bad.mkv").write_bytes(b"BAD")
+    assert manifest.verify(config, clips) == [
+        (str(tmp_path / "bad.mkv"), "checksum mismatch"),
+        (str(tmp_path / "lost.mkv"), "missing"),
+        (str(tmp_path / "short.mkv"), "size 3 != 5"),
+    ]
+
+def identity(video: str, time: str, title: str):
+    "Get a clip identity."
+    return {"video": video, "time": time, "title": title}
+
+def test_plan_renames(tmp_path):
+    "Outputs are matched by source and time, never by name or title."
+    for name in ("old.mkv", "other.mkv", "swap a.mkv", "swap b.mkv", "ext.mkv", "kept.mkv"):
+        (tmp_path / name).touch()
+    clips = {
+        str(tmp_path / "old.mkv"): identity("v1", "0 - 10", "old"),
+        str(tmp_path / "other.mkv"): identity("v1", "10 - 20", "other"),
+        str(tmp_path / "swap a.mkv"): identity("v2", "0 - 10", "a"),
+        str(tmp_path / "swap b.mkv"): identity("v2", "10 - 20", "b"),
+        str(tmp_path / "ext.mkv"): identity("v3", "0 - 10", "ext"),
+        str(tmp_path / "gone.mkv"): identity("v4", "0 - 10", "gone"),
+    }
+    planned = [
+        (tmp_path / "new.mkv", identity("v1", "0 - 10", "new")),
+        (tmp_path / "other.mkv", identity("v1", "10 - 20", "other")),
+        # Outputs can trade names
+        (tmp_path / "swap b.mkv", identity("v2", "0 - 10", "b")),
+        (tmp_path / "swap a.mkv", identity("v2", "10 - 20", "a")),
+        # Other formats are extracted again
+        (tmp_path / "ext.mp4", identity("v3", "0 - 10", "ext")),
+        (tmp_path / "gone 2.mkv", identity("v4", "0 - 10", "gone")),
+        # Unknown files are never overwritten
+        (tmp_path / "kept.mkv", identity("v1", "10 - 20", "dup")),
+    ]
+    assert sorted(manifest.plan_renames(clips, planned)) == [
+        (tmp_path / "old.mkv", tmp_path / "new.mkv"),
+        (tmp_path / "swap a.mkv", tmp_path / "swap b.mkv"),
+        (tmp_path / "swap b.mkv", tmp_path / "swap a.mkv"),
+    ]
+
+def test_update_orphans(tmp_path):
+    "Existing planned outputs are recorded; unplanned ones are kept as orphans."
+    for name in ("a.mkv", "b.mkv", "orphan.mkv"):
+        (tmp_path / name).touch()
+    clips = {
+        str(tmp_path / "a.mkv"): {**identity("v", "0 - 10", "old title"), "blake2b": "00", "size": 0},
+        str(tmp_path / "orphan.mkv"): identity("v", "5 - 6", "orphan"),
+        str(tmp_path / "deleted.mkv"): identity("v", "7 - 8", "deleted"),
+    }
+    planned = [
+        (tmp_path / "a.mkv", identity("v", "0 - 10", "a")),
+        (tmp_path / "b.mkv", identity("v", "10 - 20", "b")),
+        (tmp_path / "failed.mkv", identity("v", "20 - 30", "failed")),
+    ]
+    assert manifest.update(clips, planned, {}) == {
+        str(tmp_path / "a.mkv"): {**identity("v", "0 - 10", "a"), "blake2b": "00", "size": 0},
+        str(tmp_path / "b.mkv"): identity("v", "10 - 20", "b"),
+        str(tmp_path / "orphan.mkv"): identity("v", "5 - 6", "orphan"),
+    }
+    assert manifest.orphans(clips, planned) == [tmp_path / "orphan.mkv"]
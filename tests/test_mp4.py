@@ -0,0 +1,190 @@
+"Tests for the mp4 module."
+
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import pytest # type: ignore
+
+from mvcs import mp4
+from mvcs.error import Error, UnsupportedError
+from mvcs.mp4 import box, full_box
+
+def sample_data(track: str, index: int, size: int) -> bytes:
+    "Get identifiable contents for a sample."
+    return f"{track}{index:03d}".encode().ljust(size, b".")
+
+def trak(
+        track_id: int,
+        handler: bytes,
+        timescale: int,
+        delta: int,
+        sizes: Sequence[int],
+        per_chunk: int,
+        offsets: Sequence[int],
+        stss: Optional[Sequence[int]] = None,
+        edits: Sequence[int] = (),
+        ctts: Optional[Sequence[int]] = None,
+) -> bytes:
+    "Build a `trak` box with simple sample tables."
+    duration = delta * len(sizes)
+    tables = [
+        full_box(b"stsd", 0, struct.pack(">I", 1), box(handler, bytes(8))),
+        full_box(b"stts", 0, struct.pack(">III", 1, len(sizes), delta)),
+        full_box(b"stsz", 0, struct.pack(">II", 0, len(sizes)), mp4.packed(sizes)),
+        full_box(b"stsc", 0, struct.pack(">IIII", 1, 1, per_chunk, 1)),
+        full_box(b"stco", 0, struct.pack(">I", len(offsets)), mp4.packed(offsets)),
+    ]
+    if stss is not None:
+        tables.append(full_box(b"stss", 0, struct.pack(">I", len(stss)), mp4.packed(stss)))
+    if ctts is not None:
+        runs = [value for offset in ctts for value in (1, offset)]
+        tables.append(full_box(b"ctts", 0, struct.pack(">I", len(ctts)), mp4.packed(runs)))
+    parts = [full_box(b"tkhd", 0, struct.pack(">IIIII", 0, 0, track_id, 0, duration), bytes(60))]
+    if edits:
+        entries = b"".join(struct.pack(">IiI", duration, edit, 1 << 16) for edit in edits)
+        parts.append(box(b"edts", full_box(b"elst", 0, struct.pack(">I", len(edits)), entries)))
+    parts.append(box(b"mdia",
+        full_box(b"mdhd", 0, struct.pack(">IIII", 0, 0, timescale, duration), bytes(4)),
+        full_box(b"hdlr", 0, bytes(4), handler[:4], bytes(13)),
+        box(b"minf", box(b"stbl", *tables)),
+    ))
+    return box(b"trak", *parts)
+
+# Composition offsets of a 30 frame GOP in decode order: I P B B P B B ... P P,
+# presented one frame late (an edit list of 1 hides the delay).
+GOP_CTTS = [1] + [3, 0, 0] * 9 + [1, 1]
+
+def write_movie(
+        path: Path,
+        edits: Sequence[int] = (),
+        extra: bytes = b"",
+        ctts: Optional[Sequence[int]] = None,
+):
+    """Write a 3 second file with a 30 fps video track (a keyframe every second)
+    and an audio track of 100 ms samples, interleaved in chunks."""
+
+    video = [("v", i, 20 + i % 7) for i in range(90)]
+    audio = [("a", i, 8) for i in range(30)]
+    chunks: List[list] = []
+    for second in range(3):
+        chunks.append(video[second * 30:second * 30 + 15])
+        chunks.append(audio[second * 10:second * 10 + 10])
+        chunks.append(video[second * 30 + 15:second * 30 + 30])
+
+    def build(base: int) -> bytes:
+        offsets: Dict[str, List[int]] = {"v": [], "a": []}
+        position = base
+        for chunk in chunks:
+            offsets[chunk[0][0]].append(position)
+            position += sum(size for (_, _, size) in chunk)
+        return box(b"moov",
+            full_box(b"mvhd", 0, struct.pack(">IIII", 0, 0, 1000, 3000), bytes(80)),
+            trak(1, b"vide", 30, 1, [s for (_, _, s) in video], 15, offsets["v"],
+                 stss=[1, 31, 61], edits=edits, ctts=ctts),
+            trak(2, b"soun", 1000, 100, [s for (_, _, s) in audio], 10, offsets["a"]),
+        )
+
+    ftyp = box(b"ftyp", b"isom", bytes(4), b"isommp41")
+    size = len(build(0))
+    moov = build(len(ftyp) + size + 8)
+    data = b"".join(sample_data(*sample) for chunk in chunks for sample in chunk)
+    path.write_bytes(ftyp + moov + box(b"mdat", data) + extra)
+
+def read_samples(path: Path) -> List[List[bytes]]:
+    "Read the samples of every track of a file through its sample tables."
+    buf = path.read_bytes()
+    samples = []
+    for track in mp4.parse(buf).tracks:
+        data = []
+        for (chunk, offset) in enumerate(track.chunk_offsets):
+            for index in range(track.chunk_samples[chunk], track.chunk_samples[chunk + 1]):
+                data.append(buf[offset:offset + track.sizes[index]])
+                offset += track.sizes[index]
+        samples.append(data)
+    return samples
+
+@pytest.mark.parametrize("stts,ticks,expected", [
+    ([(10, 3)], 0, 0),
+    ([(10, 3)], 1, 1),
+    ([(10, 3)], 3, 1),
+    ([(10, 3)], 100, 10),
+    ([(2, 5), (3, 1)], 11, 3),
+])
+def test_sample_index(stts, ticks, expected):
+    "The first sample decoded at or after a time is found."
+    assert mp4.sample_index(stts, ticks) == expected
+
+def test_slice_runs():
+    "Run-length tables are sliced to a sample range."
+    assert mp4.slice_runs([(3, 1), (2, 5), (4, 2)], 2, 7) == [(1, 1), (2, 5), (2, 2)]
+
+def test_cut(tmp_path):
+    "Cuts start on the previous keyframe and copy only the selected samples."
+    src = tmp_path / "src.mp4"
+    dst = tmp_path / "dst.mp4"
+    write_movie(src)
+    mp4.cut(src, dst, 1.2, 2.5)
+
+    movie = mp4.parse(dst.read_bytes())
+    (video, audio) = movie.tracks
+    assert video.stts == [(45, 1)]
+    assert list(video.stss) == [1, 31]
+    assert audio.stts == [(15, 100)]
+    assert [data for data in read_samples(dst)] == [
+        [sample_data("v", i, 20 + i % 7) for i in range(30, 75)],
+        [sample_data("a", i, 8) for i in range(10, 25)],
+    ]
+    assert not [path for path in tmp_path.iterdir() if path.name.startswith(".")]
+
+def test_cut_edit_list(tmp_path):
+    "A single edit keeps its media time and gets the new duration."
+    src = tmp_path / "src.mp4"
+    dst = tmp_path / "dst.mp4"
+    write_movie(src, edits=[2])
+    mp4.cut(src, dst, 0, 1)
+    buf = dst.read_bytes()
+    assert mp4.parse(buf).tracks[0].edit == (2, struct.pack(">I", 1 << 16))
+
+def test_cut_composition_offsets(tmp_path):
+    """B-frame cuts select samples by presentation time, so frames decoded
+    after the end time but presented before it are kept."""
+    src = tmp_path / "src.mp4"
+    dst = tmp_path / "dst.mp4"
+    write_movie(src, edits=[1], ctts=GOP_CTTS * 3)
+    movie = mp4.parse(src.read_bytes())
+    assert sorted(mp4.presentation_times(movie.tracks[0])) == list(range(1, 91))
+
+    cuts = mp4.plan(movie, 1.2, 2.5)
+    # Frames presented at 2.4-2.5 s are B-frames decoded up to sample 75
+    assert [(cut.first, cut.last) for cut in cuts] == [(30, 76), (10, 25)]
+    mp4.cut(src, dst, 1.2, 2.5)
+    (track, _) = mp4.parse(dst.read_bytes()).tracks
+    # The new first frame (the keyframe) is presented at the start
+    assert track.edit == (1, struct.pack(">I", 1 << 16))
+    assert mp4.presentation_times(track)[0] - track.edit[0] == 0
+    assert track.ctts == [(1, offset) for offset in (GOP_CTTS * 3)[30:76]]
+
+@pytest.mark.parametrize("edits,extra", [
+    # Several edits
+    ([0, 10], b""),
+    # Fragmented files
+    ((), box(b"moof")),
+])
+def test_cut_unsupported(tmp_path, edits, extra):
+    "Files the cutter cannot handle are rejected for ffmpeg to cut."
+    src = tmp_path / "src.mp4"
+    write_movie(src, edits=edits, extra=extra)
+    with pytest.raises(UnsupportedError):
+        mp4.cut(src, tmp_path / "dst.mp4", 0, 1)
+    assert [path.name for path in tmp_path.iterdir()] == ["src.mp4"]
+
+def test_cut_empty(tmp_path):
+    "Empty and unparsable files are rejected."
+    src = tmp_path / "src.mp4"
+    src.touch()
+    with pytest.raises(UnsupportedError):
+        mp4.cut(src, tmp_path / "dst.mp4", 0, 1)
+    write_movie(src)
+    with pytest.raises(Error):
+        mp4.cut(src, tmp_path / "dst.mp4", 5, 6)
@@ -0,0 +1,76 @@
+"Tests for the names module."
+
+import datetime
+from pathlib import Path
+
+import pytest # type: ignore
+
+from mvcs.config import Config, NameCollision, Replace
+from mvcs.error import Error
+from mvcs.names import NameRenderer, disambiguate, renderer
+
+@pytest.mark.parametrize("replace,target,expected", [
+    ({}, "a b", "a b"),
+    ({" ": "_"}, "a b c", "a_b_c"),
+    # Longer keys take precedence over their prefixes
+    ({"a": "1", "ab": "2"}, "abac", "21c"),
+    # Replacements are applied in a single pass
+    ({"a": "b", "b": "c"}, "ab", "bc"),
+])
+def test_renderer_apply(replace, target, expected):
+    "Filename replacements are applied as expected."
+    config = Config.default()._replace(filename_replace=Replace.from_dict(replace))
+    assert NameRenderer.from_config(config).apply(target) == expected
+
+def test_renderer_source_name():
+    "Source video names respect the filename format and replacements."
+    config = Config.default()._replace(
+        filename_replace=Replace.from_dict({" ": "_"}),
+        video_ext="mp4",
+    )
+    name = renderer(config).source_name(datetime.datetime(2020, 1, 2, 3, 4, 5))
+    assert name == "2020-01-02_03-04-05.mp4"
+
+def test_renderer_is_cached():
+    "The renderer is compiled once per set of filename rules."
+    config = Config.default()
+    assert renderer(config) is renderer(config._replace(jobs=3))
+    assert renderer(config) is not renderer(config._replace(output_ext="mp4"))
+
+OUTPUTS = [
+    (Path("out/a.mkv"), 1),
+    (Path("out/b.mkv"), 2),
+    (Path("out/A.mkv"), 3),
+    (Path("out/a.mkv"), 1),
+    (Path("out/a.mkv"), 4),
+]
+
+@pytest.mark.parametrize("policy,expected", [
+    (
+        NameCollision.NUMBER,
+        [Path("out/a.mkv"), Path("out/b.mkv"), Path("out/A (2).mkv"),
+         Path("out/a.mkv"), Path("out/a (3).mkv")],
+    ),
+    (
+        NameCollision.SKIP,
+        [Path("out/a.mkv"), Path("out/b.mkv"), None, Path("out/a.mkv"), None],
+    ),
+])
+def test_disambiguate(policy, expected):
+    "Different clips never share an output path; identical clips may."
+    assert disambiguate(OUTPUTS, policy) == expected
+
+@pytest.mark.parametrize("policy", [NameCollision.NUMBER, NameCollision.SKIP])
+def test_disambiguate_stable(policy):
+    "Each clip gets the same path whatever the order of the job."
+    forward = dict(zip((identity for (_, identity) in OUTPUTS), disambiguate(OUTPUTS, policy)))
+    backward = list(reversed(OUTPUTS))
+    assert dict(zip((identity for (_, identity) in backward), disambiguate(backward, policy))) \
+        == forward
+
+def test_disambiguate_error():
+    "All collisions are reported at once."
+    with pytest.raises(Error) as ex:
+        disambiguate(OUTPUTS, NameCollision.ERROR)
+    assert "A.mkv" in str(ex.value)
+    assert "a.mkv" in str(ex.value)
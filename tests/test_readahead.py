@@ -0,0 +1,74 @@
+"Tests for the readahead module."
+
+import os
+import time
+
+import pytest # type: ignore
+
+from mvcs import readahead
+
+@pytest.mark.parametrize("spans,expected", [
+    ([(10, 20)], [(50, 200)]),
+    # Ranges are clamped to the file
+    ([(0, 5), (95, 120)], [(0, 100), (900, 100)]),
+])
+def test_estimate_ranges(spans, expected):
+    "Clip byte ranges are estimated from the average bitrate, with a margin."
+    assert readahead.estimate_ranges(1000, 100.0, spans) == expected
+
+def test_estimate_ranges_unknown_duration():
+    "Sources without a duration get empty ranges."
+    assert readahead.estimate_ranges(1000, 0.0, [(0, 5)]) == [(0, 0)]
+
+def test_advice(tmp_path, monkeypatch):
+    "Read-ahead and release are given to the kernel, except for sources still recording."
+    if not hasattr(os, "posix_fadvise"):
+        pytest.skip("posix_fadvise is not available")
+    calls = []
+    monkeypatch.setattr(os, "posix_fadvise", lambda fd, offset, length, advice:
+                        calls.append((offset, length, advice)))
+
+    src = tmp_path / "src.mkv"
+    src.write_bytes(bytes(100))
+    readahead.will_need(src, (10, 20))
+    readahead.will_need(src, None)
+    readahead.release(src)
+    old = time.time() - 3600
+    os.utime(src, (old, old))
+    readahead.release(src)
+    assert calls == [(10, 20, os.POSIX_FADV_WILLNEED), (0, 0, os.POSIX_FADV_DONTNEED)]
+
+@pytest.mark.parametrize("byte_range,position,expected", [
+    (None, 0, None),
+    # Capped to the window
+    ((100, 100 << 20), 0, (100, readahead.WINDOW_BYTES)),
+    ((100, 100 << 20), 1000, (1100, readahead.WINDOW_BYTES)),
+    # Clamped to the range
+    ((100, 1000), 400, (500, 600)),
+    ((100, 1000), 5000, (1100, 0)),
+])
+def test_window(byte_range, position, expected):
+    "Read-ahead is limited to a window ahead of the read position."
+    assert readahead.window(byte_range, position) == expected
+
+def test_following(tmp_path, monkeypatch):
+    "The read-ahead window advances as the clip is written."
+    calls = []
+    monkeypatch.setattr(readahead, "will_need", lambda src, byte_range: calls.append(byte_range))
+    monkeypatch.setattr(readahead, "ADVANCE_SECONDS", 0.01)
+    monkeypatch.setattr(readahead, "WINDOW_BYTES", 100)
+
+    src = tmp_path / "src.mkv"
+    dst = tmp_path / "dst.mkv"
+    with readahead.following(src, (1000, 250), dst):
+        while not calls:
+            time.sleep(0.01)
+        dst.write_bytes(bytes(120))
+        while len(calls) < 2:
+            time.sleep(0.01)
+    assert calls[:2] == [(1000, 100), (1120, 100)]
+
+    calls.clear()
+    with readahead.following(src, None, dst):
+        pass
+    assert not calls
@@ -0,0 +1,98 @@
+"Tests for the reel module."
+
+import datetime
+from pathlib import Path
+
+import pytest # type: ignore
+
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Job, Reel
+from mvcs.reel import Part, concat_list, encode_args, reel_parts
+
+JOB = {
+    "video-dir": "/videos",
+    "videos": [
+        {
+            "date": "1970-01-01T00:00:00",
+            "title": "a",
+            "clips": [
+                {"time": "0 - 10", "title": "one"},
+                {"time": "1:00 - 1:30", "title": "two"},
+                {"time": "2:00 - 2:30", "title": "twice"},
+                {"time": "3:00 - 3:30", "title": "twice"},
+            ],
+        },
+        {
+            "date": "1970-01-02T00:00:00",
+            "title": "b",
+            "clips": [{"time": "5 - 6", "title": "one"}],
+        },
+    ],
+    "reels": [
+        {
+            "title": "best",
+            "clips": [
+                {"video": "1970-01-02T00:00:00", "clip": "one"},
+                {"video": "1970-01-01T00:00:00", "clip": "two"},
+            ],
+        },
+    ],
+}
+
+def test_reel_from_dict():
+    "Reels are deserialized with the job."
+    job = Job.from_dict(Config.default(), JOB)
+    assert job.reels == [Reel(title="best", clips=[
+        (datetime.datetime(1970, 1, 2), "one"),
+        (datetime.datetime(1970, 1, 1), "two"),
+    ])]
+
+@pytest.mark.parametrize("data", [
+    {"title": "x"},
+    {"title": "", "clips": [{"video": "1970-01-01T00:00:00", "clip": "a"}]},
+    {"title": "x", "clips": []},
+    {"title": "x", "clips": [{"video": "1970-01-01T00:00:00"}]},
+    {"title": "x", "clips": ["1970-01-01T00:00:00"]},
+])
+def test_reel_from_dict_invalid(data):
+    "Invalid reels are rejected."
+    with pytest.raises(Error):
+        Reel.from_dict(data)
+
+def test_reel_parts():
+    "Clip references resolve to source ranges in reel order."
+    job = Job.from_dict(Config.default(), JOB)
+    assert reel_parts(Config.default(), job, job.reels[0]) == [
+        Part(Path("/videos/1970-01-02 00-00-00.mkv"),
+             datetime.timedelta(seconds=5), datetime.timedelta(seconds=6)),
+        Part(Path("/videos/1970-01-01 00-00-00.mkv"),
+             datetime.timedelta(minutes=1), datetime.timedelta(minutes=1, seconds=30)),
+    ]
+
+@pytest.mark.parametrize("ref", [
+    {"video": "1970-01-01T00:00:00", "clip": "missing"},
+    {"video": "1970-01-01T00:00:00", "clip": "twice"},
+])
+def test_reel_parts_invalid(ref):
+    "Unknown and ambiguous clip references are rejected."
+    job = Job.from_dict(Config.default(), JOB)
+    with pytest.raises(Error):
+        reel_parts(Config.default(), job, Reel.from_dict({"title": "bad", "clips": [ref]}))
+
+def test_concat_list():
+    "Parts are read straight from the sources with in/out points."
+    parts = [Part(Path("/v/it's.mkv"), datetime.timedelta(seconds=5), datetime.timedelta(seconds=6))]
+    assert concat_list(parts) == "file '/v/it'\\''s.mkv'\ninpoint 5.0\noutpoint 6.0\n"
+
+def test_encode_args():
+    "Mixed sources are normalized and joined with the concat filter."
+    parts = [
+        Part(Path("a.mkv"), datetime.timedelta(seconds=5), datetime.timedelta(seconds=6)),
+        Part(Path("b.mp4"), datetime.timedelta(), datetime.timedelta(seconds=2)),
+    ]
+    args = encode_args(Config.default(), parts, "1920", "1080")
+    assert args.count("-i") == 2
+    graph = args[args.index("-filter_complex") + 1]
+    assert "[0:v:0]scale=1920:1080" in graph
+    assert graph.endswith("[v0][a0][v1][a1]concat=n=2:v=1:a=1[v][a]")
@@ -0,0 +1,94 @@
+"Tests for the rename module."
+
+import pytest # type: ignore
+
+from mvcs import manifest, rename
+from mvcs.config import Config
+from mvcs.job import Job
+
+def make_job(tmp_path, titles):
+    "Get a job with one clip per title."
+    return Job.from_dict(Config.default(), {
+        "output-dir": str(tmp_path),
+        "video-dir": str(tmp_path),
+        "videos": [{
+            "date": "1970-01-01T00:00:00",
+            "title": "video",
+            "clips": [
+                {"time": f"{10 * i} - {10 * i + 10}", "title": title}
+                for (i, title) in enumerate(titles)
+            ],
+        }],
+    })
+
+@pytest.fixture
+def config(tmp_path):
+    "Get a configuration with the job file in the temporary directory."
+    return Config.default()._replace(job_path=tmp_path / "clip.yaml")
+
+def test_rename_outputs(tmp_path, config):
+    "Retitled clips and their thumbnails are renamed and keep their manifest entries."
+    job = make_job(tmp_path, ["tpyo", "kept"])
+    for (dst, _) in job.planned(config):
+        dst.write_text(dst.name)
+    (old, kept) = [dst for (dst, _) in job.planned(config)]
+    old.with_suffix(".jpg").touch()
+    manifest.store(config, manifest.update({}, job.planned(config), {}))
+
+    fixed = make_job(tmp_path, ["typo", "kept"])
+    (new, _) = [dst for (dst, _) in fixed.planned(config)]
+    assert rename.rename_outputs(config, fixed) == 1
+    assert sorted(tmp_path.iterdir()) == sorted([
+        tmp_path / "clip.manifest.json",
+        new,
+        new.with_suffix(".jpg"),
+        kept,
+    ])
+    assert new.read_text() == old.name
+    assert manifest.load(config)[str(new)]["title"] == "typo"
+
+    assert rename.rename_outputs(config, fixed) == 0
+    assert rename.orphaned_outputs(config, fixed) == []
+    assert rename.orphaned_outputs(config, make_job(tmp_path, ["typo"])) == [kept]
+
+def crashing(function):
+    "Get a replacement for `function` that runs it and then crashes."
+    def crash(*args):
+        function(*args)
+        raise KeyboardInterrupt()
+    return crash
+
+@pytest.mark.parametrize("step,renamed", [
+    # Interrupted while files were moved aside: rolled back, then renamed again
+    ("stage", 2),
+    # Interrupted while files were moved to their new names: finished
+    ("unstage", 0),
+])
+def test_rename_outputs_recover(tmp_path, config, monkeypatch, step, renamed):
+    "Renames interrupted by a crash are finished or rolled back by the next run."
+    job = make_job(tmp_path, ["tpyo", "mistkae"])
+    for (dst, _) in job.planned(config):
+        dst.write_text(dst.name)
+        dst.with_suffix(".jpg").write_text(dst.name)
+    old = [dst for (dst, _) in job.planned(config)]
+    manifest.store(config, manifest.update({}, job.planned(config), {}))
+
+    fixed = make_job(tmp_path, ["typo", "mistake"])
+    new = [dst for (dst, _) in fixed.planned(config)]
+    with monkeypatch.context() as patch:
+        patch.setattr(rename, step, crashing(getattr(rename, step)))
+        with pytest.raises(KeyboardInterrupt):
+            rename.rename_outputs(config, fixed)
+    assert rename.journal_path(config).exists()
+
+    assert rename.rename_outputs(config, fixed) == renamed
+    assert sorted(tmp_path.iterdir()) == sorted([
+        tmp_path / "clip.manifest.json",
+        *new,
+        *(path.with_suffix(".jpg") for path in new),
+    ])
+    assert [path.read_text() for path in new] == [path.name for path in old]
+    assert [path.with_suffix(".jpg").read_text() for path in new] == [path.name for path in old]
+    clips = manifest.load(config)
+    assert [clips[str(path)]["title"] for path in new] == ["typo", "mistake"]
+    assert rename.rename_outputs(config, fixed) == 0
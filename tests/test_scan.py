@@ -0,0 +1,156 @@
+"Tests for the scan module."
+
+import os
+
+import pytest # type: ignore
+
+from mvcs import scan
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.mp4 import box
+
+def element(element_id: int, payload: bytes = b"", unknown: bool = False) -> bytes:
+    "Build a Matroska element with an 8-byte size (or an unknown size)."
+    if unknown:
+        size = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+    else:
+        size = (0x01 << 56 | len(payload)).to_bytes(8, "big")
+    header = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return header + size + payload
+
+def matroska(*children: bytes, unknown: bool = False) -> bytes:
+    "Build a Matroska file with the given top-level segment elements."
+    return (
+        element(scan.EBML_ID, b"\x42\x82\x88matroska")
+        + element(scan.SEGMENT_ID, b"".join(children), unknown)
+    )
+
+INFO = element(0x1549A966, b"info")
+CLUSTER = element(scan.CLUSTER_ID, bytes(100))
+CUES = element(scan.CUES_ID, b"cues")
+NO_CUES = "missing cues (seeking index)"
+
+@pytest.mark.parametrize("data,expected", [
+    (matroska(INFO, CLUSTER, CUES), []),
+    (matroska(INFO, CUES, CLUSTER), []),
+    (matroska(INFO, CLUSTER), [NO_CUES]),
+    (matroska(INFO, element(scan.CLUSTER_ID, bytes(100), unknown=True), unknown=True),
+     [NO_CUES]),
+    (matroska(INFO, CLUSTER, CUES)[:-20], ["truncated: 159 of 179 bytes", NO_CUES]),
+    (matroska(INFO, CLUSTER, CUES, unknown=True)[:-20],
+     ["truncated: 159 of 163 bytes", NO_CUES]),
+    (b"RIFF" + bytes(100), ["missing Matroska header"]),
+    (b"", ["missing Matroska header"]),
+], ids=[
+    "complete", "cues first", "no cues", "live", "truncated", "truncated live", "other", "empty",
+])
+def test_matroska_problems(tmp_path, data, expected):
+    "Matroska sources need a header, cues and all of their elements."
+    path = tmp_path / "video.mkv"
+    path.write_bytes(data)
+    assert scan.container_problems(path) == expected
+
+@pytest.mark.parametrize("data,expected", [
+    (box(b"ftyp", b"isom") + box(b"moov", b"") + box(b"mdat", bytes(100)), []),
+    (box(b"ftyp", b"isom") + box(b"mdat", bytes(100)), ["missing moov box (movie index)"]),
+    ((box(b"ftyp", b"isom") + box(b"moov", b"") + box(b"mdat", bytes(100)))[:-10],
+     ["truncated: truncated mdat box"]),
+    (b"\x1a\x45\xdf\xa3" + bytes(100), ["missing MP4 header"]),
+], ids=["complete", "no moov", "truncated", "other"])
+def test_mp4_problems(tmp_path, data, expected):
+    "MP4 sources need a header, a movie index and all of their boxes."
+    path = tmp_path / "video.mp4"
+    path.write_bytes(data)
+    assert scan.container_problems(path) == expected
+
+@pytest.mark.parametrize("name,data,expected", [
+    ("video.ts", b"\x47" + bytes(187), []),
+    ("video.ts", bytes(188), ["missing TS header"]),
+    ("video.avi", bytes(100), []),
+])
+def test_container_problems_magic(tmp_path, name, data, expected):
+    "Other containers only get a header check."
+    path = tmp_path / name
+    path.write_bytes(data)
+    assert scan.container_problems(path) == expected
+
+@pytest.mark.parametrize("duration,packets,tail,expected", [
+    (10.0, "8.5\n9.9\n", [], []),
+    (10.0, "5.0\n", [], ["declared duration 10.0s, but packets end at 5.0s"]),
+    (10.0, "", [], ["no packets before the declared end (10.0s)"]),
+    (10.0, "9.9\n", ["Invalid data found"], ["tail does not decode: Invalid data found"]),
+    (1e9, "1e9\n", [], ["duration 1000000000.0s does not match the file size (179 bytes)"]),
+])
+def test_source_problems(tmp_path, monkeypatch, duration, packets, tail, expected):
+    """The declared duration is checked against the size and the last packets,
+    and the tail is decoded."""
+    monkeypatch.setattr(scan, "MIN_BITRATE", 8)
+    monkeypatch.setattr(scan.ffmpeg, "duration", lambda config, path: duration)
+    monkeypatch.setattr(scan.ffmpeg, "probe", lambda args: packets)
+    monkeypatch.setattr(scan.ffmpeg, "errors", lambda args: tail)
+    path = tmp_path / "video.mkv"
+    path.write_bytes(matroska(INFO, CLUSTER, CUES))
+    assert scan.source_problems(Config.default(), path) == (expected, True)
+
+def test_source_problems_unreadable(tmp_path, monkeypatch):
+    "Probe failures are reported but not final."
+    def duration(config, path):
+        raise Error("no ffprobe")
+    monkeypatch.setattr(scan.ffmpeg, "duration", duration)
+    path = tmp_path / "video.mkv"
+    path.write_bytes(matroska(INFO, CLUSTER))
+    assert scan.source_problems(Config.default(), path) == (
+        ["missing cues (seeking index)", "unreadable duration: no ffprobe"],
+        False,
+    )
+
+def test_scan_sources_cache(tmp_path, monkeypatch):
+    "Results are cached by path, size and mtime, and sources still recording are skipped."
+    checked = []
+    def source_problems(config, path):
+        checked.append(path.name)
+        return (["broken"] if path.name == "b.mkv" else [], path.name != "c.mkv")
+    monkeypatch.setattr(scan, "source_problems", source_problems)
+    config = Config.default()._replace(cache_dir=tmp_path / "cache", jobs=2)
+    paths = [tmp_path / name for name in ("a.mkv", "b.mkv", "c.mkv", "live.mkv")]
+    for path in paths:
+        path.write_bytes(b"data")
+        if path.name != "live.mkv":
+            os.utime(path, (0, 0))
+
+    expected = [
+        scan.Report(paths[0], []),
+        scan.Report(paths[1], ["broken"]),
+        scan.Report(paths[2], []),
+    ]
+    assert scan.scan_sources(config, paths) == expected
+    assert scan.scan_sources(config, paths) == expected
+    assert sorted(checked) == ["a.mkv", "b.mkv", "c.mkv", "c.mkv"]
+
+    os.utime(paths[0], (0, 1))
+    scan.scan_sources(config, paths[:1])
+    assert checked[-1] == "a.mkv"
+
+def test_repair(tmp_path, monkeypatch):
+    "Repaired sources replace the original, which is kept."
+    monkeypatch.setattr(scan.ffmpeg, "remux",
+                        lambda src, outputs: outputs[0][0].write_bytes(b"fixed"))
+    path = tmp_path / "video.mkv"
+    path.write_bytes(b"broken")
+    assert scan.repair(path) == tmp_path / "video.mkv.broken"
+    assert path.read_bytes() == b"fixed"
+    assert (tmp_path / "video.mkv.broken").read_bytes() == b"broken"
+    with pytest.raises(Error, match="exists"):
+        scan.repair(path)
+
+def test_repair_failure(tmp_path, monkeypatch):
+    "Failed repairs leave the source alone."
+    def remux(src, outputs):
+        outputs[0][0].write_bytes(b"partial")
+        raise Error("failed")
+    monkeypatch.setattr(scan.ffmpeg, "remux", remux)
+    path = tmp_path / "video.mkv"
+    path.write_bytes(b"broken")
+    with pytest.raises(Error):
+        scan.repair(path)
+    assert [p.name for p in tmp_path.iterdir()] == ["video.mkv"]
@@ -0,0 +1,73 @@
+"Tests for the scheduler module."
+
+import os
+
+import pytest # type: ignore
+
+from mvcs import scheduler
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Clip, Job
+
+def make_job(tmp_path, name, clips, date="1970-01-01T00:00:00"):
+    "Get a job file config and job writing to its own directory."
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    config = Config.default()._replace(
+        job_path=tmp_path / f"{name}.yaml",
+        cache_dir=tmp_path / "cache",
+        keep_going=True,
+    )
+    job = Job.from_dict(config, {
+        "video-dir": str(tmp_path),
+        "output-dir": str(output_dir),
+        "videos": [{"date": date, "title": name, "clips": clips}],
+    })
+    return (config, job)
+
+@pytest.fixture
+def writes(tmp_path, monkeypatch):
+    "Record the clips written (with fake contents) instead of running ffmpeg."
+    written = []
+    def write(clip, config, src, dst, parts=()):
+        if not dst.exists():
+            written.append(clip.title)
+            dst.write_text(clip.title)
+    monkeypatch.setattr(Clip, "write", write)
+    monkeypatch.setattr(scheduler.timeline.ffmpeg, "duration", lambda config, src: 3600.0)
+    (tmp_path / "1970-01-01 00-00-00.mkv").touch()
+    return written
+
+def test_run_jobs_dedupe(tmp_path, writes):
+    "Identical source ranges are extracted once for every job that wants them."
+    jobs = [
+        make_job(tmp_path, "a", [{"time": "0 - 10", "title": "one"}, {"time": "10 - 20", "title": "two"}]),
+        make_job(tmp_path, "b", [{"time": "0 - 10", "title": "same"}]),
+    ]
+    scheduler.run_jobs(Config.default()._replace(jobs=4), jobs)
+    assert sorted(writes) == ["one", "two"]
+
+    (shared,) = (tmp_path / "b").iterdir()
+    assert shared.read_text() == "one"
+    assert (tmp_path / "a.manifest.json").is_file()
+    assert (tmp_path / "b.manifest.json").is_file()
+
+def test_run_jobs_failures(tmp_path, writes):
+    "Failures are reported per job."
+    jobs = [
+        make_job(tmp_path, "ok", [{"time": "0 - 10", "title": "one"}]),
+        make_job(tmp_path, "bad", [{"time": "0 - 10", "title": "lost"}], date="1970-01-02T00:00:00"),
+    ]
+    with pytest.raises(Error, match="1 of 2 jobs"):
+        scheduler.run_jobs(Config.default(), jobs)
+    assert writes == ["one"]
+    assert not (tmp_path / "ok.failures.json").exists()
+    assert (tmp_path / "bad.failures.json").is_file()
+
+def test_device_limits(tmp_path):
+    "Clips on the same disk wait for a free slot."
+    limits = scheduler.DeviceLimits(1)
+    slot = limits.semaphore(os.stat(tmp_path).st_dev)
+    with limits.hold(tmp_path, tmp_path / "missing", tmp_path):
+        assert not slot.acquire(blocking=False)
+    assert slot.acquire(blocking=False)
@@ -0,0 +1,145 @@
+"Tests for the serve module."
+
+import sys
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest # type: ignore
+
+from mvcs import serve
+from mvcs.config import Config
+from mvcs.error import Error
+from mvcs.job import Clip, Job
+
+CONTENT = bytes(range(256)) * 10
+
+@pytest.mark.parametrize("name,expected", [
+    ("clip.mkv", ("-f", "matroska")),
+    ("clip.MP4", ("-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof")),
+    ("clip.avi", None),
+])
+def test_pipe_args(name, expected):
+    "Only containers that can be streamed are written through a pipe."
+    assert serve.pipe_args(Path(name)) == expected
+
+@pytest.mark.parametrize("header,size,expected", [
+    ("bytes=0-99", 1000, (0, 100)),
+    ("bytes=100-", 1000, (100, 1000)),
+    ("bytes=100-", None, (100, None)),
+    ("bytes=900-2000", 1000, (900, 1000)),
+    ("bytes=-100", 1000, (900, 1000)),
+    ("bytes=-100", None, None),
+    ("bytes=5-1", 1000, None),
+    ("bytes=0-1,5-9", 1000, None),
+    ("items=0-1", 1000, None),
+])
+def test_parse_range(header, size, expected):
+    "Single byte ranges are parsed; others serve the whole clip."
+    assert serve.parse_range(header, size) == expected
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    "Ranges outside the clip are rejected."
+    with pytest.raises(ValueError):
+        serve.parse_range(header, 1000)
+
+def test_segment_cache():
+    "The least recently used segments are evicted."
+    cache = serve.SegmentCache(2)
+    cache.put(("a", 0), b"0")
+    cache.put(("a", 1), b"1")
+    assert cache.get(("a", 0)) == b"0"
+    cache.put(("a", 2), b"2")
+    assert cache.get(("a", 1)) is None
+    assert cache.get(("a", 0)) == b"0"
+
+@pytest.fixture
+def streams(monkeypatch):
+    "Serve one clip whose remux writes `CONTENT` in small segments."
+    remuxes = []
+    def command(served):
+        remuxes.append(served.name)
+        return ((sys.executable, "-c", f"import sys; sys.stdout.buffer.write({CONTENT!r})"), None)
+    monkeypatch.setattr(serve.Served, "command", command)
+    monkeypatch.setattr(serve, "SEGMENT_SIZE", 1000)
+    clip = Clip.from_dict({"time": "0 - 10", "title": "clip"})
+    result = serve.ClipStreams([serve.Served("clip.mkv", clip, None, ())], capacity=8)
+    result.remuxes = remuxes
+    return result
+
+def test_clip_streams_read(streams):
+    "Ranges are remuxed once and then served from the cached segments."
+    assert streams.size("clip.mkv") is None
+    assert b"".join(streams.read("clip.mkv", 500, 1500)) == CONTENT[500:1500]
+    assert streams.size("clip.mkv") is None
+    assert b"".join(streams.read("clip.mkv", 0)) == CONTENT
+    assert streams.size("clip.mkv") == len(CONTENT)
+    assert b"".join(streams.read("clip.mkv", 999, 2001)) == CONTENT[999:2001]
+    assert b"".join(streams.read("clip.mkv", 2500)) == CONTENT[2500:]
+    assert streams.measure("clip.mkv") == len(CONTENT)
+    assert streams.remuxes == ["clip.mkv", "clip.mkv"]
+
+def test_clip_streams_failure(monkeypatch):
+    "Failed remuxes are errors and leave no size."
+    monkeypatch.setattr(serve.Served, "command", lambda served: ((sys.executable, "-c", "exit(1)"), None))
+    clip = Clip.from_dict({"time": "0 - 10", "title": "clip"})
+    streams = serve.ClipStreams([serve.Served("clip.mkv", clip, None, ())])
+    with pytest.raises(Error):
+        streams.measure("clip.mkv")
+    assert streams.size("clip.mkv") is None
+
+def test_clip_server(streams):
+    "Clips are served whole or by byte range over HTTP."
+    server = serve.ClipServer(("127.0.0.1", 0), streams)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{base}/") as response:
+            assert b'href="/clips/clip.mkv"' in response.read()
+
+        request = urllib.request.Request(f"{base}/clips/clip.mkv", headers={"Range": "bytes=1000-1999"})
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 206
+            assert response.headers["Content-Range"] == f"bytes 1000-1999/{len(CONTENT)}"
+            assert response.headers["Content-Type"] == "video/x-matroska"
+            assert response.read() == CONTENT[1000:2000]
+
+        with urllib.request.urlopen(f"{base}/clips/clip.mkv") as response:
+            assert response.status == 200
+            assert response.headers["Content-Length"] == str(len(CONTENT))
+            assert response.read() == CONTENT
+
+        request = urllib.request.Request(f"{base}/clips/clip.mkv", headers={"Range": "bytes=9999-"})
+        with pytest.raises(urllib.error.HTTPError, match="416"):
+            urllib.request.urlopen(request)
+        with pytest.raises(urllib.error.HTTPError, match="404"):
+            urllib.request.urlopen(f"{base}/clips/other.mkv")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def test_served_clips(tmp_path):
+    "Clips are served under their output names, in a format that can be piped."
+    config = Config.default()._replace(output_ext="avi", cache_dir=tmp_path / "cache")
+    job = Job.from_dict(config, {
+        "video-dir": str(tmp_path),
+        "output-dir": str(tmp_path),
+        "videos": [{
+            "date": "1970-01-01T00:00:00",
+            "title": "video",
+            "clips": [{"time": "1:00 - 1:30", "title": "clip"}],
+        }],
+    })
+    (served,) = serve.served_clips(config, job)
+    assert served.name == "1970-01-01 00-00-00 - t+0h01m00s - video - clip.mkv"
+    assert served.src == tmp_path / "1970-01-01 00-00-00.mkv"
+
+    (cmd, script) = served.command()
+    assert script is None
+    assert cmd[cmd.index("-ss") + 1] == "60.0"
+    assert cmd[cmd.index("-t") + 1] == "30.0"
+    assert cmd[-3:] == ("-f", "matroska", "pipe:1")
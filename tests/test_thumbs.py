@@ -0,0 +1,50 @@
+"Tests for the thumbs module."
+
+from pathlib import Path
+
+import pytest # type: ignore
+
+from mvcs.job import Clip
+from mvcs.thumbs import plan_passes, poster_path, sheet_path, thumbnail_args
+
+@pytest.mark.parametrize("dst,poster,sheet", [
+    (Path("out/a - b.mkv"), Path("out/a - b.jpg"), Path("out/a - b.sheet.jpg")),
+    (Path("out/v1.0 - b.mp4"), Path("out/v1.0 - b.jpg"), Path("out/v1.0 - b.sheet.jpg")),
+])
+def test_thumbnail_paths(dst, poster, sheet):
+    "Thumbnails are written next to the clip output."
+    assert poster_path(dst) == poster
+    assert sheet_path(dst) == sheet
+
+def test_plan_passes():
+    "Nearby clips share a decode pass and distant clips get their own seek."
+    clips = [
+        (Clip.from_dict({"time": "10:00 - 10:16", "title": "c"}), Path("c.mkv")),
+        (Clip.from_dict({"time": "1:00 - 2:00", "title": "a"}), Path("a.mkv")),
+        (Clip.from_dict({"time": "2:20 - 2:40", "title": "b"}), Path("b.mkv")),
+    ]
+    passes = plan_passes(clips)
+    assert [[dst for (_, dst) in clips_pass] for clips_pass in passes] == [
+        [Path("a.mkv"), Path("b.mkv")],
+        [Path("c.mkv")],
+    ]
+
+def test_thumbnail_args():
+    "The clips of a pass share one keyframe-only input limited to their span."
+    clips = [
+        (Clip.from_dict({"time": "1:00 - 2:00", "title": "a"}), Path("a.mkv")),
+        (Clip.from_dict({"time": "2:20 - 2:36", "title": "b"}), Path("b.mkv")),
+    ]
+    args = thumbnail_args(Path("src.mkv"), clips)
+
+    assert args.count("-i") == 1
+    assert args[args.index("-skip_frame") + 1] == "nokey"
+    assert args[args.index("-ss") + 1] == "60.0"
+    assert args[args.index("-t") + 1] == "96.0"
+    # Two images per clip, with times relative to the input start
+    outputs = [arg for arg in args if arg.endswith(".jpg")]
+    assert outputs == ["a.jpg", "a.sheet.jpg", "b.jpg", "b.sheet.jpg"]
+    filters = [args[i + 1] for (i, arg) in enumerate(args) if arg == "-vf"]
+    assert filters[0].startswith("select='gte(t,0.0)'")
+    assert "between(t,80.0,96.0)" in filters[3]
+    assert "tile=4x4" in filters[3]
@@ -0,0 +1,102 @@
+"Tests for the timeline module."
+
+import datetime
+from pathlib import Path
+
+import pytest # type: ignore
+
+from mvcs import timeline
+from mvcs.config import Config
+from mvcs.timeline import Timeline
+
+T0 = datetime.datetime(2020, 1, 1, 12)
+
+def at(seconds: float) -> datetime.datetime:
+    "Get the wall-clock time some seconds after the first recording starts."
+    return T0 + datetime.timedelta(seconds=seconds)
+
+def make_timeline() -> Timeline:
+    "Get recordings split at 100 s, with a gap, an overlap, and one still recording."
+    return Timeline.from_lengths({
+        at(0): (Path("a.mkv"), datetime.timedelta(seconds=100)),
+        at(100): (Path("b.mkv"), datetime.timedelta(seconds=100)),
+        at(300): (Path("c.mkv"), datetime.timedelta(seconds=60)),
+        at(350): (Path("d.mkv"), None),
+    })
+
+def pieces(parts):
+    "Summarize parts as `(name, start, end)` in seconds."
+    return [
+        (part.recording.path.name, part.start.total_seconds(), part.end.total_seconds())
+        for part in parts
+    ]
+
+@pytest.mark.parametrize("start,end,expected", [
+    (10, 20, [("a.mkv", 10, 20)]),
+    # Split recordings
+    (90, 130, [("a.mkv", 90, 100), ("b.mkv", 0, 30)]),
+    # Gaps are skipped
+    (190, 310, [("b.mkv", 90, 100), ("c.mkv", 0, 10)]),
+    (210, 290, []),
+    # Overlapping recordings hand over where the next one starts
+    (340, 360, [("c.mkv", 40, 50), ("d.mkv", 0, 10)]),
+    # The last recording without a known length is open
+    (1000, 1010, [("d.mkv", 650, 660)]),
+    (-20, -10, []),
+])
+def test_covering(start, end, expected):
+    "Wall-clock ranges map to consecutive pieces of the recordings covering them."
+    assert pieces(make_timeline().covering(at(start), at(end))) == expected
+
+def test_scan(tmp_path, monkeypatch):
+    "Recordings are found by name, and unreadable ones end where the next starts."
+    for name in ("2020-01-01 12-00-00.mkv", "2020-01-01 12-01-00.mkv", "notes.txt"):
+        (tmp_path / name).touch()
+    def duration(config, src):
+        if src.name == "2020-01-01 12-00-00.mkv":
+            raise timeline.Error("cannot read duration")
+        return 30.0
+    monkeypatch.setattr(timeline.ffmpeg, "duration", duration)
+    index = Timeline.scan(Config.default(), tmp_path)
+    assert [(r.path.name, r.start, r.end) for r in index.recordings] == [
+        ("2020-01-01 12-00-00.mkv", at(0), at(60)),
+        ("2020-01-01 12-01-00.mkv", at(60), at(90)),
+    ]
+
+def test_scan_nearby(tmp_path, monkeypatch):
+    "Scans near a range only probe the recordings that can cover it."
+    for minute in range(0, 60, 10):
+        (tmp_path / f"2020-01-01 12-{minute:02}-00.mkv").touch()
+    probed = []
+    def duration(config, src):
+        probed.append(src.name)
+        return 600.0
+    monkeypatch.setattr(timeline.ffmpeg, "duration", duration)
+    index = Timeline.scan(Config.default(), tmp_path, at(1500), at(1900))
+    assert sorted(probed) == [r.path.name for r in index.recordings] == [
+        "2020-01-01 12-10-00.mkv",
+        "2020-01-01 12-20-00.mkv",
+        "2020-01-01 12-30-00.mkv",
+    ]
+    assert pieces(index.covering(at(1500), at(1900))) == [
+        ("2020-01-01 12-20-00.mkv", 300, 600),
+        ("2020-01-01 12-30-00.mkv", 0, 100),
+    ]
+
+def test_write_parts(tmp_path, monkeypatch):
+    "Pieces are joined by stream copy through a concat list."
+    lists = []
+    def run(args):
+        lists.append(Path(args[args.index("-i") + 1]).read_text(encoding="utf-8"))
+        assert args[-1] == str(tmp_path / "clip.mkv")
+    monkeypatch.setattr(timeline.ffmpeg, "run", run)
+    index = Timeline.from_lengths({
+        at(0): (tmp_path / "a.mkv", datetime.timedelta(seconds=100)),
+        at(100): (tmp_path / "it's.mkv", datetime.timedelta(seconds=100)),
+    })
+    timeline.write_parts(index.covering(at(90), at(130)), [(tmp_path / "clip.mkv", {})])
+    assert lists == [
+        "ffconcat version 1.0\n"
+        f"file '{tmp_path}/a.mkv'\ninpoint 90.0\noutpoint 100.0\n"
+        f"file '{tmp_path}/it'\\''s.mkv'\ninpoint 0.0\noutpoint 30.0\n"
+    ]
@@ -0,0 +1,64 @@
+"Tests for the trace module."
+
+import json
+import threading
+
+import pytest # type: ignore
+
+from mvcs import trace
+
+def test_span_disabled():
+    "Spans are shared no-ops while tracing is disabled."
+    assert not trace.enabled()
+    assert trace.span("a") is trace.span("b", x=1)
+    with trace.span("a"):
+        pass
+    trace.record("a", trace.now())
+    assert not trace.enabled()
+
+def inner_span():
+    "Record an empty span."
+    with trace.span("inner"):
+        pass
+
+def test_trace_events(tmp_path):
+    "Spans are written as complete Chrome trace events with their thread."
+    path = tmp_path / "trace.json"
+    trace.start()
+    try:
+        with trace.span("outer", clip="title"):
+            worker = threading.Thread(target=inner_span)
+            worker.start()
+            worker.join()
+    finally:
+        trace.stop(path, None)
+    assert not trace.enabled()
+
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["inner", "outer"]
+    (inner, outer) = events
+    assert all(event["ph"] == "X" for event in events)
+    assert outer["args"] == {"clip": "title"}
+    assert inner["tid"] != outer["tid"]
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+
+def test_trace_exception(tmp_path):
+    "Spans are recorded even when the traced code raises."
+    path = tmp_path / "trace.json"
+    trace.start()
+    try:
+        with pytest.raises(ValueError), trace.span("failing"):
+            raise ValueError()
+    finally:
+        trace.stop(path, None)
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["failing"]
+
+def test_trace_profile(tmp_path):
+    "A cProfile dump is written when profiling."
+    path = tmp_path / "run.prof"
+    trace.start(profile=True)
+    sum(range(1000))
+    trace.stop(None, path)
+    assert path.stat().st_size > 0